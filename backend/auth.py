@@ -0,0 +1,159 @@
+"""
+Stateless signed access tokens
+Access tokens are HMAC-signed JWTs carrying the user id and role, so protected
+endpoints verify them in-process without a database lookup.
+"""
+
+import os
+import secrets
+import time
+import uuid
+import jwt
+from fastapi import Depends, HTTPException, Request
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from vercel_compat import is_serverless
+
+# SECRET_KEY is the name the deployment guides used before JWT_SECRET
+JWT_SECRET = os.getenv("JWT_SECRET") or os.getenv("SECRET_KEY")
+if not JWT_SECRET:
+    # Tokens signed with a random secret do not survive restarts and are not
+    # shared between workers or serverless instances, which would then reject
+    # each other's tokens; only a single local process may run without one
+    if is_serverless() or int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+        raise RuntimeError("JWT_SECRET must be set when running serverless or with several workers")
+    JWT_SECRET = secrets.token_urlsafe(32)
+    print("⚠️ JWT_SECRET not set, using a random per-process secret")
+JWT_ALGORITHM = "HS256"
+ACCESS_TOKEN_TTL_SECONDS = int(os.getenv("ACCESS_TOKEN_TTL_SECONDS", "900"))
+REFRESH_TOKEN_TTL_SECONDS = int(os.getenv("REFRESH_TOKEN_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# user_id -> time of revocation; tokens issued before that moment are rejected.
+# Re-enabling a user keeps the entry, so only tokens issued after the
+# revocation pass. Entries only need to outlive the longest token lifetime. This set is
+# per-process: other workers pick up a disabled account at the next refresh,
+# which re-checks the database, i.e. within ACCESS_TOKEN_TTL_SECONDS.
+_revoked = {}
+
+bearer_scheme = HTTPBearer(auto_error=False)
+
+
+def _create_token(user_id, token_type, ttl, claims=None):
+    now = int(time.time())
+    payload = {
+        "sub": str(user_id),
+        "type": token_type,
+        "iat": now,
+        "exp": now + ttl,
+        "jti": uuid.uuid4().hex,
+    }
+    if claims:
+        payload.update(claims)
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+
+def create_access_token(user_id, role, approved=True):
+    """Create a short-lived access token carrying the user id, role and approval state"""
+    return _create_token(user_id, "access", ACCESS_TOKEN_TTL_SECONDS, {"role": role, "approved": approved})
+
+
+def create_refresh_token(user_id):
+    """Create a long-lived refresh token used to obtain new access tokens"""
+    return _create_token(user_id, "refresh", REFRESH_TOKEN_TTL_SECONDS)
+
+
+def revoke_user(user_id):
+    """Reject every token issued to user_id until now"""
+    now = time.time()
+    # Drop entries older than any token that could still be valid
+    horizon = now - max(ACCESS_TOKEN_TTL_SECONDS, REFRESH_TOKEN_TTL_SECONDS)
+    for stale in [uid for uid, revoked_at in _revoked.items() if revoked_at < horizon]:
+        del _revoked[stale]
+    _revoked[str(user_id)] = now
+
+
+def _is_revoked(payload):
+    revoked_at = _revoked.get(payload["sub"])
+    return revoked_at is not None and payload["iat"] <= revoked_at
+
+
+def is_still_valid(payload):
+    """Whether already-decoded claims have neither expired nor been revoked since"""
+    return time.time() < payload["exp"] and not _is_revoked(payload)
+
+
+def decode_token(token, expected_type="access"):
+    """Verify a token's signature, expiry, type and revocation; return its claims"""
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(
+            status_code=401,
+            detail="Token expired",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    except jwt.InvalidTokenError:
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid token",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+    if payload.get("type") != expected_type:
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid token type",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+    if _is_revoked(payload):
+        raise HTTPException(
+            status_code=401,
+            detail="Token has been revoked",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    return payload
+
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
+    """FastAPI dependency returning the verified access token claims"""
+    if credentials is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    return decode_token(credentials.credentials)
+
+
+async def get_stream_user(request: Request, credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
+    """
+    get_current_user that also accepts an access_token query parameter, for
+    clients such as EventSource that cannot set headers
+    """
+    if credentials is None:
+        token = request.query_params.get("access_token")
+        if token:
+            return decode_token(token)
+    return await get_current_user(credentials)
+
+
+def check_roles(current_user, roles):
+    """Raise 403 unless the claims belong to an approved user with one of roles"""
+    if current_user.get("role") not in roles:
+        raise HTTPException(
+            status_code=403,
+            detail="Not enough permissions"
+        )
+    if not current_user.get("approved", True):
+        raise HTTPException(
+            status_code=403,
+            detail="Account pending approval"
+        )
+
+
+def require_roles(*roles):
+    """FastAPI dependency factory that only admits the given (approved) roles"""
+    async def dependency(current_user: dict = Depends(get_current_user)):
+        check_roles(current_user, roles)
+        return current_user
+    return dependency
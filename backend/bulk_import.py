@@ -0,0 +1,392 @@
+"""
+Bulk import of historical submissions
+Rows arrive as NDJSON (one JSON object per line), either as the raw request
+body or as the "submissions" part of a multipart form whose optional "images"
+part is a ZIP archive of the photos the rows refer to. Rows are validated one
+by one and written with unordered insert_many batches; every rejected row is
+reported with its line number instead of failing the whole import.
+"""
+
+import json
+import mimetypes
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import datetime, timezone
+from bson import ObjectId
+from fastapi import HTTPException
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+import database
+import features
+import stats
+import storage
+import thumbnails
+import uploads
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+MAX_IMPORT_LINE_BYTES = 64 * 1024
+MAX_IMPORT_BYTES = int(os.getenv("MAX_IMPORT_BYTES", str(2 * 1024 * 1024 * 1024)))
+# Rows beyond this many errors are counted but not listed
+MAX_REPORTED_ERRORS = 1000
+READ_CHUNK_SIZE = 64 * 1024
+
+NDJSON_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl", "application/jsonlines"}
+
+
+class ImportReport:
+    """Counts and per-row errors of one import"""
+
+    def __init__(self):
+        self.rows = 0
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, line, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "errors": errors})
+
+    def as_dict(self):
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+def _validation_errors(error):
+    return [
+        {"field": ".".join(str(part) for part in item["loc"]) or None, "message": item["msg"]}
+        for item in error.errors(include_url=False, include_context=False)
+    ]
+
+
+async def iter_lines(chunks):
+    """Yield (line number, bytes) for each line of an async byte stream"""
+    buffer = bytearray()
+    number = 0
+    async for chunk in chunks:
+        buffer += chunk
+        while True:
+            end = buffer.find(b"\n")
+            if end < 0:
+                break
+            number += 1
+            yield number, bytes(buffer[:end])
+            del buffer[:end + 1]
+        if len(buffer) > MAX_IMPORT_LINE_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Line {number + 1} exceeds {MAX_IMPORT_LINE_BYTES} bytes"
+            )
+    if buffer.strip():
+        yield number + 1, bytes(buffer)
+
+
+async def iter_request_body(request):
+    """The request body with a size cap"""
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > MAX_IMPORT_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail="Import too large"
+            )
+        yield chunk
+
+
+async def iter_file(path):
+    """A local file as an async byte stream"""
+    with open(path, "rb") as source:
+        while True:
+            chunk = await run_in_threadpool(source.read, READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+async def spool_multipart(request, directory):
+    """
+    Save the "submissions" and "images" parts of a multipart import to files
+    Returns their paths (None for a missing part); a ZIP archive needs
+    random access, so neither part can be processed while it streams in
+    """
+    paths = {"submissions": None, "images": None}
+    target = None
+    written = 0
+    try:
+        async for event in uploads.iter_multipart(request, MAX_IMPORT_BYTES):
+            kind = event[0]
+            if kind == "part":
+                name = event[1]
+                if name in paths and paths[name] is None:
+                    paths[name] = os.path.join(directory, name)
+                    target = open(paths[name], "wb")
+            elif kind == "data":
+                if target is not None:
+                    # What lands in the (often small) temp directory, chunked or not
+                    written += len(event[1])
+                    if written > MAX_IMPORT_BYTES:
+                        raise HTTPException(
+                            status_code=413,
+                            detail="Import too large"
+                        )
+                    await run_in_threadpool(target.write, event[1])
+            elif kind == "end":
+                if target is not None:
+                    target.close()
+                    target = None
+        if target is not None:
+            raise HTTPException(
+                status_code=400,
+                detail="Incomplete upload"
+            )
+    finally:
+        if target is not None:
+            target.close()
+    if paths["submissions"] is None:
+        raise HTTPException(
+            status_code=400,
+            detail="A 'submissions' NDJSON part is required"
+        )
+    return paths["submissions"], paths["images"]
+
+
+class PatientResolver:
+    """Looks up the patients rows refer to, one query per batch"""
+
+    def __init__(self):
+        self._by_email = {}
+        self._by_id = {}
+
+    def _remember(self, user):
+        patient = {
+            "patient_id": str(user["_id"]),
+            "patient_name": user["full_name"],
+            "patient_email": user["email"],
+            "patient_age": user.get("age"),
+        }
+        self._by_email[user["email"]] = patient
+        self._by_id[patient["patient_id"]] = patient
+
+    async def load(self, rows):
+        emails = {row.patient_email for row in rows if row.patient_email and row.patient_email not in self._by_email}
+        ids = {
+            ObjectId(row.patient_id) for row in rows
+            if row.patient_id and row.patient_id not in self._by_id and ObjectId.is_valid(row.patient_id)
+        }
+        if not emails and not ids:
+            return
+        query = {"role": "patient", "$or": []}
+        if emails:
+            query["$or"].append({"email": {"$in": list(emails)}})
+        if ids:
+            query["$or"].append({"_id": {"$in": list(ids)}})
+        projection = {"full_name": 1, "email": 1, "age": 1}
+        async for user in database.get_collection("users").find(query, projection):
+            self._remember(user)
+
+    def get(self, row):
+        if row.patient_id:
+            return self._by_id.get(row.patient_id)
+        return self._by_email.get(row.patient_email)
+
+
+async def store_archive_image(archive, member_name):
+    """Copy one image from the archive into storage; returns (blob name, size)"""
+    content_type = mimetypes.guess_type(member_name)[0]
+    extension = uploads.ALLOWED_IMAGE_TYPES.get(content_type)
+    if extension is None:
+        raise ValueError("Unsupported image type")
+    try:
+        info = archive.getinfo(member_name)
+    except KeyError:
+        raise ValueError("Image not found in the archive")
+    if info.file_size > uploads.MAX_IMAGE_BYTES:
+        raise ValueError("Image is too large")
+
+    upload = await storage.get_backend().open_upload(extension, content_type)
+    writer = uploads.ChunkedUploadWriter(upload, uploads.MAX_IMAGE_BYTES)
+    try:
+        with archive.open(info) as member:
+            while True:
+                chunk = await run_in_threadpool(member.read, uploads.UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                await writer.write(chunk)
+        await writer.close()
+    except BaseException:
+        await writer.discard()
+        raise
+    image = {
+        "upload": upload,
+        "extension": extension,
+        "content_type": content_type,
+        "size": writer.size,
+        "sha256": writer.digest.hexdigest(),
+    }
+    return await storage.commit_upload(image), writer.size
+
+
+async def _write_batch(batch, patients, archive, report):
+    """Build and insert the documents of a batch of validated rows"""
+    from pymongo.errors import BulkWriteError
+
+    await patients.load([row for _, row in batch])
+    now = datetime.now(timezone.utc)
+    lines = []
+    docs = []
+    failed = {}
+    try:
+        for line, row in batch:
+            patient = patients.get(row)
+            if patient is None:
+                report.error(line, [{"field": "patient", "message": "Patient not found"}])
+                continue
+            doc = {
+                # Assigned here so unsaved rows can be told apart after a failure
+                "_id": ObjectId(),
+                **patient,
+                **row.model_dump(include={
+                    "blood_glucose", "hba1c", "insulin_level", "diabetes_type", "symptoms", "medications", "notes",
+                }),
+                "created_at": row.created_at or now,
+                "updated_at": now,
+            }
+            if row.external_id is not None:
+                doc["external_id"] = row.external_id
+            if row.tongue_image:
+                if archive is None:
+                    report.error(line, [{"field": "tongue_image", "message": "No image archive was uploaded"}])
+                    continue
+                try:
+                    image_name, size = await store_archive_image(archive, row.tongue_image)
+                except (ValueError, HTTPException, zipfile.BadZipFile) as e:
+                    message = e.detail if isinstance(e, HTTPException) else str(e)
+                    report.error(line, [{"field": "tongue_image", "message": message}])
+                    continue
+                doc["tongue_image_filename"] = image_name
+                doc["tongue_image_url"] = f"/images/{image_name}"
+                doc["tongue_image_size"] = size
+            lines.append(line)
+            docs.append(doc)
+        if not docs:
+            return
+
+        try:
+            await database.get_collection("submissions").insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                failed[write_error["index"]] = (
+                    "Duplicate external_id" if write_error.get("code") == 11000 else write_error.get("errmsg", "Write failed")
+                )
+    except BaseException:
+        # A database error or a client disconnect interrupted the batch: the
+        # image references of rows that were not saved would never be released
+        await _release_unsaved(docs)
+        raise
+
+    saved = []
+    for index, doc in enumerate(docs):
+        if index in failed:
+            report.error(lines[index], [{"field": None, "message": failed[index]}])
+            if "tongue_image_filename" in doc:
+                await storage.release(doc["tongue_image_filename"])
+        else:
+            saved.append(doc)
+    report.inserted += len(saved)
+    if saved:
+        await stats.record_write("submissions", total_submissions=len(saved))
+        await _enqueue_followups(saved)
+
+
+async def _release_unsaved(docs):
+    """Release the image references of documents that are not in the database"""
+    with_images = [doc for doc in docs if "tongue_image_filename" in doc]
+    if not with_images:
+        return
+    try:
+        cursor = database.get_collection("submissions").find(
+            {"_id": {"$in": [doc["_id"] for doc in with_images]}}, {"_id": 1}
+        )
+        saved = {doc["_id"] async for doc in cursor}
+        for doc in with_images:
+            if doc["_id"] not in saved:
+                await storage.release(doc["tongue_image_filename"])
+    except Exception as e:
+        # Keeping a reference only delays garbage collection; dropping the
+        # reference of a saved row would lose its image
+        print(f"✗ Could not release the images of an interrupted import batch: {e}")
+
+
+async def _enqueue_followups(docs):
+    """Queue thumbnails and features of imported images, as create_submission does"""
+    try:
+        for doc in docs:
+            if "tongue_image_filename" in doc:
+                await thumbnails.enqueue(doc["tongue_image_filename"])
+                await features.enqueue(doc["_id"], doc["tongue_image_filename"])
+    except Exception as e:
+        # Thumbnails render lazily and features.py backfills features
+        print(f"✗ Could not queue follow-up jobs for imported submissions: {e}")
+
+
+async def import_submissions(lines, model, archive=None):
+    """Validate and insert NDJSON rows from an async (line number, bytes) iterator"""
+    report = ImportReport()
+    patients = PatientResolver()
+    batch = []
+    async for line, raw in lines:
+        if not raw.strip():
+            continue
+        report.rows += 1
+        try:
+            row = model.model_validate(json.loads(raw))
+        except ValidationError as e:
+            report.error(line, _validation_errors(e))
+            continue
+        except ValueError as e:
+            report.error(line, [{"field": None, "message": f"Invalid JSON: {e}"}])
+            continue
+        batch.append((line, row))
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await _write_batch(batch, patients, archive, report)
+            batch = []
+    if batch:
+        await _write_batch(batch, patients, archive, report)
+    return report
+
+
+async def import_request(request, model):
+    """Run an import from an NDJSON body or a multipart form with an image archive"""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in NDJSON_TYPES:
+        report = await import_submissions(iter_lines(iter_request_body(request)), model)
+        return report.as_dict()
+
+    directory = await run_in_threadpool(tempfile.mkdtemp, prefix="soin-import-")
+    try:
+        submissions_path, images_path = await spool_multipart(request, directory)
+        archive = None
+        if images_path is not None:
+            try:
+                archive = await run_in_threadpool(zipfile.ZipFile, images_path)
+            except zipfile.BadZipFile:
+                raise HTTPException(
+                    status_code=400,
+                    detail="The images part is not a valid ZIP archive"
+                )
+        try:
+            report = await import_submissions(iter_lines(iter_file(submissions_path)), model, archive)
+        finally:
+            if archive is not None:
+                archive.close()
+        return report.as_dict()
+    finally:
+        await run_in_threadpool(shutil.rmtree, directory, True)
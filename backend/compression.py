@@ -0,0 +1,98 @@
+"""
+Compression of large JSON responses
+Complete JSON bodies of at least COMPRESSION_MIN_BYTES are compressed with
+Brotli or gzip, whichever the client prefers. Streaming responses (exports,
+event streams) and images are passed through untouched.
+"""
+
+import gzip
+import os
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    # gzip only
+    brotli = None
+
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+# Qualities above ~5 cost far more CPU for little gain on JSON
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+COMPRESSIBLE_TYPES = ("application/json",)
+
+
+def choose_encoding(accept_encoding):
+    """Preferred supported encoding from an Accept-Encoding header, or None"""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        accepted[coding.strip().lower()] = weight
+
+    def quality(coding):
+        return accepted.get(coding, accepted.get("*", 0.0))
+
+    # max() keeps the first of equal qualities, i.e. the server's preference
+    best = max(["br", "gzip"] if brotli is not None else ["gzip"], key=quality)
+    return best if quality(best) > 0 else None
+
+
+def compress(encoding, body):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing single-message JSON responses"""
+
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                # Held back until the body shows whether to compress
+                start = message
+                return
+            if start is None:
+                await send(message)
+                return
+            held, start = start, None
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                body = message.get("body", b"")
+                headers = MutableHeaders(raw=held["headers"])
+                content_type = headers.get("content-type", "").split(";")[0].strip()
+                if (
+                    len(body) >= self.minimum_size
+                    and content_type in COMPRESSIBLE_TYPES
+                    and "content-encoding" not in headers
+                ):
+                    body = compress(encoding, body)
+                    headers["content-encoding"] = encoding
+                    headers["content-length"] = str(len(body))
+                    headers.add_vary_header("Accept-Encoding")
+                    message = {**message, "body": body}
+            await send(held)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Create an admin account
+Public registration only creates patients and doctors, so admins are added
+from a shell with access to the database:
+
+    python create_admin.py --email admin@example.com --name "Clinic Admin"
+"""
+
+import argparse
+import asyncio
+import getpass
+import sys
+from datetime import datetime, timezone
+import database
+import passwords
+import stats
+
+
+async def create_admin(email, full_name, password, age=None):
+    """Insert an approved admin user; returns its id"""
+    users = database.get_collection("users")
+    if not await database.ensure_indexes("users") and await users.find_one({"email": email}, {"_id": 1}):
+        raise ValueError(f"{email} is already registered")
+    now = datetime.now(timezone.utc)
+    result = await users.insert_one({
+        "full_name": full_name,
+        "email": email,
+        "password": await passwords.hash_password(password),
+        "age": age,
+        "role": "admin",
+        "approval_status": "approved",
+        "created_at": now,
+        "updated_at": now,
+        "is_active": True
+    })
+    await stats.record_write("users", total_admins=1)
+    return result.inserted_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create an admin account")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--name", required=True)
+    parser.add_argument("--age", type=int)
+    args = parser.parse_args()
+    password = getpass.getpass("Password: ")
+    if not password or password != getpass.getpass("Repeat password: "):
+        print("✗ Passwords are empty or do not match")
+        return 1
+
+    async def run():
+        try:
+            return await create_admin(args.email.strip(), args.name, password, args.age)
+        finally:
+            database.close()
+
+    try:
+        admin_id = asyncio.run(run())
+    except Exception as e:
+        if database.is_duplicate_key_error(e) or isinstance(e, ValueError):
+            print(f"✗ {args.email} is already registered")
+            return 1
+        raise
+    print(f"✓ Admin {args.email} created ({admin_id})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+"""
+Async MongoDB data access layer shared by all API handlers
+Uses motor so database round trips never block the event loop
+
+The client is created lazily on first use and then reused, so importing this
+module (e.g. on a serverless cold start) costs no connection setup.
+"""
+
+import asyncio
+import os
+import time
+import metrics
+from vercel_compat import is_serverless
+
+# Connection settings (all overridable through environment variables)
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.getenv("DB_NAME", "soin_healthcare")
+# Serverless instances handle one request at a time, so keep their pools small
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "10" if is_serverless() else "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "10000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+
+# Index definitions per collection: (keys, options)
+INDEXES = {
+    "users": [
+        ([("email", 1)], {"unique": True, "name": "email_unique"}),
+        ([("role", 1), ("is_active", 1)], {"name": "role_active"}),
+        ([("role", 1), ("approval_status", 1), ("created_at", 1)], {"name": "role_approval_created"}),
+    ],
+    "submissions": [
+        ([("patient_id", 1), ("created_at", -1), ("_id", -1)], {"name": "patient_created"}),
+        ([("created_at", -1), ("_id", -1)], {"name": "created"}),
+        ([("diabetes_type", 1), ("created_at", -1), ("_id", -1)], {"name": "diabetes_type_created"}),
+        ([("updated_at", 1)], {"name": "updated"}),
+        # Search filters (search.py): lab ranges within a type, symptoms and
+        # medications (multikey) and words in the notes
+        ([("diabetes_type", 1), ("blood_glucose", 1)], {"name": "diabetes_type_glucose"}),
+        ([("diabetes_type", 1), ("hba1c", 1)], {"name": "diabetes_type_hba1c"}),
+        ([("symptoms", 1), ("created_at", -1), ("_id", -1)], {"name": "symptoms_created"}),
+        ([("medications", 1), ("created_at", -1), ("_id", -1)], {"name": "medications_created"}),
+        ([("notes", "text")], {"default_language": "english", "name": "notes_text"}),
+        # Re-running a bulk import skips rows that were already imported
+        ([("external_id", 1)], {
+            "unique": True,
+            "partialFilterExpression": {"external_id": {"$exists": True}},
+            "name": "external_id_unique",
+        }),
+    ],
+    "image_blobs": [
+        ([("refcount", 1), ("updated_at", 1)], {"name": "refcount_updated"}),
+    ],
+    "jobs": [
+        ([("status", 1), ("run_at", 1)], {"name": "status_run_at"}),
+        ([("key", 1)], {
+            "unique": True,
+            "partialFilterExpression": {"key": {"$exists": True}},
+            "name": "key_unique",
+        }),
+        ([("expires_at", 1)], {"expireAfterSeconds": 0, "name": "expires_ttl"}),
+    ],
+    "rate_limits": [
+        ([("expires_at", 1)], {"expireAfterSeconds": 0, "name": "expires_ttl"}),
+    ],
+}
+
+# A collection whose index build failed is retried after this many seconds
+INDEX_RETRY_SECONDS = int(os.getenv("INDEX_RETRY_SECONDS", "300"))
+
+_client = None
+_db = None
+# Collections whose indexes are in place
+_indexes_ready = set()
+# collection -> monotonic time of its last failed index build
+_index_failures = {}
+# collection -> background index build started by get_collection()
+_index_tasks = {}
+
+
+def get_client():
+    """Return the shared motor client, creating it on first use"""
+    global _client
+    if _client is None:
+        # Deferred import: pymongo/motor are only loaded when the DB is needed
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        _client = AsyncIOMotorClient(
+            MONGO_URL,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            event_listeners=metrics.mongo_listeners(),
+        )
+    return _client
+
+
+def get_db():
+    """Return the shared async database handle"""
+    global _db
+    if _db is None:
+        _db = get_client()[DB_NAME]
+    return _db
+
+
+def get_collection(name):
+    """
+    Return an async collection handle by name
+    The first use of a collection in a process starts building its indexes in
+    the background, so entrypoints without a startup hook (Mangum runs the
+    app with lifespan="off") get them too.
+    """
+    if name in INDEXES and name not in _indexes_ready:
+        _schedule_indexes(name)
+    return get_db()[name]
+
+
+def _schedule_indexes(name):
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # Synchronous callers; the next use inside the event loop schedules it
+        return
+    task = _index_tasks.get(name)
+    if task is not None and not task.done() and task.get_loop() is loop:
+        return
+    if time.monotonic() - _index_failures.get(name, -INDEX_RETRY_SECONDS) < INDEX_RETRY_SECONDS:
+        return
+    _index_tasks[name] = loop.create_task(ensure_indexes(name))
+
+
+async def _create_index(collection_name, keys, options):
+    try:
+        await get_db()[collection_name].create_index(keys, **options)
+        return True
+    except Exception as e:
+        print(f"✗ Index {options['name']} on {collection_name} could not be built: {e}")
+        if collection_name == "users" and is_duplicate_key_error(e):
+            print("  Existing accounts share an email; run dedupe_users.py to resolve them")
+        return False
+
+
+async def ensure_indexes(*collections):
+    """
+    Create the INDEXES of the given collections (default: all), idempotently
+    Never raises: a failed index is logged and its collection retried after
+    INDEX_RETRY_SECONDS. Returns True when every index is in place.
+    """
+    now = time.monotonic()
+    pending = [
+        name for name in (collections or INDEXES)
+        if name not in _indexes_ready and now - _index_failures.get(name, -INDEX_RETRY_SECONDS) >= INDEX_RETRY_SECONDS
+    ]
+    if not pending:
+        return all(name in _indexes_ready for name in (collections or INDEXES))
+    # The builds are independent, so they run concurrently
+    results = await asyncio.gather(*[
+        _create_index(name, keys, options) for name in pending for keys, options in INDEXES[name]
+    ])
+    position = 0
+    for name in pending:
+        built = results[position:position + len(INDEXES[name])]
+        position += len(INDEXES[name])
+        if all(built):
+            _indexes_ready.add(name)
+            _index_failures.pop(name, None)
+        else:
+            _index_failures[name] = now
+    return all(name in _indexes_ready for name in (collections or INDEXES))
+
+
+def is_duplicate_key_error(error):
+    """True if a pymongo error was caused by a unique index violation"""
+    return getattr(error, "code", None) == 11000
+
+
+async def ping():
+    """Check that MongoDB is reachable without blocking the event loop"""
+    try:
+        await get_client().admin.command("ping")
+        return True
+    except Exception:
+        return False
+
+
+def close():
+    """Close the client (if one was created) and release pooled connections"""
+    global _client, _db
+    if _client is not None:
+        _client.close()
+    _client = None
+    _db = None
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Resolve user accounts that share an email address
+Registrations racing each other before the unique email index existed could
+create several accounts for one email, and the index cannot be built while
+they remain. For every such email the oldest account is kept; the others are
+disabled and their email is rewritten to <email>.duplicate-<id>, so their
+submissions stay linked to them and nothing is deleted. Then the users
+indexes are built.
+
+    python dedupe_users.py [--dry-run]
+"""
+
+import argparse
+import asyncio
+import sys
+from datetime import datetime, timezone
+import database
+
+
+async def find_duplicates():
+    """[(email, [user ids oldest first])] for every email with several accounts"""
+    pipeline = [
+        {"$sort": {"created_at": 1, "_id": 1}},
+        {"$group": {"_id": "$email", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    cursor = database.get_collection("users").aggregate(pipeline, allowDiskUse=True)
+    return [(group["_id"], group["ids"]) async for group in cursor]
+
+
+async def dedupe(dry_run=False):
+    """Disable and rename the duplicates; returns how many accounts were changed"""
+    users = database.get_collection("users")
+    changed = 0
+    for email, ids in await find_duplicates():
+        kept, duplicates = ids[0], ids[1:]
+        print(f"{email}: keeping {kept}, disabling {', '.join(str(user_id) for user_id in duplicates)}")
+        if dry_run:
+            changed += len(duplicates)
+            continue
+        for user_id in duplicates:
+            await users.update_one(
+                {"_id": user_id},
+                {"$set": {
+                    "email": f"{email}.duplicate-{user_id}",
+                    "duplicate_of": kept,
+                    "is_active": False,
+                    "updated_at": datetime.now(timezone.utc)
+                }}
+            )
+            changed += 1
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resolve user accounts sharing an email")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the duplicates")
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            changed = await dedupe(args.dry_run)
+            indexed = args.dry_run or await database.ensure_indexes("users")
+            return changed, indexed
+        finally:
+            database.close()
+
+    changed, indexed = asyncio.run(run())
+    print(f"✓ {changed} duplicate accounts {'found' if args.dry_run else 'disabled'}")
+    if not indexed:
+        print("✗ The users indexes could still not be built")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
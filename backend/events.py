@@ -0,0 +1,168 @@
+"""
+Real-time submission events
+An in-process broker fans submission events out to Server-Sent Events
+clients. Every subscriber has a bounded queue: a client that falls behind has
+its backlog replaced by a single "resync" event (refetch the list) instead of
+holding memory or slowing down the publisher.
+
+Events are published by the handlers of this process. With
+SUBMISSION_CHANGE_STREAMS=1 (MongoDB replica set required) they come from a
+change stream instead, so clients of every worker see writes made by any of
+them.
+"""
+
+import asyncio
+import os
+import database
+from serialization import dumps
+from submissions import LIST_FIELDS
+
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "100"))
+HEARTBEAT_SECONDS = float(os.getenv("EVENT_HEARTBEAT_SECONDS", "15"))
+# Reconnection delay suggested to EventSource clients
+RETRY_MILLISECONDS = 5000
+CHANGE_STREAMS_ENABLED = os.getenv("SUBMISSION_CHANGE_STREAMS", "0") == "1"
+CHANGE_STREAM_RETRY_SECONDS = 5
+
+_change_stream_task = None
+
+
+class Subscriber:
+    """One connected client: a bounded queue of (id, event, data) tuples"""
+
+    def __init__(self, maxsize):
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+
+class Broker:
+    """Fan-out of events to every current subscriber"""
+
+    def __init__(self, queue_size=EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.sequence = 0
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self):
+        subscriber = Subscriber(self.queue_size)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, event, data):
+        """Queue an event for every subscriber without ever waiting"""
+        self.sequence += 1
+        self.published += 1
+        message = (self.sequence, event, data)
+        for subscriber in self.subscribers:
+            try:
+                subscriber.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Too slow to keep up: drop its backlog and ask it to refetch
+                dropped = subscriber.queue.qsize()
+                while not subscriber.queue.empty():
+                    subscriber.queue.get_nowait()
+                subscriber.dropped += dropped
+                self.dropped += dropped
+                subscriber.queue.put_nowait((self.sequence, "resync", {}))
+
+    def stats(self):
+        return {
+            "subscribers": len(self.subscribers),
+            "published": self.published,
+            "dropped": self.dropped,
+        }
+
+
+broker = Broker()
+
+
+def compact(doc):
+    """The list-view fields of a submission, as sent in events"""
+    data = {field: doc[field] for field in LIST_FIELDS if field in doc}
+    data["id"] = doc["_id"]
+    if "updated_at" in doc:
+        data["updated_at"] = doc["updated_at"]
+    return data
+
+
+def publish_submission(event, doc):
+    """Announce a created/updated submission written by this process"""
+    if not CHANGE_STREAMS_ENABLED:
+        broker.publish(f"submission.{event}", compact(doc))
+
+
+def format_event(message):
+    """Encode an (id, event, data) tuple in the text/event-stream format"""
+    event_id, event, data = message
+    return f"id: {event_id}\nevent: {event}\ndata: ".encode() + dumps(data) + b"\n\n"
+
+
+async def stream(is_authorized, resync=False):
+    """
+    Async iterator over the text/event-stream body of one new subscriber
+    Sends a heartbeat comment when idle, and ends once is_authorized()
+    (checked before every event and heartbeat) turns False so the client
+    reconnects with fresh credentials.
+    """
+    # Subscribed on first iteration, so the finally below always unsubscribes
+    subscriber = broker.subscribe()
+    try:
+        if not is_authorized():
+            return
+        yield f"retry: {RETRY_MILLISECONDS}\n\n".encode()
+        if resync:
+            # Reconnecting client: events it missed are not kept
+            yield format_event((broker.sequence, "resync", {}))
+        while True:
+            try:
+                message = await asyncio.wait_for(subscriber.queue.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                message = None
+            # Checked before every write, so a busy feed cannot outlive the token
+            if not is_authorized():
+                break
+            yield b": heartbeat\n\n" if message is None else format_event(message)
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+async def _change_stream_loop():
+    pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}]
+    resume_token = None
+    while True:
+        try:
+            async with database.get_collection("submissions").watch(
+                pipeline, full_document="updateLookup", resume_after=resume_token
+            ) as changes:
+                async for change in changes:
+                    resume_token = changes.resume_token
+                    doc = change.get("fullDocument")
+                    if doc is None:
+                        # Deleted again before the lookup
+                        continue
+                    event = "created" if change["operationType"] == "insert" else "updated"
+                    broker.publish(f"submission.{event}", compact(doc))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"✗ Submission change stream failed: {e}")
+            await asyncio.sleep(CHANGE_STREAM_RETRY_SECONDS)
+
+
+def start_change_stream():
+    """Feed the broker from a MongoDB change stream, if enabled"""
+    global _change_stream_task
+    if CHANGE_STREAMS_ENABLED and _change_stream_task is None:
+        _change_stream_task = asyncio.get_running_loop().create_task(_change_stream_loop())
+
+
+def stop_change_stream():
+    global _change_stream_task
+    if _change_stream_task is not None:
+        _change_stream_task.cancel()
+        _change_stream_task = None
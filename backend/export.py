@@ -0,0 +1,257 @@
+"""
+Streaming data export
+The admin export ZIP is produced while it is being sent: CSV rows come from
+batched database cursors and images are copied into the archive entry by
+entry, so memory stays bounded and the download starts immediately.
+
+Submissions can also be exported in columnar form (Parquet or an Arrow IPC
+stream) for analysis, optionally limited to what changed since a timestamp.
+"""
+
+import csv
+import importlib.util
+import io
+import zipfile
+from datetime import datetime
+from starlette.concurrency import run_in_threadpool
+import database
+import storage
+from submissions import isoformat_utc
+
+EXPORT_BATCH_SIZE = 500
+# Rows per Parquet row group / Arrow record batch
+COLUMNAR_BATCH_ROWS = 10000
+# Flush CSV text into the archive (and the archive to the client) at this size
+FLUSH_THRESHOLD = 64 * 1024
+
+USER_COLUMNS = ["id", "full_name", "email", "age", "role", "approval_status", "is_active", "created_at"]
+SUBMISSION_COLUMNS = [
+    "id", "patient_id", "patient_name", "patient_email", "patient_age",
+    "blood_glucose", "hba1c", "insulin_level", "diabetes_type",
+    "symptoms", "medications", "notes", "tongue_image_filename", "created_at",
+]
+
+
+class StreamSink(io.RawIOBase):
+    """
+    Unseekable in-memory sink for zipfile and the Arrow writers
+    zipfile then writes data descriptors instead of seeking back, and the
+    bytes written so far can be drained and sent at any point.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def seekable(self):
+        return False
+
+    def seek(self, *args):
+        raise OSError("StreamSink is not seekable")
+
+    def flush(self):
+        pass
+
+    def pending(self):
+        return len(self._buffer)
+
+    def drain(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return isoformat_utc(value)
+    if isinstance(value, list):
+        return "; ".join(str(item) for item in value)
+    if value is None:
+        return ""
+    return value
+
+
+async def _write_csv(archive, sink, entry_name, collection, columns):
+    """Write a collection as a CSV entry, yielding archive bytes as they accumulate"""
+    projection = {column: 1 for column in columns if column != "id"}
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(columns)
+    with archive.open(entry_name, "w", force_zip64=True) as entry:
+        cursor = collection.find({}, projection).sort("_id", 1).batch_size(EXPORT_BATCH_SIZE)
+        async for doc in cursor:
+            doc["id"] = str(doc["_id"])
+            writer.writerow([_csv_value(doc.get(column)) for column in columns])
+            if text.tell() >= FLUSH_THRESHOLD:
+                entry.write(text.getvalue().encode("utf-8"))
+                text.seek(0)
+                text.truncate()
+                if sink.pending():
+                    yield sink.drain()
+        entry.write(text.getvalue().encode("utf-8"))
+    yield sink.drain()
+
+
+async def _write_images(archive, sink, backend):
+    """Copy every referenced image into the archive, one entry at a time"""
+    seen = set()
+    cursor = database.get_collection("submissions").find(
+        {"tongue_image_filename": {"$exists": True}}, {"tongue_image_filename": 1}
+    ).batch_size(EXPORT_BATCH_SIZE)
+    async for doc in cursor:
+        name = doc["tongue_image_filename"]
+        # Content-addressed images can be shared by several submissions
+        if name in seen:
+            continue
+        seen.add(name)
+        info = await backend.stat(name)
+        if info is None:
+            continue
+        # ZipInfo defaults to ZIP_STORED: photos are already compressed
+        member = zipfile.ZipInfo(f"images/{name}", date_time=datetime.now().timetuple()[:6])
+        with archive.open(member, "w", force_zip64=True) as entry:
+            if info["size"]:
+                async for chunk in backend.iter_range(name, 0, info["size"] - 1):
+                    entry.write(chunk)
+                    if sink.pending() >= FLUSH_THRESHOLD:
+                        yield sink.drain()
+        yield sink.drain()
+
+
+async def stream_export_zip():
+    """Async iterator over the bytes of the export archive"""
+    sink = StreamSink()
+    backend = storage.get_backend()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        async for chunk in _write_csv(archive, sink, "users.csv", database.get_collection("users"), USER_COLUMNS):
+            yield chunk
+        async for chunk in _write_csv(
+            archive, sink, "submissions.csv", database.get_collection("submissions"), SUBMISSION_COLUMNS
+        ):
+            yield chunk
+        async for chunk in _write_images(archive, sink, backend):
+            yield chunk
+    # Central directory
+    yield sink.drain()
+
+
+COLUMNAR_FORMATS = {
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+# Analytics columns; contact details stay in the full (ZIP) export
+COLUMNAR_FIELDS = [
+    "patient_id", "patient_age", "blood_glucose", "hba1c", "insulin_level",
+    "diabetes_type", "symptoms", "medications", "notes", "tongue_image_filename",
+    "created_at", "updated_at",
+]
+
+
+def _columnar_schema():
+    import pyarrow as pa
+
+    categorical = pa.dictionary(pa.int32(), pa.string())
+    timestamp = pa.timestamp("ms", tz="UTC")
+    return pa.schema([
+        ("id", pa.string()),
+        ("patient_id", categorical),
+        ("patient_age", pa.int32()),
+        ("blood_glucose", pa.float64()),
+        ("hba1c", pa.float64()),
+        ("insulin_level", pa.float64()),
+        ("diabetes_type", categorical),
+        ("symptoms", pa.list_(pa.string())),
+        ("medications", pa.list_(pa.string())),
+        ("notes", pa.string()),
+        ("tongue_image_filename", pa.string()),
+        ("created_at", timestamp),
+        ("updated_at", timestamp),
+    ])
+
+
+def is_columnar_available():
+    """True if pandas and pyarrow, which the columnar export needs, are installed"""
+    return (
+        importlib.util.find_spec("pandas") is not None
+        and importlib.util.find_spec("pyarrow") is not None
+    )
+
+
+def _to_table(docs, schema):
+    """Typed Arrow table for a batch of submission documents"""
+    import pandas as pd
+    import pyarrow as pa
+
+    frame = pd.DataFrame.from_records(docs, columns=["_id", *COLUMNAR_FIELDS])
+    frame.insert(0, "id", frame.pop("_id").astype(str))
+    # Coerce stray values (strings, missing fields) instead of failing the export
+    for column in ("blood_glucose", "hba1c", "insulin_level"):
+        frame[column] = pd.to_numeric(frame[column], errors="coerce").astype("float64")
+    frame["patient_age"] = pd.to_numeric(frame["patient_age"], errors="coerce").astype("Int32")
+    for column in ("created_at", "updated_at"):
+        frame[column] = pd.to_datetime(frame[column], utc=True, errors="coerce")
+    for column in ("patient_id", "diabetes_type"):
+        frame[column] = frame[column].astype("category")
+    for column in ("symptoms", "medications"):
+        frame[column] = [value if isinstance(value, list) else None for value in frame[column]]
+    return pa.Table.from_pandas(frame, preserve_index=False).cast(schema)
+
+
+def build_changes_query(since=None, until=None):
+    """Submissions updated in [since, until); no bounds means everything"""
+    query = {}
+    if since is not None or until is not None:
+        query["updated_at"] = {}
+        if since is not None:
+            query["updated_at"]["$gte"] = since
+        if until is not None:
+            query["updated_at"]["$lt"] = until
+    return query
+
+
+async def stream_columnar(export_format, query):
+    """
+    Async iterator over submissions as Parquet or an Arrow IPC stream
+    Each batch of documents becomes one row group / record batch, converted
+    in the threadpool and sent as soon as it is written.
+    """
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+
+    schema = _columnar_schema()
+    sink = StreamSink()
+    if export_format == "parquet":
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    else:
+        writer = ipc.new_stream(sink, schema)
+
+    def write(docs):
+        writer.write_table(_to_table(docs, schema))
+
+    projection = {field: 1 for field in COLUMNAR_FIELDS}
+    cursor = database.get_collection("submissions").find(query, projection).batch_size(EXPORT_BATCH_SIZE)
+    try:
+        docs = []
+        async for doc in cursor:
+            docs.append(doc)
+            if len(docs) >= COLUMNAR_BATCH_ROWS:
+                await run_in_threadpool(write, docs)
+                docs = []
+                yield sink.drain()
+        if docs:
+            await run_in_threadpool(write, docs)
+    finally:
+        # Writes the Parquet footer / Arrow end-of-stream marker
+        writer.close()
+    yield sink.drain()
@@ -0,0 +1,275 @@
+"""
+Tongue-image color features
+Each image is decoded once at a reduced size with Pillow and described with
+vectorized NumPy: CIELAB and HSV histograms, the coating ratio and the
+dominant hues. Features are computed by a background job after every upload
+and stored on the submission as tongue_features; run this module to recompute
+them for every stored image:
+
+    python features.py [--workers N] [--missing-only]
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import os
+import sys
+from contextlib import AsyncExitStack, asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from bson import ObjectId
+import database
+import events
+import jobs
+import pools
+import storage
+import versions
+from submissions import LIST_FIELDS
+
+# Bump when the features change so stale documents can be found and recomputed
+FEATURES_VERSION = 1
+# Images are analysed at this longest edge; color statistics barely change
+FEATURE_IMAGE_SIZE = int(os.getenv("FEATURE_IMAGE_SIZE", "256"))
+FEATURE_WORKERS = int(os.getenv("FEATURE_WORKERS", str(min(2, os.cpu_count() or 1))))
+FEATURE_EXTRACTION_ENABLED = os.getenv("FEATURE_EXTRACTION", "1") == "1"
+
+HUE_BINS = 18
+LAB_BINS = 8
+LAB_RANGES = {"L": (0.0, 100.0), "a": (-60.0, 80.0), "b": (-40.0, 80.0)}
+DOMINANT_HUES = 3
+# Darker pixels (mouth, shadows) are left out of every statistic
+MIN_LIGHTNESS = 20.0
+# Hues of nearly grey pixels are noise
+MIN_HUE_SATURATION = 0.15
+# Coating: light pixels with little chroma, unlike the red tongue body
+COATING_MIN_LIGHTNESS = 60.0
+COATING_MAX_CHROMA = 18.0
+
+# sRGB (D65) -> XYZ, rows scaled by the D65 white point so white maps to 1
+_RGB_TO_XYZ = (
+    (0.4124564 / 0.95047, 0.3575761 / 0.95047, 0.1804375 / 0.95047),
+    (0.2126729, 0.7151522, 0.0721750),
+    (0.0193339 / 1.08883, 0.1191920 / 1.08883, 0.9503041 / 1.08883),
+)
+
+_pool = pools.WorkerPool("features", FEATURE_WORKERS)
+
+
+def is_available():
+    """True if extraction is enabled and NumPy and Pillow are installed"""
+    return (
+        FEATURE_EXTRACTION_ENABLED
+        and importlib.util.find_spec("numpy") is not None
+        and importlib.util.find_spec("PIL") is not None
+    )
+
+
+def _rgb_to_lab(rgb):
+    """CIELAB (D65) of an (n, 3) float array of sRGB values in 0..1"""
+    import numpy as np
+
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ np.asarray(_RGB_TO_XYZ, dtype=np.float32).T
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16.0 / 116.0)
+    return np.stack([
+        116.0 * f[:, 1] - 16.0,
+        500.0 * (f[:, 0] - f[:, 1]),
+        200.0 * (f[:, 1] - f[:, 2]),
+    ], axis=1)
+
+
+def _fractions(counts, total):
+    return [round(float(count) / total, 4) for count in counts] if total else [0.0] * len(counts)
+
+
+def extract_features(path, size=FEATURE_IMAGE_SIZE):
+    """Color features of one image file (runs inside the worker pool)"""
+    # Deferred imports: NumPy and Pillow are only loaded in workers
+    import numpy as np
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as image:
+        # Let the JPEG decoder downscale while decoding
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        image = image.convert("RGB")
+        hsv = np.asarray(image.convert("HSV"), dtype=np.uint8).reshape(-1, 3)
+        rgb = np.asarray(image, dtype=np.float32).reshape(-1, 3) / 255.0
+
+    lab = _rgb_to_lab(rgb)
+    mask = lab[:, 0] >= MIN_LIGHTNESS
+    lab = lab[mask]
+    hsv = hsv[mask]
+    pixels = int(mask.sum())
+
+    lab_histogram = {}
+    for channel, name in enumerate("Lab"):
+        counts, _ = np.histogram(lab[:, channel], bins=LAB_BINS, range=LAB_RANGES[name])
+        lab_histogram[name] = _fractions(counts, pixels)
+
+    # Pillow's HSV channels are all 0..255
+    saturation = hsv[:, 1] / 255.0
+    chromatic = saturation >= MIN_HUE_SATURATION
+    hue_counts = np.bincount(
+        hsv[chromatic, 0].astype(np.int32) * HUE_BINS // 256, minlength=HUE_BINS
+    )
+    hue_histogram = _fractions(hue_counts, int(chromatic.sum()))
+    bin_degrees = 360 / HUE_BINS
+    dominant = [
+        {"hue": round((int(index) + 0.5) * bin_degrees, 1), "fraction": hue_histogram[index]}
+        for index in np.argsort(hue_counts, kind="stable")[::-1][:DOMINANT_HUES]
+        if hue_counts[index]
+    ]
+
+    chroma = np.hypot(lab[:, 1], lab[:, 2])
+    coating = (lab[:, 0] >= COATING_MIN_LIGHTNESS) & (chroma <= COATING_MAX_CHROMA)
+
+    def stat(values, function):
+        return [round(float(value), 2) for value in function(values, axis=0)] if pixels else None
+
+    return {
+        "version": FEATURES_VERSION,
+        "pixels": pixels,
+        "lab_mean": stat(lab, np.mean),
+        "lab_std": stat(lab, np.std),
+        "lab_histogram": lab_histogram,
+        "saturation_mean": round(float(saturation.mean()), 4) if pixels else None,
+        "value_mean": round(float(hsv[:, 2].mean()) / 255.0, 4) if pixels else None,
+        "hue_histogram": hue_histogram,
+        "dominant_hues": dominant,
+        "coating_ratio": round(float(coating.mean()), 4) if pixels else None,
+    }
+
+
+def extract_features_batch(paths):
+    """
+    Features of several images in one worker call, so the pool's per-task
+    overhead is paid once per batch; images that fail to decode give None
+    """
+    results = []
+    for path in paths:
+        if path is None:
+            results.append(None)
+            continue
+        try:
+            results.append(extract_features(path))
+        except Exception as e:
+            print(f"✗ Feature extraction failed for {path}: {e}")
+            results.append(None)
+    return results
+
+
+async def compute_features(name):
+    """Features of a stored image"""
+    async with storage.get_backend().local_copy(name) as path:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_pool.get(), extract_features, str(path))
+
+
+async def store_features(image_name, computed):
+    """Set tongue_features on every submission of an image; returns how many"""
+    result = await database.get_collection("submissions").update_many(
+        {"tongue_image_filename": image_name},
+        {"$set": {"tongue_features": computed, "updated_at": datetime.now(timezone.utc)}}
+    )
+    return result.modified_count
+
+
+@jobs.handler("tongue_features")
+async def update_submission_features(payload):
+    """Compute and store the features of a new submission's image (a job)"""
+    submissions = database.get_collection("submissions")
+    doc = await submissions.find_one({"_id": ObjectId(payload["submission_id"])}, {field: 1 for field in LIST_FIELDS})
+    if doc is None:
+        return
+    name = payload["image"]
+    # Deduplicated images: reuse the features of an earlier upload
+    earlier = await submissions.find_one(
+        {"tongue_image_filename": name, "tongue_features.version": FEATURES_VERSION},
+        {"tongue_features": 1}
+    )
+    computed = earlier["tongue_features"] if earlier else await compute_features(name)
+    now = datetime.now(timezone.utc)
+    await submissions.update_one({"_id": doc["_id"]}, {"$set": {"tongue_features": computed, "updated_at": now}})
+    await versions.bump("submissions")
+    events.publish_submission("updated", {**doc, "updated_at": now})
+
+
+async def enqueue(submission_id, image_name):
+    """Queue the feature extraction of a new submission"""
+    if is_available():
+        await jobs.enqueue(
+            "tongue_features",
+            {"submission_id": str(submission_id), "image": image_name},
+            key=f"tongue_features:{submission_id}"
+        )
+
+
+async def recompute_all(workers, missing_only=False, batch_size=32):
+    """Recompute the features of every stored image across a process pool"""
+    query = {"tongue_image_filename": {"$exists": True}}
+    if missing_only:
+        query["tongue_features.version"] = {"$ne": FEATURES_VERSION}
+    # Deduplicated blobs are shared by submissions, so each is analysed once
+    names = await database.get_collection("submissions").distinct("tongue_image_filename", query)
+    backend = storage.get_backend()
+    loop = asyncio.get_running_loop()
+    updated = failed = 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=pools.process_context()) as executor:
+        for start in range(0, len(names), batch_size * workers):
+            window = names[start:start + batch_size * workers]
+            # S3 objects are downloaded for the duration of the window only
+            async with _local_copies(backend, window) as paths:
+                chunks = [
+                    [str(path) if path is not None else None for path in paths[offset:offset + batch_size]]
+                    for offset in range(0, len(paths), batch_size)
+                ]
+                results = await asyncio.gather(*[
+                    loop.run_in_executor(executor, extract_features_batch, chunk) for chunk in chunks
+                ])
+            for name, computed in zip(window, [item for chunk in results for item in chunk]):
+                if computed is None:
+                    failed += 1
+                    continue
+                updated += await store_features(name, computed)
+            print(f"{min(start + len(window), len(names))}/{len(names)} images")
+    if updated:
+        await versions.bump("submissions")
+    return {"images": len(names), "submissions_updated": updated, "failed": failed}
+
+
+@asynccontextmanager
+async def _local_copies(backend, names):
+    """Local paths of several stored images (None for those that failed)"""
+    async with AsyncExitStack() as stack:
+        async def enter(name):
+            try:
+                return await stack.enter_async_context(backend.local_copy(name))
+            except Exception as e:
+                print(f"✗ Could not read {name}: {e}")
+                return None
+        yield await asyncio.gather(*[enter(name) for name in names])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute tongue-image color features")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=32, help="Images per worker task")
+    parser.add_argument("--missing-only", action="store_true", help="Skip images with current features")
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            return await recompute_all(args.workers, args.missing_only, args.batch_size)
+        finally:
+            database.close()
+
+    result = asyncio.run(run())
+    print(f"✓ {result['submissions_updated']} submissions updated from {result['images']} images "
+          f"({result['failed']} failed)")
+    return 1 if result["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""
+Image serving with zero-copy file responses, strong ETags, conditional
+requests and byte ranges
+"""
+
+import hashlib
+import mimetypes
+import os
+import re
+from collections import OrderedDict
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response, StreamingResponse
+import storage
+from storage import BLOB_NAME
+
+# Stored image names are content hashes (or, for older uploads, unique UUIDs),
+# so the content behind a name never changes
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+READ_CHUNK_SIZE = 64 * 1024
+ETAG_CACHE_SIZE = 4096
+
+_SAFE_FILENAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# (path, mtime_ns, size) -> strong ETag, so each file is hashed only once
+_etag_cache = OrderedDict()
+
+
+def validate_image_name(filename):
+    """Reject names that are not plain stored image names with a 404"""
+    if not _SAFE_FILENAME.match(filename):
+        raise HTTPException(
+            status_code=404,
+            detail="Image not found"
+        )
+    return filename
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as image_file:
+        for chunk in iter(lambda: image_file.read(READ_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def content_etag(name, path, info):
+    """Strong ETag derived from the object content (cached per file version)"""
+    # Content-addressed blobs are named after their hash already
+    blob = BLOB_NAME.match(name)
+    if blob:
+        return f'"{blob.group(1)}"'
+    if path is None:
+        # Remote object: the backend's own content checksum
+        return info["etag"] or f'"{info["size"]:x}-{int(info["modified"]):x}"'
+    key = (str(path), info["modified"], info["size"])
+    etag = _etag_cache.get(key)
+    if etag is None:
+        etag = f'"{await run_in_threadpool(_hash_file, path)}"'
+        _etag_cache[key] = etag
+        if len(_etag_cache) > ETAG_CACHE_SIZE:
+            _etag_cache.popitem(last=False)
+    else:
+        _etag_cache.move_to_end(key)
+    return etag
+
+
+def etag_matches(header, etag):
+    """Weak comparison of an If-None-Match/If-Range header against an ETag"""
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def parse_range(header, size):
+    """
+    Parse a single byte range header into (start, end) inclusive
+    Returns None when the header should be ignored (multi-range, malformed)
+    Raises 416 when the range cannot be satisfied
+    """
+    match = _RANGE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if first == "" and last == "":
+        return None
+    if first == "":
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise _range_not_satisfiable(size)
+        start = max(0, size - length)
+        end = size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if start > end:
+            if last and int(last) < start:
+                return None
+            raise _range_not_satisfiable(size)
+    if start >= size:
+        raise _range_not_satisfiable(size)
+    return start, end
+
+
+def _range_not_satisfiable(size):
+    return HTTPException(
+        status_code=416,
+        detail="Requested range not satisfiable",
+        headers={"Content-Range": f"bytes */{size}"}
+    )
+
+
+class FileRangeResponse(Response):
+    """
+    Sends a file, or one byte range of it, without copying it through Python
+    when the server supports the ASGI zero-copy or pathsend extensions, and in
+    fixed-size chunks read off the event loop otherwise.
+    """
+
+    def __init__(self, path, size, status_code=200, headers=None, media_type=None, byte_range=None, send_body=True):
+        self.path = path
+        self.size = size
+        self.byte_range = byte_range
+        self.send_body = send_body
+        super().__init__(content=None, status_code=status_code, headers=headers, media_type=media_type)
+        start, end = byte_range if byte_range else (0, size - 1)
+        self.offset = start
+        self.count = max(0, end - start + 1)
+        self.headers["content-length"] = str(self.count)
+
+    async def __call__(self, scope, receive, send):
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if not self.send_body or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        extensions = scope.get("extensions") or {}
+        if self.byte_range is None and "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+            return
+
+        fd = await run_in_threadpool(os.open, self.path, os.O_RDONLY)
+        try:
+            if "http.response.zerocopy" in extensions:
+                await send({
+                    "type": "http.response.zerocopy",
+                    "file": fd,
+                    "offset": self.offset,
+                    "count": self.count,
+                    "more_body": False,
+                })
+                return
+            position = self.offset
+            remaining = self.count
+            while remaining > 0:
+                chunk = await run_in_threadpool(os.pread, fd, min(READ_CHUNK_SIZE, remaining), position)
+                if not chunk:
+                    break
+                position += len(chunk)
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # File shrank underneath us; close the body cleanly
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            os.close(fd)
+
+
+async def image_response(request, name):
+    """Build a cacheable, conditional, range-aware response for a stored image"""
+    backend = storage.get_backend()
+    info = await backend.stat(name)
+    if info is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Image not found"
+        )
+    # Local objects can be handed to the server as files (zero-copy)
+    path = backend.local_path(name)
+    size = info["size"]
+    etag = await content_etag(name, path, info)
+    headers = {
+        "etag": etag,
+        "cache-control": IMAGE_CACHE_CONTROL,
+        "accept-ranges": "bytes",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    send_body = request.method != "HEAD"
+
+    status_code = 200
+    byte_range = None
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and size > 0 and (if_range is None or if_range.strip() == etag):
+        byte_range = parse_range(range_header, size)
+        if byte_range is not None:
+            status_code = 206
+            headers["content-range"] = f"bytes {byte_range[0]}-{byte_range[1]}/{size}"
+
+    if path is not None:
+        return FileRangeResponse(
+            path, size, status_code=status_code, headers=headers, media_type=media_type,
+            byte_range=byte_range, send_body=send_body
+        )
+
+    start, end = byte_range if byte_range else (0, size - 1)
+    headers["content-length"] = str(end - start + 1)
+    if not send_body or size == 0:
+        response = Response(status_code=status_code, headers=headers, media_type=media_type)
+        response.headers["content-length"] = str(end - start + 1)
+        return response
+    return StreamingResponse(
+        backend.iter_range(name, start, end), status_code=status_code, headers=headers, media_type=media_type
+    )
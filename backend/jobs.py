@@ -0,0 +1,306 @@
+"""
+Durable background jobs stored in MongoDB
+Handlers enqueue follow-up work (image features, thumbnails, ...) and return
+as soon as their own record is written; workers claim jobs from the jobs
+collection and run the handler registered for the job's kind.
+
+- A claimed job is leased for JOB_VISIBILITY_TIMEOUT_SECONDS; if its worker
+  dies, the job becomes claimable again once the lease runs out, unless that
+  was its last attempt, in which case it is marked failed.
+- Failed jobs are retried with exponential backoff up to JOB_MAX_ATTEMPTS
+  times, then kept with status "failed".
+- Enqueueing with an idempotency key a job already has returns that job.
+- Finished jobs expire after JOB_RETENTION_SECONDS.
+
+Workers run inside the API process (JOB_WORKERS, 0 to disable) or as a
+separate process:
+
+    python jobs.py [--workers N]
+
+Serverless functions run no workers, so there jobs are only enqueued when
+JOB_EXTERNAL_WORKERS=1 says such a process consumes the queue; otherwise
+they would stay queued forever.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import signal
+import socket
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+import database
+import metrics
+from vercel_compat import is_serverless
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_VISIBILITY_TIMEOUT_SECONDS = int(os.getenv("JOB_VISIBILITY_TIMEOUT_SECONDS", "300"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "5"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "3600"))
+# Idle workers look for new jobs at least this often (other processes enqueue too)
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+# Set when a separate `python jobs.py` process runs the jobs
+JOB_EXTERNAL_WORKERS = os.getenv("JOB_EXTERNAL_WORKERS", "0") == "1"
+
+STATUSES = ("queued", "running", "done", "failed")
+
+# kind -> async handler(payload)
+_handlers = {}
+_worker_tasks = []
+# Set when this process enqueues a job, so local idle workers wake at once
+_wakeup = None
+# Jobs handled by this process
+counters = {"completed": 0, "retried": 0, "failed": 0}
+# Jobs per status in the collection, refreshed by refresh_depth()
+depth = {status: 0 for status in STATUSES}
+
+
+def _jobs():
+    return database.get_collection("jobs")
+
+
+def _get_wakeup():
+    global _wakeup
+    if _wakeup is None:
+        _wakeup = asyncio.Event()
+    return _wakeup
+
+
+def handler(kind):
+    """Decorator registering the async function that runs jobs of a kind"""
+    def register(func):
+        _handlers[kind] = func
+        return func
+    return register
+
+
+def has_workers():
+    """Whether any worker will run queued jobs, in this process or a separate one"""
+    return JOB_EXTERNAL_WORKERS or (JOB_WORKERS > 0 and not is_serverless())
+
+
+async def enqueue(kind, payload, key=None, delay=0, max_attempts=JOB_MAX_ATTEMPTS):
+    """
+    Add a job; returns its id, or None if no worker would run it
+    With an idempotency key, a job that already has the key is returned
+    instead of adding another one
+    """
+    if not has_workers():
+        return None
+    now = datetime.now(timezone.utc)
+    job = {
+        "_id": str(uuid.uuid4()),
+        "kind": kind,
+        "payload": payload,
+        "status": "queued",
+        "attempts": 0,
+        "max_attempts": max_attempts,
+        # Queued: when the job may run. Running: when its lease expires
+        "run_at": now + timedelta(seconds=delay),
+        "created_at": now,
+        "updated_at": now,
+    }
+    if key is not None:
+        job["key"] = key
+        # Deduplication relies on the unique key index
+        await database.ensure_indexes("jobs")
+    try:
+        await _jobs().insert_one(job)
+    except Exception as e:
+        if key is None or not database.is_duplicate_key_error(e):
+            raise
+        existing = await _jobs().find_one({"key": key}, {"_id": 1})
+        return existing["_id"]
+    _get_wakeup().set()
+    return job["_id"]
+
+
+async def claim(worker_id):
+    """Lease the next runnable job (queued and due, or running with an expired lease)"""
+    from pymongo import ReturnDocument
+
+    now = datetime.now(timezone.utc)
+    return await _jobs().find_one_and_update(
+        {
+            "status": {"$in": ["queued", "running"]},
+            "run_at": {"$lte": now},
+            "kind": {"$in": list(_handlers)},
+            # A job that crashed its worker on the last attempt is not rerun
+            "$expr": {"$lt": ["$attempts", "$max_attempts"]},
+        },
+        {
+            "$set": {
+                "status": "running",
+                "run_at": now + timedelta(seconds=JOB_VISIBILITY_TIMEOUT_SECONDS),
+                "lease": str(uuid.uuid4()),
+                "worker": worker_id,
+                "updated_at": now,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("run_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def fail_abandoned():
+    """
+    Mark jobs failed whose lease expired on their last attempt
+    Their worker died without recording an outcome (OOM, a crash in native
+    code), so claim() no longer picks them up. Returns how many were marked.
+    """
+    now = datetime.now(timezone.utc)
+    result = await _jobs().update_many(
+        {
+            "status": "running",
+            "run_at": {"$lte": now},
+            "$expr": {"$gte": ["$attempts", "$max_attempts"]},
+        },
+        {"$set": {
+            "status": "failed",
+            "last_error": "Worker lost during the last attempt",
+            "finished_at": now,
+            "expires_at": now + timedelta(seconds=JOB_RETENTION_SECONDS),
+            "updated_at": now,
+        }}
+    )
+    if result.modified_count:
+        counters["failed"] += result.modified_count
+        print(f"✗ {result.modified_count} jobs failed after their worker was lost")
+    return result.modified_count
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter before attempt number attempts + 1"""
+    delay = min(JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1), JOB_RETRY_MAX_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+
+async def _finish(job, update):
+    """Apply an update to a job unless its lease was taken over meanwhile"""
+    update.setdefault("$set", {})["updated_at"] = datetime.now(timezone.utc)
+    result = await _jobs().update_one({"_id": job["_id"], "lease": job["lease"]}, update)
+    return result.modified_count == 1
+
+
+async def run_job(job):
+    """Run a claimed job and record its outcome"""
+    started = time.perf_counter()
+    try:
+        await _handlers[job["kind"]](job["payload"])
+    except Exception as e:
+        now = datetime.now(timezone.utc)
+        error = f"{type(e).__name__}: {e}"
+        if job["attempts"] >= job["max_attempts"]:
+            outcome = "failed"
+            update = {"$set": {
+                "status": "failed",
+                "last_error": error,
+                "finished_at": now,
+                "expires_at": now + timedelta(seconds=JOB_RETENTION_SECONDS),
+            }}
+            print(f"✗ Job {job['kind']} {job['_id']} failed after {job['attempts']} attempts: {error}")
+        else:
+            outcome = "retried"
+            update = {"$set": {
+                "status": "queued",
+                "last_error": error,
+                "run_at": now + timedelta(seconds=retry_delay(job["attempts"])),
+            }}
+    else:
+        now = datetime.now(timezone.utc)
+        outcome = "completed"
+        update = {"$set": {
+            "status": "done",
+            "finished_at": now,
+            "expires_at": now + timedelta(seconds=JOB_RETENTION_SECONDS),
+        }}
+    counters[outcome] += 1
+    if metrics.METRICS_ENABLED:
+        metrics.observe_job(job["kind"], outcome, time.perf_counter() - started)
+    if not await _finish(job, update):
+        print(f"✗ Job {job['kind']} {job['_id']} outlived its lease; its result was not recorded")
+
+
+async def _worker_loop(worker_id):
+    wakeup = _get_wakeup()
+    while True:
+        try:
+            job = await claim(worker_id)
+        except Exception as e:
+            print(f"✗ Job claim failed: {e}")
+            job = None
+        if job is not None:
+            await run_job(job)
+            continue
+        try:
+            await fail_abandoned()
+        except Exception as e:
+            print(f"✗ Abandoned job sweep failed: {e}")
+        wakeup.clear()
+        try:
+            await asyncio.wait_for(wakeup.wait(), JOB_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_workers(count=JOB_WORKERS):
+    """Run job workers in the background of this process"""
+    if _worker_tasks or count <= 0:
+        return
+    loop = asyncio.get_running_loop()
+    host = f"{socket.gethostname()}:{os.getpid()}"
+    for number in range(count):
+        _worker_tasks.append(loop.create_task(_worker_loop(f"{host}:{number}")))
+
+
+def stop_workers():
+    """Cancel the workers; jobs they were running become claimable when their lease ends"""
+    for task in _worker_tasks:
+        task.cancel()
+    _worker_tasks.clear()
+
+
+async def refresh_depth():
+    """Update depth with the number of jobs per status"""
+    counts = {status: 0 for status in STATUSES}
+    async for row in _jobs().aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+        counts[row["_id"]] = row["count"]
+    depth.update(counts)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run background job workers")
+    parser.add_argument("--workers", type=int, default=max(JOB_WORKERS, 1))
+    args = parser.parse_args()
+
+    # Importing the modules that define handlers registers them
+    import features
+    import pools
+    import thumbnails
+
+    async def run():
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopping.set)
+        await database.ensure_indexes()
+        start_workers(args.workers)
+        print(f"✓ {args.workers} job workers running ({', '.join(sorted(_handlers))})")
+        await stopping.wait()
+        stop_workers()
+        pools.shutdown_all()
+        database.close()
+
+    asyncio.run(run())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
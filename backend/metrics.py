@@ -0,0 +1,280 @@
+"""
+Request, MongoDB and password-hashing metrics in Prometheus text format
+Enabled with METRICS_ENABLED=1. When disabled the HTTP middleware and the
+pymongo listeners are not installed at all, so the only cost left is a flag
+check around password hashing.
+
+Collected:
+- per-route request latency histograms and status counts
+- per-command MongoDB durations and failures (pymongo command monitoring)
+- connection pool checkout wait and connections in use
+- bcrypt queue wait and hashing time
+- background job durations and outcomes
+- login throttling, event stream, password and job queue state, read at scrape time
+"""
+
+import os
+import threading
+import time
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+# Optional bearer token required to scrape /api/metrics
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DATABASE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+# Listener callbacks run on motor's worker threads
+_lock = threading.Lock()
+_metrics = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with _lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def set(self, *label_values, value):
+        """Mirror a counter maintained elsewhere"""
+        with _lock:
+            self._values[label_values] = value
+
+    def samples(self):
+        for label_values, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+
+    kind = "gauge"
+
+
+class Histogram:
+    """Cumulative bucket histogram with labels"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._values = {}
+        _metrics.append(self)
+
+    def observe(self, value, *label_values):
+        with _lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def samples(self):
+        for label_values, series in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {series[-1]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+HTTP_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route")
+)
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status")
+)
+MONGO_COMMAND_DURATION = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency", ("command",), DATABASE_BUCKETS
+)
+MONGO_COMMAND_FAILURES = Counter(
+    "mongodb_command_failures_total", "Failed MongoDB commands", ("command",)
+)
+MONGO_CHECKOUT_WAIT = Histogram(
+    "mongodb_pool_checkout_wait_seconds", "Time waiting for a pooled connection", (), DATABASE_BUCKETS
+)
+MONGO_CHECKOUT_FAILURES = Counter(
+    "mongodb_pool_checkout_failures_total", "Failed connection checkouts", ("reason",)
+)
+MONGO_CONNECTIONS_IN_USE = Gauge(
+    "mongodb_pool_connections_in_use", "Connections currently checked out"
+)
+PASSWORD_DURATION = Histogram(
+    "password_hash_duration_seconds", "bcrypt hash/verify time", ("operation",)
+)
+PASSWORD_QUEUE_WAIT = Histogram(
+    "password_queue_wait_seconds", "Time bcrypt jobs wait for a worker thread", ("operation",)
+)
+PASSWORD_PENDING = Gauge("password_jobs_pending", "bcrypt jobs running or queued")
+LOGIN_THROTTLED = Counter("login_throttled_total", "Login attempts rejected by throttling", ("bucket",))
+LOGIN_ALLOWED = Counter("login_attempts_allowed_total", "Login attempts admitted by throttling")
+EVENT_SUBSCRIBERS = Gauge("event_stream_subscribers", "Connected event stream clients")
+EVENTS_PUBLISHED = Counter("event_stream_published_total", "Events published to stream clients")
+EVENTS_DROPPED = Counter("event_stream_dropped_total", "Events dropped for slow stream clients")
+JOB_DURATION = Histogram("job_duration_seconds", "Background job run time", ("kind", "outcome"))
+JOBS_PROCESSED = Counter("jobs_processed_total", "Background jobs run by this process", ("outcome",))
+JOBS_DEPTH = Gauge("jobs_depth", "Background jobs per status", ("status",))
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and status per matched route"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Route templates keep label cardinality bounded
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            HTTP_DURATION.observe(time.perf_counter() - started, scope["method"], path)
+            HTTP_REQUESTS.inc(scope["method"], path, str(status))
+
+
+def mongo_listeners():
+    """pymongo event listeners to pass to the client (none when disabled)"""
+    if not METRICS_ENABLED:
+        return []
+    from pymongo import monitoring
+
+    checkout_started = threading.local()
+
+    class CommandMetrics(monitoring.CommandListener):
+        def started(self, event):
+            pass
+
+        def succeeded(self, event):
+            MONGO_COMMAND_DURATION.observe(event.duration_micros / 1e6, event.command_name)
+
+        def failed(self, event):
+            MONGO_COMMAND_DURATION.observe(event.duration_micros / 1e6, event.command_name)
+            MONGO_COMMAND_FAILURES.inc(event.command_name)
+
+    class PoolMetrics(monitoring.ConnectionPoolListener):
+        # Checkout start and end are reported on the same thread
+        def connection_check_out_started(self, event):
+            checkout_started.value = time.perf_counter()
+
+        def connection_checked_out(self, event):
+            started = getattr(checkout_started, "value", None)
+            if started is not None:
+                MONGO_CHECKOUT_WAIT.observe(time.perf_counter() - started)
+            MONGO_CONNECTIONS_IN_USE.inc(amount=1)
+
+        def connection_check_out_failed(self, event):
+            MONGO_CHECKOUT_FAILURES.inc(str(event.reason))
+
+        def connection_checked_in(self, event):
+            MONGO_CONNECTIONS_IN_USE.inc(amount=-1)
+
+        def pool_created(self, event):
+            pass
+
+        def pool_ready(self, event):
+            pass
+
+        def pool_cleared(self, event):
+            pass
+
+        def pool_closed(self, event):
+            pass
+
+        def connection_created(self, event):
+            pass
+
+        def connection_ready(self, event):
+            pass
+
+        def connection_closed(self, event):
+            pass
+
+    return [CommandMetrics(), PoolMetrics()]
+
+
+def observe_password(operation, queued, started, finished):
+    PASSWORD_QUEUE_WAIT.observe(started - queued, operation)
+    PASSWORD_DURATION.observe(finished - started, operation)
+
+
+def observe_job(kind, outcome, duration):
+    JOB_DURATION.observe(duration, kind, outcome)
+
+
+def _collect_state():
+    """Mirror counters kept by other modules"""
+    import events
+    import jobs
+    import passwords
+    import ratelimit
+
+    PASSWORD_PENDING.set(value=passwords.pending_jobs())
+    LOGIN_ALLOWED.set(value=ratelimit.counters["allowed"])
+    LOGIN_THROTTLED.set("ip", value=ratelimit.counters["rejected_ip"])
+    LOGIN_THROTTLED.set("email", value=ratelimit.counters["rejected_email"])
+    broker = events.broker.stats()
+    EVENT_SUBSCRIBERS.set(value=broker["subscribers"])
+    EVENTS_PUBLISHED.set(value=broker["published"])
+    EVENTS_DROPPED.set(value=broker["dropped"])
+    for outcome, value in jobs.counters.items():
+        JOBS_PROCESSED.set(outcome, value=value)
+    for status, value in jobs.depth.items():
+        JOBS_DEPTH.set(status, value=value)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    _collect_state()
+    lines = []
+    with _lock:
+        for metric in _metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
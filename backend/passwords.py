@@ -0,0 +1,77 @@
+"""
+Password hashing offloaded to a bounded worker pool
+bcrypt is CPU heavy, so it must never run directly on the event loop
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+from passlib.context import CryptContext
+import metrics
+
+# bcrypt cost factor; hashes with a different cost are upgraded on next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Number of threads doing bcrypt work (bcrypt releases the GIL)
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Maximum hash/verify jobs running or waiting before we fail fast with 503
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", "64"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix="bcrypt")
+_pending = 0
+
+
+async def _run(operation, func, *args):
+    """Run func in the password pool, rejecting work when the queue is full"""
+    global _pending
+    if _pending >= PASSWORD_QUEUE_LIMIT:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, please try again shortly",
+            headers={"Retry-After": "1"},
+        )
+    _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        if not metrics.METRICS_ENABLED:
+            return await loop.run_in_executor(_executor, func, *args)
+        queued = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                metrics.observe_password(operation, queued, started, time.perf_counter())
+
+        return await loop.run_in_executor(_executor, timed)
+    finally:
+        _pending -= 1
+
+
+async def hash_password(password):
+    """Hash a password with the configured bcrypt cost"""
+    return await _run("hash", pwd_context.hash, password)
+
+
+async def verify_password(password, hashed):
+    """
+    Verify a password against its hash
+    Returns (valid, new_hash); new_hash is set when the stored hash should be
+    replaced because the configured bcrypt cost changed
+    """
+    return await _run("verify", pwd_context.verify_and_update, password, hashed)
+
+
+def pending_jobs():
+    """Number of hash/verify jobs currently running or queued"""
+    return _pending
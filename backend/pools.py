@@ -0,0 +1,51 @@
+"""
+Worker pools for CPU-bound image work
+Pillow and NumPy work runs in process pools so it neither blocks the event
+loop nor contends for the GIL. Pools start on first use; serverless runtimes
+lack the shared memory multiprocessing needs and get threads instead.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from vercel_compat import is_serverless
+
+# Every pool created, so shutdown_all() can stop them
+_pools = []
+
+
+def process_context():
+    """Multiprocessing context for pools started from this process"""
+    # Forking a process with motor and bcrypt threads can deadlock the child,
+    # so workers start from a clean forkserver
+    return multiprocessing.get_context("forkserver")
+
+
+class WorkerPool:
+    """An executor of max_workers workers, created on first use"""
+
+    def __init__(self, name, max_workers):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = None
+        _pools.append(self)
+
+    def get(self):
+        """Return the executor, starting it if needed"""
+        if self._executor is None:
+            if is_serverless():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+            else:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=process_context())
+        return self._executor
+
+    def shutdown(self):
+        """Stop the executor (if one was started)"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def shutdown_all():
+    """Stop every pool that was started"""
+    for pool in _pools:
+        pool.shutdown()
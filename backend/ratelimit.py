@@ -0,0 +1,154 @@
+"""
+Login throttling
+Token buckets keyed by client IP and by email are checked before the user
+lookup and bcrypt verify, so a credential-stuffing burst is rejected at the
+cost of a dictionary (or single document) update instead of a password hash.
+
+Backends (RATE_LIMIT_BACKEND):
+- "memory": buckets in this process (default); each worker limits separately
+- "mongo": buckets in the rate_limits collection, shared by every worker and
+  serverless instance
+"""
+
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException
+import database
+from vercel_compat import is_serverless
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+# Per IP: bursts of 20 attempts, refilled at 20 per minute
+LOGIN_IP_CAPACITY = float(os.getenv("LOGIN_IP_CAPACITY", "20"))
+LOGIN_IP_PER_MINUTE = float(os.getenv("LOGIN_IP_PER_MINUTE", "20"))
+# Per email: bursts of 5 attempts, refilled at 1 per minute
+LOGIN_EMAIL_CAPACITY = float(os.getenv("LOGIN_EMAIL_CAPACITY", "5"))
+LOGIN_EMAIL_PER_MINUTE = float(os.getenv("LOGIN_EMAIL_PER_MINUTE", "1"))
+# Behind a proxy (Vercel, a load balancer) the peer address is the proxy's
+TRUST_FORWARDED_FOR = os.getenv("RATE_LIMIT_TRUST_FORWARDED_FOR", "1" if is_serverless() else "0") == "1"
+# Proxies in front of the app that append to X-Forwarded-For. Entries left of
+# the one they added are whatever the client sent, so they are never used
+TRUSTED_PROXY_HOPS = max(1, int(os.getenv("RATE_LIMIT_TRUSTED_PROXY_HOPS", "1")))
+MEMORY_MAX_KEYS = int(os.getenv("RATE_LIMIT_MEMORY_MAX_KEYS", "100000"))
+
+
+class TokenBucket:
+    """Bucket parameters: capacity tokens, refilled continuously at rate per second"""
+
+    def __init__(self, name, capacity, per_minute):
+        self.name = name
+        self.capacity = capacity
+        self.rate = per_minute / 60
+
+
+LOGIN_IP = TokenBucket("login_ip", LOGIN_IP_CAPACITY, LOGIN_IP_PER_MINUTE)
+LOGIN_EMAIL = TokenBucket("login_email", LOGIN_EMAIL_CAPACITY, LOGIN_EMAIL_PER_MINUTE)
+
+
+class MemoryBackend:
+    """Buckets in a bounded LRU dict of this process"""
+
+    def __init__(self, max_keys=MEMORY_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    async def take(self, bucket, key):
+        """Take one token; returns (allowed, seconds until a token is available)"""
+        now = time.monotonic()
+        full_key = (bucket.name, key)
+        tokens, updated = self._buckets.pop(full_key, (bucket.capacity, now))
+        tokens = min(bucket.capacity, tokens + (now - updated) * bucket.rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[full_key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            # Least recently used keys are the ones closest to a full bucket
+            self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / bucket.rate
+
+
+class MongoBackend:
+    """Buckets in the rate_limits collection, updated atomically in one round trip"""
+
+    async def take(self, bucket, key):
+        from pymongo import ReturnDocument
+
+        now = datetime.now(timezone.utc)
+        elapsed_seconds = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}
+        refilled = {"$min": [
+            bucket.capacity,
+            {"$add": [{"$ifNull": ["$tokens", bucket.capacity]}, {"$multiply": [elapsed_seconds, bucket.rate]}]},
+        ]}
+        doc = await database.get_collection("rate_limits").find_one_and_update(
+            {"_id": f"{bucket.name}:{key}"},
+            [
+                {"$set": {"tokens": refilled, "updated_at": now}},
+                {"$set": {
+                    "allowed": {"$gte": ["$tokens", 1]},
+                    "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                    # Once full again the document carries no state
+                    "expires_at": now + timedelta(seconds=bucket.capacity / bucket.rate),
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        allowed = doc["allowed"]
+        return allowed, 0.0 if allowed else (1 - doc["tokens"]) / bucket.rate
+
+
+_backend = None
+counters = {"allowed": 0, "rejected_ip": 0, "rejected_email": 0}
+
+
+def get_backend():
+    """Return the configured limiter backend (created on first use)"""
+    global _backend
+    if _backend is None:
+        if RATE_LIMIT_BACKEND == "memory":
+            _backend = MemoryBackend()
+        elif RATE_LIMIT_BACKEND == "mongo":
+            _backend = MongoBackend()
+        else:
+            raise RuntimeError(f"Unknown RATE_LIMIT_BACKEND '{RATE_LIMIT_BACKEND}'")
+    return _backend
+
+
+def client_ip(request):
+    """Address of the client, taking X-Forwarded-For into account when trusted"""
+    if TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            # Counted from the right: the client controls the left-most entries
+            entries = [entry.strip() for entry in forwarded.split(",") if entry.strip()]
+            if entries:
+                return entries[-min(TRUSTED_PROXY_HOPS, len(entries))]
+    return request.client.host if request.client else "unknown"
+
+
+def _too_many(retry_after):
+    return HTTPException(
+        status_code=429,
+        detail="Too many login attempts. Please try again later.",
+        headers={"Retry-After": str(max(1, int(retry_after + 0.999)))}
+    )
+
+
+async def check_login(request, email):
+    """Take a login attempt from the IP and email buckets; raises 429 when either is empty"""
+    backend = get_backend()
+    allowed, retry_after = await backend.take(LOGIN_IP, client_ip(request))
+    if not allowed:
+        counters["rejected_ip"] += 1
+        raise _too_many(retry_after)
+    allowed, retry_after = await backend.take(LOGIN_EMAIL, email.strip().lower())
+    if not allowed:
+        counters["rejected_email"] += 1
+        raise _too_many(retry_after)
+    counters["allowed"] += 1
+
+
+def stats():
+    return {"backend": RATE_LIMIT_BACKEND, **counters}
@@ -0,0 +1,174 @@
+"""
+Faceted submission search for doctors
+Filters on diabetes type, symptoms, medications, lab value ranges and words
+in the notes go into one $match that the compound, multikey and text indexes
+of the submissions collection serve, followed by an index-backed $sort. A
+$facet stage then returns the page of results, the total and the facet counts
+in the same round trip.
+
+Broad searches would otherwise count and facet every match, so only the
+newest SEARCH_COUNT_LIMIT matches reach the $facet stage: past that the total
+is reported as a lower bound ("N+") and the facets describe those matches.
+"""
+
+import os
+from fastapi import HTTPException
+from submissions import LIST_FIELDS
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Deep offsets scan everything they skip; narrow the filters instead
+MAX_OFFSET = 10000
+# Values listed per symptom/medication facet
+FACET_LIMIT = 20
+SEARCH_MAX_TIME_MS = int(os.getenv("SEARCH_MAX_TIME_MS", "5000"))
+# Matches counted and faceted per search
+SEARCH_COUNT_LIMIT = int(os.getenv("SEARCH_COUNT_LIMIT", "10000"))
+
+# Lab value facet buckets: [lower, upper) bounds, open-ended at the top
+BLOOD_GLUCOSE_BOUNDARIES = [0, 70, 100, 126, 180, 250]
+HBA1C_BOUNDARIES = [0, 5.7, 6.5, 8, 10]
+RANGES = {
+    "blood_glucose": BLOOD_GLUCOSE_BOUNDARIES,
+    "hba1c": HBA1C_BOUNDARIES,
+}
+
+
+def build_match(diabetes_type=None, symptoms=None, medications=None, blood_glucose_min=None,
+                blood_glucose_max=None, hba1c_min=None, hba1c_max=None, text=None, patient_id=None,
+                created_from=None, created_to=None):
+    """
+    Mongo filter for a search
+    Several diabetes types match any of them; several symptoms or
+    medications must all be present
+    """
+    query = {}
+    if text:
+        # $text has to be part of the first $match of the pipeline
+        query["$text"] = {"$search": text}
+    if patient_id:
+        query["patient_id"] = patient_id
+    if diabetes_type:
+        query["diabetes_type"] = diabetes_type[0] if len(diabetes_type) == 1 else {"$in": diabetes_type}
+    if symptoms:
+        query["symptoms"] = {"$all": symptoms}
+    if medications:
+        query["medications"] = {"$all": medications}
+    for field, low, high in (
+        ("blood_glucose", blood_glucose_min, blood_glucose_max),
+        ("hba1c", hba1c_min, hba1c_max),
+    ):
+        if low is not None and high is not None and low > high:
+            raise HTTPException(
+                status_code=400,
+                detail=f"{field}_min is greater than {field}_max"
+            )
+        if low is not None or high is not None:
+            query[field] = {}
+            if low is not None:
+                query[field]["$gte"] = low
+            if high is not None:
+                query[field]["$lte"] = high
+    if created_from or created_to:
+        query["created_at"] = {}
+        if created_from:
+            query["created_at"]["$gte"] = created_from
+        if created_to:
+            query["created_at"]["$lt"] = created_to
+    return query
+
+
+def _count_by(expression):
+    # What $sortByCount expands to, ties broken by value for stable output
+    return [
+        {"$group": {"_id": expression, "count": {"$sum": 1}}},
+        {"$sort": {"count": -1, "_id": 1}},
+    ]
+
+
+FACET_FIELDS = ("diabetes_type", "symptoms", "medications", *RANGES)
+
+
+def _count_limit(limit, offset):
+    # The requested page always lies within the counted matches
+    return max(SEARCH_COUNT_LIMIT, offset + limit)
+
+
+def build_pipeline(match, limit, offset):
+    """
+    Aggregation returning one document with results, total and facets
+    One match beyond the count limit is let through to tell a total of
+    exactly the limit from a capped one; the facets drop it again
+    """
+    count_limit = _count_limit(limit, offset)
+    if "$text" in match:
+        sort = {"score": {"$meta": "textScore"}, "created_at": -1, "_id": -1}
+    else:
+        sort = {"created_at": -1, "_id": -1}
+    facets = {
+        "results": [
+            {"$skip": offset},
+            {"$limit": limit},
+            {"$project": {field: 1 for field in LIST_FIELDS}},
+        ],
+        "total": [{"$count": "count"}],
+        "diabetes_type": _count_by("$diabetes_type"),
+    }
+    for field in ("symptoms", "medications"):
+        facets[field] = [
+            {"$project": {field: 1}},
+            {"$unwind": f"${field}"},
+            *_count_by(f"${field}"),
+            {"$limit": FACET_LIMIT},
+        ]
+    for field, boundaries in RANGES.items():
+        facets[field] = [
+            {"$match": {field: {"$type": "number"}}},
+            {"$bucket": {"groupBy": f"${field}", "boundaries": [*boundaries, float("inf")], "default": "other"}},
+        ]
+    for field in FACET_FIELDS:
+        facets[field].insert(0, {"$limit": count_limit})
+    # Sorted before $facet, whose sub-pipelines cannot use indexes: the
+    # created / *_created indexes then supply the order instead of a
+    # blocking in-memory sort of every match, and $limit stops the index
+    # scan once the counted matches have been read
+    return [
+        {"$match": match},
+        {"$sort": sort},
+        {"$limit": count_limit + 1},
+        {"$facet": facets},
+    ]
+
+
+def is_timeout(error):
+    """True if a pymongo error means the search exceeded SEARCH_MAX_TIME_MS"""
+    return getattr(error, "code", None) == 50
+
+
+def _range_facet(buckets, boundaries):
+    counts = {bucket["_id"]: bucket["count"] for bucket in buckets}
+    upper_bounds = [*boundaries[1:], None]
+    return [
+        {"min": low, "max": high, "count": counts.get(low, 0)}
+        for low, high in zip(boundaries, upper_bounds)
+    ]
+
+
+async def search(collection, match, limit=DEFAULT_PAGE_SIZE, offset=0):
+    """
+    Run a search; returns (docs, total, total_capped, facets)
+    total_capped means total is a lower bound (see SEARCH_COUNT_LIMIT)
+    """
+    cursor = collection.aggregate(
+        build_pipeline(match, limit, offset), maxTimeMS=SEARCH_MAX_TIME_MS, allowDiskUse=True
+    )
+    result = (await cursor.to_list(length=1))[0]
+    facets = {
+        field: [{"value": row["_id"], "count": row["count"]} for row in result[field]]
+        for field in ("diabetes_type", "symptoms", "medications")
+    }
+    for field, boundaries in RANGES.items():
+        facets[field] = _range_facet(result[field], boundaries)
+    total = result["total"][0]["count"] if result["total"] else 0
+    count_limit = _count_limit(limit, offset)
+    return result["results"], min(total, count_limit), total > count_limit, facets
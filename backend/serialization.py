@@ -0,0 +1,33 @@
+"""
+Fast JSON responses
+orjson serializes datetimes natively and ObjectIds through a default hook, so
+handlers return MongoDB documents in one pass instead of converting them field
+by field. The response models in server.py describe these payloads in the
+OpenAPI schema; returning a response directly means FastAPI does not
+re-validate them on the way out.
+"""
+
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+# Naive datetimes from MongoDB are UTC; numpy values come from image features
+JSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content):
+    """Serialize content to JSON bytes"""
+    return orjson.dumps(content, default=_default, option=JSON_OPTIONS)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson, accepting ObjectId and datetime values"""
+
+    def render(self, content):
+        return dumps(content)
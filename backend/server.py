@@ -1,18 +1,45 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Query
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
 from datetime import datetime, timezone
-from pydantic import BaseModel, EmailStr
-from typing import List, Optional
-from pymongo import MongoClient
-from passlib.context import CryptContext
-import os
+from vercel_compat import is_serverless
+from pydantic import BaseModel, EmailStr, ValidationError, field_validator, model_validator
+from typing import Dict, List, Optional
+from bson import ObjectId
+import json
+import logging
+from compression import CompressionMiddleware
+from serialization import FastJSONResponse
+import auth
+import bulk_import
+import database
+import events
+import export
+import features
+import images
+import jobs
+import metrics
+import passwords
+import pools
+import ratelimit
+import search
+import stats
+import storage
+import submissions
+import thumbnails
+import trends
+import uploads
+import versions
+
+logger = logging.getLogger(__name__)
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Soin API",
     description="Backend API for Soin APP",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse
 )
 
 # Configure CORS
@@ -22,24 +49,38 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Link", "X-Export-Until"],
 )
 
-# MongoDB connection
-MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
-try:
-    client = MongoClient(MONGO_URL)
-    db = client["soin_healthcare"]
-    users_collection = db["users"]
-    # Test connection
-    client.admin.command('ping')
-    print("✓ MongoDB connected successfully")
-except Exception as e:
-    print(f"✗ MongoDB connection failed: {e}")
-    db = None
-    users_collection = None
-
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Compress large JSON responses (streams and images pass through)
+app.add_middleware(CompressionMiddleware)
+
+# Per-route latency and status metrics (not installed unless enabled)
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
+# MongoDB connection check (non-blocking, handled by the async data layer)
+@app.on_event("startup")
+async def check_database():
+    if await database.ping():
+        print("✓ MongoDB connected successfully")
+        await database.ensure_indexes()
+    else:
+        print("✗ MongoDB connection failed")
+    if not is_serverless():
+        storage.start_garbage_collector()
+        stats.start_reconciler()
+        events.start_change_stream()
+        jobs.start_workers()
+
+@app.on_event("shutdown")
+async def close_database():
+    storage.stop_garbage_collector()
+    stats.stop_reconciler()
+    events.stop_change_stream()
+    jobs.stop_workers()
+    pools.shutdown_all()
+    database.close()
 
 # Pydantic models
 class UserRegister(BaseModel):
@@ -47,12 +88,167 @@ class UserRegister(BaseModel):
     email: EmailStr
     password: str
     age: int
-    role: str  # "patient", "doctor", or "admin"
+    role: str  # "patient" or "doctor"
 
 class UserLogin(BaseModel):
     email: EmailStr
     password: str
 
+class TokenRefresh(BaseModel):
+    refresh_token: str
+
+class SubmissionCreate(BaseModel):
+    blood_glucose: float
+    hba1c: float
+    insulin_level: Optional[float] = None
+    diabetes_type: str
+    symptoms: List[str] = []
+    medications: List[str] = []
+    notes: str = ""
+
+    @field_validator("insulin_level", mode="before")
+    @classmethod
+    def empty_as_none(cls, value):
+        return None if value == "" else value
+
+    @field_validator("symptoms", "medications", mode="before")
+    @classmethod
+    def parse_json_list(cls, value):
+        # Multipart forms send lists as JSON-encoded strings
+        if isinstance(value, str):
+            return json.loads(value) if value else []
+        return value
+
+class SubmissionImportRow(SubmissionCreate):
+    # One NDJSON line of a bulk import; the patient is given by id or email
+    patient_id: Optional[str] = None
+    patient_email: Optional[EmailStr] = None
+    external_id: Optional[str] = None
+    tongue_image: Optional[str] = None  # path inside the images archive
+    created_at: Optional[datetime] = None
+
+    @field_validator("patient_id")
+    @classmethod
+    def valid_object_id(cls, value):
+        if value is not None and not ObjectId.is_valid(value):
+            raise ValueError("Invalid patient id")
+        return value
+
+    @model_validator(mode="after")
+    def patient_given(self):
+        if not self.patient_id and not self.patient_email:
+            raise ValueError("patient_id or patient_email is required")
+        if self.created_at is not None and self.created_at.tzinfo is None:
+            self.created_at = self.created_at.replace(tzinfo=timezone.utc)
+        return self
+
+# Response models (OpenAPI schema of the payloads handlers return)
+class UserOut(BaseModel):
+    id: str
+    email: EmailStr
+    full_name: str
+    role: str
+    approval_status: Optional[str] = None
+
+class LoginResponse(BaseModel):
+    message: str
+    user_id: str
+    email: EmailStr
+    full_name: str
+    role: str
+    access_token: str
+    refresh_token: str
+    token_type: str
+    expires_in: int
+    user: UserOut
+
+class TokenResponse(BaseModel):
+    access_token: str
+    refresh_token: str
+    token_type: str
+    expires_in: int
+
+class PendingDoctorOut(BaseModel):
+    id: str
+    name: str
+    email: EmailStr
+    age: Optional[int] = None
+    created_at: Optional[datetime] = None
+
+class StatsOut(BaseModel):
+    total_patients: int
+    total_doctors: int
+    pending_doctors: int
+    total_admins: int
+    total_submissions: int
+
+class ImportErrorOut(BaseModel):
+    line: int
+    errors: List[dict]
+
+class ImportReportOut(BaseModel):
+    rows: int
+    inserted: int
+    failed: int
+    errors: List[ImportErrorOut]
+    errors_truncated: bool
+
+class SubmissionOut(BaseModel):
+    # Every field but id/created_at can be left out with ?fields=
+    id: str
+    patient_id: Optional[str] = None
+    patient_name: Optional[str] = None
+    patient_email: Optional[str] = None
+    patient_age: Optional[int] = None
+    blood_glucose: Optional[float] = None
+    hba1c: Optional[float] = None
+    insulin_level: Optional[float] = None
+    diabetes_type: Optional[str] = None
+    symptoms: Optional[List[str]] = None
+    medications: Optional[List[str]] = None
+    notes: Optional[str] = None
+    tongue_image_url: Optional[str] = None
+    tongue_features: Optional[dict] = None
+    created_at: datetime
+
+class FacetValueOut(BaseModel):
+    value: Optional[str] = None
+    count: int
+
+class RangeFacetOut(BaseModel):
+    min: float
+    max: Optional[float] = None
+    count: int
+
+class SearchFacetsOut(BaseModel):
+    diabetes_type: List[FacetValueOut]
+    symptoms: List[FacetValueOut]
+    medications: List[FacetValueOut]
+    blood_glucose: List[RangeFacetOut]
+    hba1c: List[RangeFacetOut]
+
+class SearchOut(BaseModel):
+    total: int
+    total_capped: bool = False  # total is a lower bound ("N+")
+    limit: int
+    offset: int
+    results: List[SubmissionOut]
+    facets: SearchFacetsOut
+
+class TrendPointOut(BaseModel):
+    t: datetime
+    value: float
+    min: Optional[float] = None
+    max: Optional[float] = None
+    count: Optional[int] = None
+
+class TrendsOut(BaseModel):
+    patient_id: str
+    interval: str
+    timezone: str
+    downsample: str
+    series: Dict[str, List[TrendPointOut]]
+
 # Create API router
 api_router = APIRouter()
 
@@ -60,8 +256,8 @@ api_router = APIRouter()
 @api_router.get("/health")
 async def health_check():
     """Health check endpoint to verify API is running."""
-    mongo_status = "connected" if db is not None else "disconnected"
-    return JSONResponse(
+    mongo_status = "connected" if await database.ping() else "disconnected"
+    return FastJSONResponse(
         content={
             "status": "healthy",
             "timestamp": datetime.now(timezone.utc).isoformat(),
@@ -76,52 +272,66 @@ async def health_check():
 async def register_user(user: UserRegister):
     """Register a new user."""
     try:
-        # Check if MongoDB is connected
-        if users_collection is None:
-            raise HTTPException(
-                status_code=500, 
-                detail="Database connection not available"
-            )
+        users_collection = database.get_collection("users")
         
-        # Validate role
-        if user.role.lower() not in ["patient", "doctor", "admin"]:
+        # Validate role; admin accounts are only created with create_admin.py
+        if user.role.lower() == "admin":
             raise HTTPException(
-                status_code=400,
-                detail="Invalid role. Must be 'patient', 'doctor', or 'admin'"
+                status_code=403,
+                detail="Admin accounts cannot be registered"
             )
-        
-        # Check if user already exists
-        existing_user = users_collection.find_one({"email": user.email})
-        if existing_user:
+        if user.role.lower() not in ["patient", "doctor"]:
             raise HTTPException(
                 status_code=400,
-                detail="Email already registered"
+                detail="Invalid role. Must be 'patient' or 'doctor'"
             )
         
         # Hash password
-        hashed_password = pwd_context.hash(user.password)
+        hashed_password = await passwords.hash_password(user.password)
         
-        # Create user document
+        # Create user document (doctors need admin approval)
+        role = user.role.lower()
+        approval_status = "pending" if role == "doctor" else "approved"
         user_doc = {
             "full_name": user.full_name,
             "email": user.email,
             "password": hashed_password,
             "age": user.age,
-            "role": user.role.lower(),
+            "role": role,
+            "approval_status": approval_status,
             "created_at": datetime.now(timezone.utc),
             "updated_at": datetime.now(timezone.utc),
             "is_active": True
         }
         
-        # Insert into MongoDB
-        result = users_collection.insert_one(user_doc)
+        # Insert into MongoDB; the unique email index rejects duplicates
+        if not await database.ensure_indexes("users"):
+            # Index not built (see the startup log): check the slow, racy way
+            if await users_collection.find_one({"email": user.email}, {"_id": 1}):
+                raise HTTPException(
+                    status_code=400,
+                    detail="Email already registered"
+                )
+        try:
+            result = await users_collection.insert_one(user_doc)
+        except Exception as e:
+            if database.is_duplicate_key_error(e):
+                raise HTTPException(
+                    status_code=400,
+                    detail="Email already registered"
+                )
+            raise
+        
+        counter = {"patient": "total_patients", "doctor": "pending_doctors"}[role]
+        await stats.record_write("users", **{counter: 1})
         
-        return JSONResponse(
+        return FastJSONResponse(
             content={
                 "message": "Registration successful",
                 "user_id": str(result.inserted_id),
                 "email": user.email,
-                "role": user.role.lower()
+                "role": role,
+                "approval_status": approval_status
             },
             status_code=201
         )
@@ -135,19 +345,19 @@ async def register_user(user: UserRegister):
         )
 
 # User login endpoint
-@api_router.post("/login")
-async def login_user(credentials: UserLogin):
+@api_router.post("/login", response_model=LoginResponse)
+async def login_user(credentials: UserLogin, request: Request):
     """Authenticate user login."""
+    # Throttled before the lookup and bcrypt verify
+    await ratelimit.check_login(request, credentials.email)
     try:
-        # Check if MongoDB is connected
-        if users_collection is None:
-            raise HTTPException(
-                status_code=500,
-                detail="Database connection not available"
-            )
+        users_collection = database.get_collection("users")
         
         # Find user by email
-        user = users_collection.find_one({"email": credentials.email})
+        user = await users_collection.find_one(
+            {"email": credentials.email},
+            {"email": 1, "password": 1, "full_name": 1, "role": 1, "is_active": 1, "approval_status": 1}
+        )
         if not user:
             raise HTTPException(
                 status_code=401,
@@ -155,12 +365,20 @@ async def login_user(credentials: UserLogin):
             )
         
         # Verify password
-        if not pwd_context.verify(credentials.password, user["password"]):
+        valid, new_hash = await passwords.verify_password(credentials.password, user["password"])
+        if not valid:
             raise HTTPException(
                 status_code=401,
                 detail="Invalid email or password"
             )
         
+        # Transparently upgrade the hash if the bcrypt cost changed
+        if new_hash:
+            await users_collection.update_one(
+                {"_id": user["_id"]},
+                {"$set": {"password": new_hash, "updated_at": datetime.now(timezone.utc)}}
+            )
+        
         # Check if account is active
         if not user.get("is_active", True):
             raise HTTPException(
@@ -168,13 +386,26 @@ async def login_user(credentials: UserLogin):
                 detail="Account is disabled"
             )
         
-        return JSONResponse(
+        user_id = str(user["_id"])
+        approval_status = user.get("approval_status", "approved")
+        return FastJSONResponse(
             content={
                 "message": "Login successful",
-                "user_id": str(user["_id"]),
+                "user_id": user_id,
                 "email": user["email"],
                 "full_name": user["full_name"],
-                "role": user["role"]
+                "role": user["role"],
+                "access_token": auth.create_access_token(user_id, user["role"], approval_status == "approved"),
+                "refresh_token": auth.create_refresh_token(user_id),
+                "token_type": "bearer",
+                "expires_in": auth.ACCESS_TOKEN_TTL_SECONDS,
+                "user": {
+                    "id": user_id,
+                    "email": user["email"],
+                    "full_name": user["full_name"],
+                    "role": user["role"],
+                    "approval_status": approval_status
+                }
             },
             status_code=200
         )
@@ -187,6 +418,588 @@ async def login_user(credentials: UserLogin):
             detail=f"Login failed: {str(e)}"
         )
 
+# Token refresh endpoint
+@api_router.post("/refresh", response_model=TokenResponse)
+async def refresh_token(body: TokenRefresh):
+    """Exchange a refresh token for a new access token."""
+    payload = auth.decode_token(body.refresh_token, expected_type="refresh")
+    try:
+        users_collection = database.get_collection("users")
+        
+        # Refresh is the one place tokens are re-checked against the database
+        user = await users_collection.find_one(
+            {"_id": ObjectId(payload["sub"])},
+            {"role": 1, "is_active": 1, "approval_status": 1}
+        )
+        if not user:
+            raise HTTPException(
+                status_code=401,
+                detail="User no longer exists"
+            )
+        if not user.get("is_active", True):
+            auth.revoke_user(payload["sub"])
+            raise HTTPException(
+                status_code=403,
+                detail="Account is disabled"
+            )
+        
+        return FastJSONResponse(
+            content={
+                "access_token": auth.create_access_token(
+                    payload["sub"], user["role"], user.get("approval_status", "approved") == "approved"
+                ),
+                "refresh_token": auth.create_refresh_token(payload["sub"]),
+                "token_type": "bearer",
+                "expires_in": auth.ACCESS_TOKEN_TTL_SECONDS
+            },
+            status_code=200
+        )
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Token refresh failed: {str(e)}"
+        )
+
+# Enable/disable a user account (admin only)
+@api_router.post("/admin/users/{user_id}/status")
+async def set_user_status(
+    user_id: str,
+    active: bool,
+    current_user: dict = Depends(auth.require_roles("admin"))
+):
+    """Enable or disable a user account; disabling revokes its tokens immediately."""
+    if not ObjectId.is_valid(user_id):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid user id"
+        )
+    try:
+        users_collection = database.get_collection("users")
+        result = await users_collection.update_one(
+            {"_id": ObjectId(user_id)},
+            {"$set": {"is_active": active, "updated_at": datetime.now(timezone.utc)}}
+        )
+        if result.matched_count == 0:
+            raise HTTPException(
+                status_code=404,
+                detail="User not found"
+            )
+        
+        await stats.record_write("users")
+        if not active:
+            auth.revoke_user(user_id)
+        
+        return FastJSONResponse(
+            content={
+                "message": "User enabled" if active else "User disabled",
+                "user_id": user_id,
+                "is_active": active
+            },
+            status_code=200
+        )
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Status update failed: {str(e)}"
+        )
+
+async def discard_upload(image, image_name):
+    """Undo a streamed upload after its submission failed."""
+    if image_name is not None:
+        await storage.release(image_name)
+    elif image is not None:
+        await uploads.discard_image(image)
+
+# Admin statistics endpoint
+@api_router.get("/admin/stats", response_model=StatsOut)
+async def get_admin_stats(request: Request, current_user: dict = Depends(auth.require_roles("admin"))):
+    """Return platform counters from the materialized stats document (ETag/Last-Modified aware)."""
+    try:
+        snapshot = await stats.get_snapshot()
+        cache_headers = versions.validators(snapshot["version"], snapshot["updated_at"], "stats")
+        if versions.is_not_modified(request, cache_headers):
+            return Response(status_code=304, headers=cache_headers)
+        return FastJSONResponse(content=snapshot["counts"], headers=cache_headers)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to fetch stats: {str(e)}"
+        )
+
+# Login throttling counters
+@api_router.get("/admin/rate-limits")
+async def get_rate_limit_stats(current_user: dict = Depends(auth.require_roles("admin"))):
+    """Return login throttling counters of this process."""
+    return FastJSONResponse(content=ratelimit.stats())
+
+# Pending doctors endpoint
+@api_router.get("/admin/pending-doctors", response_model=List[PendingDoctorOut])
+async def list_pending_doctors(request: Request, current_user: dict = Depends(auth.require_roles("admin"))):
+    """List doctor accounts waiting for approval (ETag/Last-Modified aware)."""
+    try:
+        version, updated_at = await versions.get_version("users")
+        cache_headers = versions.validators(version, updated_at, "pending-doctors")
+        if versions.is_not_modified(request, cache_headers):
+            return Response(status_code=304, headers=cache_headers)
+        doctors = await database.get_collection("users").find(
+            {"role": "doctor", "approval_status": "pending"},
+            {"full_name": 1, "email": 1, "age": 1, "created_at": 1}
+        ).sort("created_at", 1).to_list(length=None)
+        return FastJSONResponse(content=[
+            {
+                "id": str(doctor["_id"]),
+                "name": doctor["full_name"],
+                "email": doctor["email"],
+                "age": doctor.get("age"),
+                "created_at": doctor.get("created_at")
+            }
+            for doctor in doctors
+        ], headers=cache_headers)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to fetch pending doctors: {str(e)}"
+        )
+
+# Doctor approval endpoint
+@api_router.post("/admin/approve-doctor/{doctor_id}")
+async def approve_doctor(
+    doctor_id: str,
+    approve: bool,
+    current_user: dict = Depends(auth.require_roles("admin"))
+):
+    """Approve or reject a pending doctor account."""
+    if not ObjectId.is_valid(doctor_id):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid doctor id"
+        )
+    try:
+        # Only a pending doctor can change state, so counters move exactly once
+        doctor = await database.get_collection("users").find_one_and_update(
+            {"_id": ObjectId(doctor_id), "role": "doctor", "approval_status": "pending"},
+            {"$set": {
+                "approval_status": "approved" if approve else "rejected",
+                "updated_at": datetime.now(timezone.utc)
+            }},
+            projection={"_id": 1}
+        )
+        if doctor is None:
+            raise HTTPException(
+                status_code=404,
+                detail="Pending doctor not found"
+            )
+        
+        if approve:
+            await stats.record_write("users", pending_doctors=-1, total_doctors=1)
+        else:
+            auth.revoke_user(doctor_id)
+            await stats.record_write("users", pending_doctors=-1)
+        
+        return FastJSONResponse(
+            content={
+                "message": "Doctor approved" if approve else "Doctor rejected",
+                "doctor_id": doctor_id,
+                "approval_status": "approved" if approve else "rejected"
+            },
+            status_code=200
+        )
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Doctor approval failed: {str(e)}"
+        )
+
+# Data export endpoint
+@api_router.get("/admin/export-data")
+async def export_data(
+    format: str = Query("zip", pattern="^(zip|parquet|arrow)$"),
+    since: Optional[datetime] = None,
+    current_user: dict = Depends(auth.require_roles("admin"))
+):
+    """
+    Stream the platform data.
+    zip: users, submissions and tongue images. parquet/arrow: submissions in
+    columnar form, limited to those updated since the given timestamp; pass
+    the returned X-Export-Until value as the next export's since.
+    """
+    now = datetime.now(timezone.utc)
+    if format == "zip":
+        filename = f"soin_export_{now.date().isoformat()}.zip"
+        return StreamingResponse(
+            export.stream_export_zip(),
+            media_type="application/zip",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        )
+
+    # Checked before streaming: an import error inside the body would abort
+    # the download after a 200 had already been sent
+    if not export.is_columnar_available():
+        raise HTTPException(
+            status_code=501,
+            detail="Columnar export needs pandas and pyarrow, which this deployment does not include"
+        )
+    media_type, extension = export.COLUMNAR_FORMATS[format]
+    query = export.build_changes_query(since, now) if since else {}
+    filename = f"soin_submissions_{now.strftime('%Y%m%dT%H%M%SZ')}.{extension}"
+    return StreamingResponse(
+        export.stream_columnar(format, query),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Export-Until": now.isoformat()
+        }
+    )
+
+# Bulk import endpoint
+@api_router.post("/admin/import-submissions", response_model=ImportReportOut)
+async def import_submissions(request: Request, current_user: dict = Depends(auth.require_roles("admin"))):
+    """
+    Import historical submissions from NDJSON, one JSON object per line.
+    Send application/x-ndjson as the body, or a multipart form with a
+    "submissions" NDJSON part and an optional "images" ZIP archive that the
+    rows' tongue_image paths refer to. Invalid rows are reported by line
+    number; rows whose external_id was already imported are skipped.
+    """
+    try:
+        await database.ensure_indexes("submissions")
+        report = await bulk_import.import_request(request, SubmissionImportRow)
+        return FastJSONResponse(content=report, status_code=200)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Import failed: {str(e)}"
+        )
+
+# Patient submission endpoint
+@api_router.post("/submissions")
+async def create_submission(
+    request: Request,
+    current_user: dict = Depends(auth.require_roles("patient"))
+):
+    """Create a submission from a multipart form with a streamed tongue image."""
+    fields, image = await uploads.receive_image_form(request, "tongue_image")
+    image_name = None
+    try:
+        if image is None:
+            raise HTTPException(
+                status_code=400,
+                detail="tongue_image is required"
+            )
+        try:
+            submission = SubmissionCreate(**fields)
+        except ValidationError as e:
+            raise RequestValidationError(e.errors(include_url=False, include_context=False))
+        
+        # Deduplicated, content-addressed storage of the image
+        image_name = await storage.commit_upload(image)
+        
+        users_collection = database.get_collection("users")
+        patient = await users_collection.find_one(
+            {"_id": ObjectId(current_user["sub"])},
+            {"full_name": 1, "email": 1, "age": 1}
+        )
+        if not patient:
+            raise HTTPException(
+                status_code=401,
+                detail="User no longer exists"
+            )
+        
+        now = datetime.now(timezone.utc)
+        submission_doc = {
+            "patient_id": current_user["sub"],
+            "patient_name": patient["full_name"],
+            "patient_email": patient["email"],
+            "patient_age": patient.get("age"),
+            **submission.model_dump(),
+            "tongue_image_filename": image_name,
+            "tongue_image_url": f"/images/{image_name}",
+            "tongue_image_size": image["size"],
+            "created_at": now,
+            "updated_at": now
+        }
+        result = await database.get_collection("submissions").insert_one(submission_doc)
+    
+    except (HTTPException, RequestValidationError):
+        await discard_upload(image, image_name)
+        raise
+    except Exception as e:
+        await discard_upload(image, image_name)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Submission failed: {str(e)}"
+        )
+    
+    # The submission is saved and owns its image reference from here on
+    await stats.record_write("submissions", total_submissions=1)
+    events.publish_submission("created", submission_doc)
+    # Follow-up work runs in job workers, after this response
+    try:
+        await thumbnails.enqueue(image_name)
+        await features.enqueue(result.inserted_id, image_name)
+    except Exception as e:
+        # Thumbnails render lazily and features.py backfills features
+        print(f"✗ Could not queue follow-up jobs for {result.inserted_id}: {e}")
+    
+    return FastJSONResponse(
+        content={
+            "message": "Submission saved successfully",
+            "id": str(result.inserted_id),
+            "tongue_image_url": submission_doc["tongue_image_url"],
+            "created_at": now.isoformat()
+        },
+        status_code=200
+    )
+
+# Submission listing endpoint
+@api_router.get("/submissions", response_model=List[SubmissionOut])
+async def list_submissions(
+    request: Request,
+    limit: int = Query(submissions.DEFAULT_PAGE_SIZE, ge=1, le=submissions.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    patient_id: Optional[str] = None,
+    diabetes_type: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    patient_search: Optional[str] = Query(None, max_length=100),
+    fields: Optional[str] = None,
+    current_user: dict = Depends(auth.require_roles("patient", "doctor", "admin"))
+):
+    """
+    List submissions, newest first, one page at a time.
+    The next page's cursor is returned in the X-Next-Cursor and Link headers;
+    send it with the same filters. patient_search matches part of the
+    patient's name or email.
+    Unchanged pages are answered with 304 via ETag/Last-Modified.
+    """
+    # Patients only ever see their own submissions
+    if current_user["role"] == "patient":
+        patient_id = current_user["sub"]
+    
+    query = submissions.build_query(
+        patient_id, diabetes_type, created_from, created_to, cursor, patient_search=patient_search
+    )
+    projection = submissions.build_projection(fields)
+    try:
+        version, updated_at = await versions.get_version("submissions")
+        headers = versions.validators(version, updated_at, current_user["role"], patient_id, request.url.query)
+        if versions.is_not_modified(request, headers):
+            return Response(status_code=304, headers=headers)
+        docs, next_cursor = await submissions.fetch_page(
+            database.get_collection("submissions"), query, projection, limit
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to fetch submissions: {str(e)}"
+        )
+    
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+    return FastJSONResponse(
+        content=[submissions.serialize_submission(doc) for doc in docs],
+        headers=headers
+    )
+
+# Submission search endpoint
+@api_router.get("/submissions/search", response_model=SearchOut)
+async def search_submissions(
+    request: Request,
+    diabetes_type: Optional[List[str]] = Query(None),
+    symptoms: Optional[List[str]] = Query(None),
+    medications: Optional[List[str]] = Query(None),
+    blood_glucose_min: Optional[float] = None,
+    blood_glucose_max: Optional[float] = None,
+    hba1c_min: Optional[float] = None,
+    hba1c_max: Optional[float] = None,
+    q: Optional[str] = Query(None, max_length=200),
+    patient_id: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    limit: int = Query(search.DEFAULT_PAGE_SIZE, ge=1, le=search.MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0, le=search.MAX_OFFSET),
+    current_user: dict = Depends(auth.require_roles("doctor", "admin"))
+):
+    """
+    Search submissions with facet counts, newest (or best text match) first.
+    Repeat diabetes_type to match any of several types, and symptoms or
+    medications to require all of them; q searches words in the notes.
+    Facets count the submissions matching every filter. Past
+    SEARCH_COUNT_LIMIT matches only the newest are counted: total_capped is
+    then true and total is a lower bound.
+    """
+    match = search.build_match(
+        diabetes_type, symptoms, medications, blood_glucose_min, blood_glucose_max,
+        hba1c_min, hba1c_max, q, patient_id, created_from, created_to
+    )
+    try:
+        version, updated_at = await versions.get_version("submissions")
+        headers = versions.validators(version, updated_at, "search", request.url.query)
+        if versions.is_not_modified(request, headers):
+            return Response(status_code=304, headers=headers)
+        if q:
+            # $text needs the notes_text index (see database.get_collection)
+            await database.ensure_indexes("submissions")
+        docs, total, total_capped, facets = await search.search(
+            database.get_collection("submissions"), match, limit, offset
+        )
+    except Exception as e:
+        if search.is_timeout(e):
+            raise HTTPException(
+                status_code=504,
+                detail="Search took too long, please narrow the filters"
+            )
+        raise HTTPException(
+            status_code=500,
+            detail=f"Search failed: {str(e)}"
+        )
+    return FastJSONResponse(
+        content={
+            "total": total,
+            "total_capped": total_capped,
+            "limit": limit,
+            "offset": offset,
+            "results": [submissions.serialize_submission(doc) for doc in docs],
+            "facets": facets
+        },
+        headers=headers
+    )
+
+# Glucose/HbA1c trend endpoint
+@api_router.get("/submissions/trends", response_model=TrendsOut)
+async def get_trends(
+    request: Request,
+    patient_id: Optional[str] = None,
+    interval: str = Query("day", pattern="^(raw|day|week|month)$"),
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    tz: str = "UTC",
+    max_points: int = Query(trends.DEFAULT_MAX_POINTS, ge=3, le=trends.MAX_POINTS),
+    downsample: str = Query("lttb", pattern="^(lttb|none)$"),
+    current_user: dict = Depends(auth.require_roles("patient", "doctor", "admin"))
+):
+    """
+    Blood glucose and HbA1c series of one patient, oldest first.
+    Values are averaged per day/week/month (in the tz time zone) or returned
+    raw. Series longer than max_points are reduced with LTTB, or cut to the
+    most recent max_points with downsample=none.
+    """
+    # Patients only ever see their own trends
+    if current_user["role"] == "patient":
+        patient_id = current_user["sub"]
+    if not patient_id:
+        raise HTTPException(
+            status_code=400,
+            detail="patient_id is required"
+        )
+    trends.validate_timezone(tz)
+    try:
+        version, updated_at = await versions.get_version("submissions")
+        headers = versions.validators(version, updated_at, "trends", patient_id, request.url.query)
+        if versions.is_not_modified(request, headers):
+            return Response(status_code=304, headers=headers)
+        series = await trends.get_trends(
+            database.get_collection("submissions"), patient_id, interval,
+            created_from, created_to, tz, max_points, lttb=downsample == "lttb"
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to fetch trends: {str(e)}"
+        )
+    return FastJSONResponse(
+        content={
+            "patient_id": patient_id,
+            "interval": interval,
+            "timezone": tz,
+            "downsample": downsample,
+            "series": series
+        },
+        headers=headers
+    )
+
+# Real-time submission feed (Server-Sent Events)
+@api_router.get("/submissions/stream")
+async def stream_submissions(request: Request, current_user: dict = Depends(auth.get_stream_user)):
+    """
+    Push submission.created/submission.updated events to doctors and admins.
+    EventSource clients pass their access token as ?access_token=; the stream
+    ends when the token expires or is revoked, and "resync" asks the client to
+    refetch the list.
+    """
+    auth.check_roles(current_user, ("doctor", "admin"))
+    if is_serverless():
+        raise HTTPException(
+            status_code=501,
+            detail="Event streaming is not available in serverless deployments"
+        )
+    return StreamingResponse(
+        events.stream(
+            lambda: auth.is_still_valid(current_user),
+            resync="last-event-id" in request.headers
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Prometheus metrics endpoint
+@api_router.get("/metrics")
+async def get_metrics(request: Request):
+    """Expose metrics in the Prometheus text format (METRICS_ENABLED=1)."""
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(
+            status_code=404,
+            detail="Metrics are disabled"
+        )
+    if metrics.METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {metrics.METRICS_TOKEN}":
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid metrics token",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    try:
+        await jobs.refresh_depth()
+    except Exception as e:
+        print(f"✗ Job queue depth unavailable: {e}")
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Image serving endpoint (public: rendered directly by <img> tags)
+@api_router.api_route("/images/{filename}", methods=["GET", "HEAD"])
+async def get_image(filename: str, request: Request, variant: Optional[str] = None):
+    """Serve an uploaded image (or a thumbnail variant) with ETag, Range and long-lived caching support."""
+    name = images.validate_image_name(filename)
+    if variant is not None:
+        if variant not in thumbnails.THUMBNAIL_SIZES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown variant. Must be one of: {', '.join(thumbnails.THUMBNAIL_SIZES)}"
+            )
+        try:
+            name = await thumbnails.get_thumbnail(filename, variant)
+        except Exception as e:
+            # Images Pillow cannot decode are served as-is, from the original's
+            # URL: the variant URL is cached as immutable, so it must not hold
+            # the full-size image
+            logger.warning("Thumbnail generation failed for %s: %s", filename, e)
+            return RedirectResponse(
+                request.url.remove_query_params("variant"),
+                status_code=307,
+                headers={"cache-control": "no-store"}
+            )
+    return await images.image_response(request, name)
+
 # Include router in app
 app.include_router(api_router, prefix="/api")
 
@@ -0,0 +1,126 @@
+"""
+Materialized admin statistics
+Counters live in a single document that is updated incrementally on
+register/approve/submit, so reading them is O(1). A periodic reconciliation
+job recounts the collections to correct any drift, and an in-process TTL
+cache absorbs repeated dashboard loads. The document's version field changes
+with every update and backs the endpoint's ETag.
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+import database
+import versions
+
+STATS_ID = "global"
+STATS_CACHE_TTL_SECONDS = float(os.getenv("STATS_CACHE_TTL_SECONDS", "5"))
+STATS_RECONCILE_INTERVAL_SECONDS = int(os.getenv("STATS_RECONCILE_INTERVAL_SECONDS", "900"))
+
+COUNTERS = ["total_patients", "total_doctors", "pending_doctors", "total_admins", "total_submissions"]
+
+_cache = None
+_cache_expires = 0.0
+_reconcile_task = None
+
+
+def _stats():
+    return database.get_collection("stats")
+
+
+def invalidate_cache():
+    global _cache
+    _cache = None
+
+
+async def increment(**counters):
+    """Apply counter deltas, e.g. increment(total_patients=1)"""
+    await _stats().update_one(
+        {"_id": STATS_ID},
+        {"$inc": {**counters, "version": 1}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    invalidate_cache()
+
+
+async def record_write(collection, **counters):
+    """
+    Apply counter deltas and bump a collection's version after a committed
+    write. Failures are logged, not raised: the write itself stands, and
+    reconcile() corrects counters that missed an update.
+    """
+    if counters:
+        try:
+            await increment(**counters)
+        except Exception as e:
+            print(f"✗ Could not update stats after a {collection} write: {e}")
+    try:
+        await versions.bump(collection)
+    except Exception as e:
+        print(f"✗ Could not bump the {collection} version: {e}")
+
+
+async def reconcile():
+    """Recount every counter from the source collections and store the result"""
+    users = database.get_collection("users")
+    counts = dict(zip(COUNTERS, await asyncio.gather(
+        users.count_documents({"role": "patient"}),
+        users.count_documents({"role": "doctor", "approval_status": {"$in": ["approved", None]}}),
+        users.count_documents({"role": "doctor", "approval_status": "pending"}),
+        users.count_documents({"role": "admin"}),
+        database.get_collection("submissions").estimated_document_count(),
+    )))
+    now = datetime.now(timezone.utc)
+    await _stats().update_one(
+        {"_id": STATS_ID},
+        {"$set": {**counts, "updated_at": now, "reconciled_at": now}, "$inc": {"version": 1}},
+        upsert=True
+    )
+    invalidate_cache()
+    return counts
+
+
+async def get_snapshot():
+    """
+    Current counters with the document's version and updated_at, served from
+    the TTL cache when fresh
+    """
+    global _cache, _cache_expires
+    if _cache is not None and time.monotonic() < _cache_expires:
+        return _cache
+    doc = await _stats().find_one({"_id": STATS_ID})
+    if doc is None:
+        # First use: seed the document from the collections
+        await reconcile()
+        doc = await _stats().find_one({"_id": STATS_ID})
+    _cache = {
+        "counts": {counter: max(0, doc.get(counter, 0)) for counter in COUNTERS},
+        "version": doc.get("version", 0),
+        "updated_at": doc.get("updated_at"),
+    }
+    _cache_expires = time.monotonic() + STATS_CACHE_TTL_SECONDS
+    return _cache
+
+
+async def _reconcile_loop():
+    while True:
+        await asyncio.sleep(STATS_RECONCILE_INTERVAL_SECONDS)
+        try:
+            await reconcile()
+        except Exception as e:
+            print(f"✗ Stats reconciliation failed: {e}")
+
+
+def start_reconciler():
+    """Run reconciliation periodically in the background of this process"""
+    global _reconcile_task
+    if _reconcile_task is None:
+        _reconcile_task = asyncio.get_running_loop().create_task(_reconcile_loop())
+
+
+def stop_reconciler():
+    global _reconcile_task
+    if _reconcile_task is not None:
+        _reconcile_task.cancel()
+        _reconcile_task = None
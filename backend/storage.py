@@ -0,0 +1,543 @@
+"""
+Content-addressed image storage with pluggable backends
+Images are stored under the SHA-256 of their content, so identical uploads are
+stored once and every image URL is immutable. Reference counts live in the
+image_blobs collection; blobs nobody references are removed by a background
+garbage collection sweep after a grace period.
+
+Backends (STORAGE_BACKEND):
+- "local": files under vercel_compat.get_upload_directory() (default)
+- "s3": an S3-compatible bucket; set S3_ENDPOINT_URL to use MinIO, LocalStack
+  or another local S3 stand-in
+"""
+
+import asyncio
+import functools
+import os
+import re
+import shutil
+import tempfile
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from starlette.concurrency import run_in_threadpool
+import database
+from vercel_compat import FILE_STORAGE_WARNING, get_upload_directory, is_serverless
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_PREFIX = os.getenv("S3_PREFIX", "tongue_images/")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_REGION = os.getenv("S3_REGION") or None
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "20"))
+# Multipart part size; S3 requires at least 5 MiB for every part but the last
+S3_PART_SIZE = max(int(os.getenv("S3_PART_SIZE", str(8 * 1024 * 1024))), 5 * 1024 * 1024)
+# Parts are spooled to a temporary file once they grow past this many bytes
+S3_SPOOL_MEMORY_BYTES = int(os.getenv("S3_SPOOL_MEMORY_BYTES", str(256 * 1024)))
+
+IMAGE_GC_GRACE_SECONDS = int(os.getenv("IMAGE_GC_GRACE_SECONDS", str(24 * 3600)))
+IMAGE_GC_INTERVAL_SECONDS = int(os.getenv("IMAGE_GC_INTERVAL_SECONDS", "3600"))
+READ_CHUNK_SIZE = 64 * 1024
+
+# Names of content-addressed blobs: <sha256>.<extension>
+BLOB_NAME = re.compile(r"^([0-9a-f]{64})\.[a-z0-9]+$")
+
+_backend = None
+_gc_task = None
+
+
+class LocalUpload:
+    """An upload being written to a temporary file next to the final blobs"""
+
+    def __init__(self, root, extension):
+        self.root = root
+        self.path = root / f".{uuid.uuid4()}{extension}.part"
+        self._file = open(self.path, "wb")
+
+    async def write(self, chunk):
+        await run_in_threadpool(self._file.write, chunk)
+
+    def _place(self, destination):
+        self._file.close()
+        if destination.exists():
+            os.remove(self.path)
+        else:
+            os.replace(self.path, destination)
+
+    async def commit(self, name):
+        """Move the upload into place unless an identical blob is already there"""
+        await run_in_threadpool(self._place, self.root / name)
+
+    async def abort(self):
+        self._file.close()
+        await run_in_threadpool(remove_local_file, self.path)
+
+
+class LocalStorage:
+    """Images on the local filesystem"""
+
+    def __init__(self, root=None):
+        self.root = Path(root) if root else get_upload_directory()
+
+    def local_path(self, name):
+        """Path of a stored object for zero-copy serving (None if not local)"""
+        return self.root / name
+
+    async def open_upload(self, extension, content_type):
+        return await run_in_threadpool(LocalUpload, self.root, extension)
+
+    async def stat(self, name):
+        """Size/modification info of a stored object, or None if missing"""
+        try:
+            stat_result = await run_in_threadpool(os.stat, self.root / name)
+        except FileNotFoundError:
+            return None
+        return {"size": stat_result.st_size, "modified": stat_result.st_mtime_ns, "etag": None}
+
+    async def iter_range(self, name, start, end):
+        """Yield the bytes start..end (inclusive) of a stored object"""
+        fd = await run_in_threadpool(os.open, self.root / name, os.O_RDONLY)
+        try:
+            position = start
+            while position <= end:
+                chunk = await run_in_threadpool(os.pread, fd, min(READ_CHUNK_SIZE, end - position + 1), position)
+                if not chunk:
+                    break
+                position += len(chunk)
+                yield chunk
+        finally:
+            os.close(fd)
+
+    @asynccontextmanager
+    async def local_copy(self, name):
+        """Context manager yielding a local file path with the object's content"""
+        yield self.root / name
+
+    async def put_file(self, name, source, content_type):
+        """Store a local file (which is consumed) under name"""
+        destination = self.root / name
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        await run_in_threadpool(shutil.move, source, destination)
+
+    async def delete(self, name):
+        await run_in_threadpool(remove_local_file, self.root / name)
+
+    def _trash_path(self, name):
+        return self.root / f".{name}.gc"
+
+    async def quarantine(self, name):
+        """Move a blob aside before its record is deleted; False if missing"""
+        def move():
+            try:
+                os.replace(self.root / name, self._trash_path(name))
+                return True
+            except FileNotFoundError:
+                return False
+        return await run_in_threadpool(move)
+
+    async def restore(self, name):
+        """Undo quarantine() for a blob that turned out to be referenced"""
+        def move():
+            if (self.root / name).exists():
+                # A new upload already put the (identical) content back
+                remove_local_file(self._trash_path(name))
+            else:
+                os.replace(self._trash_path(name), self.root / name)
+        await run_in_threadpool(move)
+
+    async def purge(self, name):
+        """Permanently delete a quarantined blob"""
+        await run_in_threadpool(remove_local_file, self._trash_path(name))
+
+    async def list_sweepable(self, cutoff):
+        """Blob names and leftover temporary objects older than cutoff (POSIX time)"""
+        def scan():
+            blobs = []
+            leftovers = []
+            with os.scandir(self.root) as entries:
+                for entry in entries:
+                    if not entry.is_file() or entry.stat().st_mtime >= cutoff:
+                        continue
+                    if BLOB_NAME.match(entry.name):
+                        blobs.append(entry.name)
+                    elif entry.name.startswith(".") and entry.name.endswith((".part", ".gc")):
+                        leftovers.append(entry.name)
+            return blobs, leftovers
+        return await run_in_threadpool(scan)
+
+
+class S3Upload:
+    """
+    An upload streamed to S3
+    Uploads smaller than one part go to their final key in a single PUT;
+    larger ones use a multipart upload to a temporary key that is copied
+    server-side once the content hash (and so the final key) is known. The
+    part being filled is spooled to disk past S3_SPOOL_MEMORY_BYTES, so
+    memory per upload stays flat whatever S3_PART_SIZE is.
+    """
+
+    def __init__(self, storage, extension, content_type):
+        self.storage = storage
+        self.content_type = content_type
+        self.temporary_key = storage.key(f"tmp/{uuid.uuid4()}{extension}")
+        self._part = tempfile.SpooledTemporaryFile(max_size=S3_SPOOL_MEMORY_BYTES)
+        self._part_size = 0
+        self._parts = []
+        self._upload_id = None
+
+    async def _call(self, method, **kwargs):
+        return await self.storage.call(method, **kwargs)
+
+    def _take_part(self):
+        """The filled part, rewound for reading; writes go to a fresh one"""
+        part = self._part
+        part.seek(0)
+        self._part = tempfile.SpooledTemporaryFile(max_size=S3_SPOOL_MEMORY_BYTES)
+        self._part_size = 0
+        return part
+
+    async def _upload_part(self):
+        if self._upload_id is None:
+            response = await self._call(
+                "create_multipart_upload",
+                Bucket=self.storage.bucket, Key=self.temporary_key, ContentType=self.content_type
+            )
+            self._upload_id = response["UploadId"]
+        part_number = len(self._parts) + 1
+        with self._take_part() as body:
+            response = await self._call(
+                "upload_part",
+                Bucket=self.storage.bucket, Key=self.temporary_key, UploadId=self._upload_id,
+                PartNumber=part_number, Body=body
+            )
+        self._parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+
+    async def write(self, chunk):
+        # A part past the spool threshold is written to disk
+        await run_in_threadpool(self._part.write, chunk)
+        self._part_size += len(chunk)
+        if self._part_size >= S3_PART_SIZE:
+            await self._upload_part()
+
+    async def commit(self, name):
+        bucket = self.storage.bucket
+        final_key = self.storage.key(name)
+        if self._upload_id is None:
+            with self._take_part() as body:
+                if await self.storage.stat(name) is None:
+                    await self._call(
+                        "put_object",
+                        Bucket=bucket, Key=final_key, Body=body, ContentType=self.content_type
+                    )
+            self._part.close()
+            return
+
+        if self._part_size:
+            await self._upload_part()
+        self._part.close()
+        await self._call(
+            "complete_multipart_upload",
+            Bucket=bucket, Key=self.temporary_key, UploadId=self._upload_id,
+            MultipartUpload={"Parts": self._parts}
+        )
+        if await self.storage.stat(name) is None:
+            await self._call(
+                "copy_object",
+                Bucket=bucket, Key=final_key, CopySource={"Bucket": bucket, "Key": self.temporary_key}
+            )
+        await self._call("delete_object", Bucket=bucket, Key=self.temporary_key)
+
+    async def abort(self):
+        self._part.close()
+        if self._upload_id is not None:
+            await self._call(
+                "abort_multipart_upload",
+                Bucket=self.storage.bucket, Key=self.temporary_key, UploadId=self._upload_id
+            )
+
+
+class S3Storage:
+    """
+    Images in an S3-compatible bucket
+    One boto3 client (thread-safe, with a shared connection pool) is reused
+    for every request; blocking calls run in the threadpool.
+    """
+
+    def __init__(self, bucket=S3_BUCKET, prefix=S3_PREFIX, endpoint_url=S3_ENDPOINT_URL, region=S3_REGION):
+        if not bucket:
+            raise RuntimeError("S3_BUCKET must be set when STORAGE_BACKEND=s3")
+        # Deferred import: boto3 is only loaded when the S3 backend is used
+        import boto3
+        from botocore.config import Config
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            config=Config(
+                max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                retries={"max_attempts": 5, "mode": "adaptive"},
+                tcp_keepalive=True,
+            ),
+        )
+
+    def key(self, name):
+        return f"{self.prefix}{name}"
+
+    async def call(self, method, **kwargs):
+        return await run_in_threadpool(functools.partial(getattr(self.client, method), **kwargs))
+
+    def local_path(self, name):
+        return None
+
+    async def open_upload(self, extension, content_type):
+        return S3Upload(self, extension, content_type)
+
+    async def stat(self, name):
+        try:
+            response = await self.call("head_object", Bucket=self.bucket, Key=self.key(name))
+        except Exception as e:
+            if _is_not_found(e):
+                return None
+            raise
+        return {
+            "size": response["ContentLength"],
+            "modified": response["LastModified"].timestamp(),
+            "etag": response.get("ETag"),
+        }
+
+    async def iter_range(self, name, start, end):
+        response = await self.call(
+            "get_object", Bucket=self.bucket, Key=self.key(name), Range=f"bytes={start}-{end}"
+        )
+        body = response["Body"]
+        try:
+            while True:
+                chunk = await run_in_threadpool(body.read, READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+    @asynccontextmanager
+    async def local_copy(self, name):
+        fd, path = tempfile.mkstemp(suffix=Path(name).suffix)
+        os.close(fd)
+        try:
+            await run_in_threadpool(self.client.download_file, self.bucket, self.key(name), path)
+            yield Path(path)
+        finally:
+            remove_local_file(path)
+
+    async def put_file(self, name, source, content_type):
+        try:
+            await run_in_threadpool(
+                self.client.upload_file, str(source), self.bucket, self.key(name),
+                ExtraArgs={"ContentType": content_type}
+            )
+        finally:
+            remove_local_file(source)
+
+    async def delete(self, name):
+        await self.call("delete_object", Bucket=self.bucket, Key=self.key(name))
+
+    async def quarantine(self, name):
+        try:
+            await self.call(
+                "copy_object",
+                Bucket=self.bucket, Key=self.key(f"trash/{name}"),
+                CopySource={"Bucket": self.bucket, "Key": self.key(name)}
+            )
+        except Exception as e:
+            if _is_not_found(e):
+                return False
+            raise
+        await self.delete(name)
+        return True
+
+    async def restore(self, name):
+        if await self.stat(name) is None:
+            await self.call(
+                "copy_object",
+                Bucket=self.bucket, Key=self.key(name),
+                CopySource={"Bucket": self.bucket, "Key": self.key(f"trash/{name}")}
+            )
+        await self.purge(name)
+
+    async def purge(self, name):
+        await self.delete(f"trash/{name}")
+
+    async def list_sweepable(self, cutoff):
+        def scan():
+            blobs = []
+            leftovers = []
+            paginator = self.client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+                for item in page.get("Contents", []):
+                    if item["LastModified"].timestamp() >= cutoff:
+                        continue
+                    name = item["Key"][len(self.prefix):]
+                    if BLOB_NAME.match(name):
+                        blobs.append(name)
+                    elif name.startswith(("tmp/", "trash/")):
+                        leftovers.append(name)
+            # Multipart uploads that were never completed or aborted
+            uploads = self.client.list_multipart_uploads(Bucket=self.bucket, Prefix=self.key("tmp/"))
+            for upload in uploads.get("Uploads", []):
+                if upload["Initiated"].timestamp() < cutoff:
+                    self.client.abort_multipart_upload(
+                        Bucket=self.bucket, Key=upload["Key"], UploadId=upload["UploadId"]
+                    )
+            return blobs, leftovers
+        return await run_in_threadpool(scan)
+
+
+def remove_local_file(path):
+    """Delete a local file, ignoring files that are already gone"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _is_not_found(error):
+    code = str(getattr(error, "response", {}).get("Error", {}).get("Code", ""))
+    return code in ("404", "NoSuchKey", "NotFound")
+
+
+def get_backend():
+    """Return the configured storage backend (created on first use)"""
+    global _backend
+    if _backend is None:
+        if STORAGE_BACKEND == "s3":
+            _backend = S3Storage()
+        elif STORAGE_BACKEND == "local":
+            if is_serverless():
+                print(FILE_STORAGE_WARNING)
+            _backend = LocalStorage()
+        else:
+            raise RuntimeError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}'")
+    return _backend
+
+
+def _blobs():
+    return database.get_collection("image_blobs")
+
+
+async def acquire(name, size=None, content_type=None):
+    """Add a reference to a blob, creating its record if needed"""
+    now = datetime.now(timezone.utc)
+    update = {
+        "$inc": {"refcount": 1},
+        "$set": {"updated_at": now},
+        "$setOnInsert": {"size": size, "content_type": content_type, "created_at": now},
+    }
+    try:
+        await _blobs().update_one({"_id": name}, update, upsert=True)
+    except Exception as e:
+        # Two concurrent first uploads of the same content; the other one won
+        if not database.is_duplicate_key_error(e):
+            raise
+        await _blobs().update_one({"_id": name}, update)
+
+
+async def release(name):
+    """Drop a reference to a blob; unreferenced blobs are collected later"""
+    await _blobs().update_one(
+        {"_id": name},
+        {"$inc": {"refcount": -1}, "$set": {"updated_at": datetime.now(timezone.utc)}}
+    )
+
+
+async def commit_upload(image):
+    """
+    Store a streamed upload (see uploads.receive_image_form) by content hash
+    Returns the blob name; the caller owns one reference to it
+    """
+    name = f"{image['sha256']}{image['extension']}"
+    # Reference first: a fresh updated_at keeps the sweep away from this blob
+    await acquire(name, image["size"], image["content_type"])
+    try:
+        await image["upload"].commit(name)
+    except BaseException:
+        await release(name)
+        raise
+    return name
+
+
+async def _delete_variants(backend, name):
+    import thumbnails
+
+    for variant in thumbnails.THUMBNAIL_SIZES:
+        await backend.delete(thumbnails.variant_name(name, variant))
+
+
+async def collect_garbage():
+    """
+    Delete blobs that have been unreferenced for longer than the grace period,
+    plus orphaned blobs with no record and stale temporary objects
+    Returns the number of objects removed
+    """
+    backend = get_backend()
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=IMAGE_GC_GRACE_SECONDS)
+    removed = 0
+
+    unreferenced = {"refcount": {"$lte": 0}, "updated_at": {"$lt": cutoff}}
+    async for blob in _blobs().find(unreferenced, {"_id": 1}):
+        name = blob["_id"]
+        # Move the blob aside before deleting the record: an upload racing
+        # with the sweep either refreshes updated_at (record survives, blob is
+        # restored) or finds the blob missing and stores it again
+        moved = await backend.quarantine(name)
+        result = await _blobs().delete_one({"_id": name, **unreferenced})
+        if result.deleted_count:
+            if moved:
+                await backend.purge(name)
+            await _delete_variants(backend, name)
+            removed += 1
+        elif moved:
+            await backend.restore(name)
+
+    # Blobs without any record, e.g. from a crash between write and acquire
+    blob_names, leftovers = await backend.list_sweepable(cutoff.timestamp())
+    for start in range(0, len(blob_names), 500):
+        batch = blob_names[start:start + 500]
+        known = {doc["_id"] async for doc in _blobs().find({"_id": {"$in": batch}}, {"_id": 1})}
+        for name in batch:
+            if name not in known:
+                await backend.delete(name)
+                await _delete_variants(backend, name)
+                removed += 1
+    for name in leftovers:
+        await backend.delete(name)
+        removed += 1
+    return removed
+
+
+async def _garbage_collection_loop():
+    while True:
+        await asyncio.sleep(IMAGE_GC_INTERVAL_SECONDS)
+        try:
+            removed = await collect_garbage()
+            if removed:
+                print(f"✓ Image garbage collection removed {removed} files")
+        except Exception as e:
+            print(f"✗ Image garbage collection failed: {e}")
+
+
+def start_garbage_collector():
+    """Run the sweep periodically in the background of this process"""
+    global _gc_task
+    if _gc_task is None:
+        _gc_task = asyncio.get_running_loop().create_task(_garbage_collection_loop())
+
+
+def stop_garbage_collector():
+    global _gc_task
+    if _gc_task is not None:
+        _gc_task.cancel()
+        _gc_task = None
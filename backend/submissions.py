@@ -0,0 +1,133 @@
+"""
+Submission queries: keyset pagination, filters and list projections
+Pages are ordered by (created_at, _id) descending and continue from an opaque
+cursor, so every page is an index range scan no matter how deep it is.
+"""
+
+import base64
+import re
+from datetime import datetime, timezone
+from bson import ObjectId
+from fastapi import HTTPException
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Fields returned by list views (what the dashboards render)
+LIST_FIELDS = [
+    "patient_id",
+    "patient_name",
+    "patient_email",
+    "patient_age",
+    "blood_glucose",
+    "hba1c",
+    "insulin_level",
+    "diabetes_type",
+    "symptoms",
+    "medications",
+    "notes",
+    "tongue_image_url",
+    "created_at",
+]
+# Fields only returned when asked for with ?fields=
+EXTRA_FIELDS = [
+    "tongue_features",
+]
+
+
+def encode_cursor(doc):
+    """Opaque cursor pointing just after doc in (created_at, _id) order"""
+    raw = f"{doc['created_at'].isoformat()}|{doc['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; invalid cursors are a 400"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, object_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(created_at), ObjectId(object_id)
+    except Exception:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid cursor"
+        )
+
+
+def build_projection(fields=None):
+    """Projection for the requested comma-separated fields (default: LIST_FIELDS)"""
+    if fields:
+        requested = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = [field for field in requested if field not in LIST_FIELDS and field not in EXTRA_FIELDS]
+        if unknown:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown fields: {', '.join(unknown)}"
+            )
+    else:
+        requested = LIST_FIELDS
+    # created_at is always needed to build the next cursor
+    return {field: 1 for field in {*requested, "created_at"}}
+
+
+def build_query(patient_id=None, diabetes_type=None, created_from=None, created_to=None, cursor=None,
+                patient_search=None):
+    """
+    Mongo filter for a page of submissions
+    patient_search matches part of the patient's name or email, ignoring case
+    (no index serves it; the scan still stops once the page is full)
+    """
+    query = {}
+    if patient_id:
+        query["patient_id"] = patient_id
+    if diabetes_type:
+        query["diabetes_type"] = diabetes_type
+    if patient_search:
+        pattern = {"$regex": re.escape(patient_search), "$options": "i"}
+        query["$or"] = [{"patient_name": pattern}, {"patient_email": pattern}]
+    if created_from or created_to:
+        query["created_at"] = {}
+        if created_from:
+            query["created_at"]["$gte"] = created_from
+        if created_to:
+            query["created_at"]["$lt"] = created_to
+    if cursor:
+        created_at, object_id = decode_cursor(cursor)
+        query["$and"] = [{
+            "$or": [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "_id": {"$lt": object_id}},
+            ]
+        }]
+    return query
+
+
+async def fetch_page(collection, query, projection, limit):
+    """Return (docs, next_cursor) for one page"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    # One extra document tells us whether another page exists
+    docs = await collection.find(query, projection) \
+        .sort([("created_at", -1), ("_id", -1)]) \
+        .limit(limit + 1) \
+        .to_list(length=limit + 1)
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+
+def isoformat_utc(value):
+    """ISO 8601 string for a datetime; MongoDB returns naive UTC datetimes"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.isoformat()
+
+
+def serialize_submission(doc):
+    """
+    Prepare a submission document for FastJSONResponse
+    Only _id is renamed; ObjectId and datetime values are left for the
+    serializer, so no per-field conversion is done here.
+    """
+    doc["id"] = doc.pop("_id")
+    return doc
@@ -0,0 +1,89 @@
+"""
+Thumbnail derivatives for dashboard image grids
+Size-bucketed WebP thumbnails are rendered with Pillow in a worker pool,
+cached in the storage backend next to the originals and regenerated lazily
+when missing. New uploads queue a job that renders every variant ahead of
+the first dashboard request.
+"""
+
+import asyncio
+import os
+import tempfile
+import jobs
+import pools
+import storage
+
+# variant name (as used in ?variant=) -> longest edge in pixels
+THUMBNAIL_SIZES = {
+    "128": 128,
+    "512": 512,
+}
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", str(min(2, os.cpu_count() or 1))))
+VARIANTS_DIRECTORY = "variants"
+
+_pool = pools.WorkerPool("thumbnail", THUMBNAIL_WORKERS)
+# Thumbnails being rendered right now, so concurrent requests share the work
+_in_flight = {}
+
+
+def variant_name(name, variant):
+    """Storage name of a variant of an uploaded image"""
+    stem = name.rsplit(".", 1)[0]
+    return f"{VARIANTS_DIRECTORY}/{stem}.{variant}.webp"
+
+
+def render_thumbnail(source, destination, size, quality=THUMBNAIL_QUALITY):
+    """Render a WebP thumbnail (runs inside the worker pool)"""
+    # Deferred import: Pillow is only loaded in workers that render images
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        # Let the JPEG decoder downscale while decoding
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGB")
+        image.save(destination, "WEBP", quality=quality, method=4)
+    return destination
+
+
+async def _render_and_store(backend, name, key, size):
+    fd, temporary = tempfile.mkstemp(suffix=".webp")
+    os.close(fd)
+    try:
+        async with backend.local_copy(name) as source:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(_pool.get(), render_thumbnail, str(source), temporary, size)
+        await backend.put_file(key, temporary, "image/webp")
+    finally:
+        storage.remove_local_file(temporary)
+
+
+async def get_thumbnail(name, variant):
+    """Return the storage name of a cached thumbnail, rendering it first if missing"""
+    backend = storage.get_backend()
+    key = variant_name(name, variant)
+    if await backend.stat(key) is not None:
+        return key
+
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_render_and_store(backend, name, key, THUMBNAIL_SIZES[variant]))
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+    await asyncio.shield(task)
+    return key
+
+
+@jobs.handler("thumbnails")
+async def render_all_variants(payload):
+    """Render every thumbnail variant of a stored image (a job)"""
+    for variant in THUMBNAIL_SIZES:
+        await get_thumbnail(payload["image"], variant)
+
+
+async def enqueue(image_name):
+    """Queue the thumbnails of a new upload; identical images share one job"""
+    await jobs.enqueue("thumbnails", {"image": image_name}, key=f"thumbnails:{image_name}")
@@ -0,0 +1,174 @@
+"""
+Per-patient blood glucose and HbA1c trends
+Values are either bucketed by day, week or month with a $group over the
+(patient_id, created_at) index, or returned raw. Either way a series longer
+than max_points can be reduced with Largest-Triangle-Three-Buckets (LTTB),
+which keeps the peaks and dips a chart needs while bounding the payload.
+"""
+
+from datetime import timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+METRICS = ("blood_glucose", "hba1c")
+DEFAULT_MAX_POINTS = 500
+MAX_POINTS = 5000
+
+
+def validate_timezone(name):
+    """Reject unknown IANA time zone names with a 400"""
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(
+            status_code=400,
+            detail="Unknown time zone"
+        )
+    return name
+
+
+def build_match(patient_id, created_from=None, created_to=None):
+    query = {"patient_id": patient_id}
+    if created_from or created_to:
+        query["created_at"] = {}
+        if created_from:
+            query["created_at"]["$gte"] = created_from
+        if created_to:
+            query["created_at"]["$lt"] = created_to
+    return query
+
+
+def bucket_pipeline(match, interval, tz="UTC"):
+    """Aggregation producing one document per non-empty bucket, oldest first"""
+    bucket = {"date": "$created_at", "unit": interval, "timezone": tz}
+    if interval == "week":
+        bucket["startOfWeek"] = "monday"
+    group = {"_id": {"$dateTrunc": bucket}, "count": {"$sum": 1}}
+    for metric in METRICS:
+        group[f"{metric}_avg"] = {"$avg": f"${metric}"}
+        group[f"{metric}_min"] = {"$min": f"${metric}"}
+        group[f"{metric}_max"] = {"$max": f"${metric}"}
+    return [
+        {"$match": match},
+        {"$group": group},
+        {"$sort": {"_id": 1}},
+    ]
+
+
+async def fetch_points(collection, match, interval, tz="UTC"):
+    """
+    Points of every metric, oldest first
+    Raw points are {"t", "value"}; bucketed points add "min", "max" and "count"
+    """
+    series = {metric: [] for metric in METRICS}
+    if interval == "raw":
+        cursor = collection.find(match, {"created_at": 1, **{metric: 1 for metric in METRICS}}) \
+            .sort([("created_at", 1), ("_id", 1)])
+        async for doc in cursor:
+            for metric in METRICS:
+                if doc.get(metric) is not None:
+                    series[metric].append({"t": _utc(doc["created_at"]), "value": doc[metric]})
+        return series
+
+    async for bucket in collection.aggregate(bucket_pipeline(match, interval, tz)):
+        for metric in METRICS:
+            if bucket[f"{metric}_avg"] is not None:
+                series[metric].append({
+                    "t": _utc(bucket["_id"]),
+                    "value": bucket[f"{metric}_avg"],
+                    "min": bucket[f"{metric}_min"],
+                    "max": bucket[f"{metric}_max"],
+                    "count": bucket["count"],
+                })
+    return series
+
+
+def _utc(value):
+    # MongoDB returns naive UTC datetimes
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def lttb_indices(x, y, threshold):
+    """Indices of the points LTTB keeps when reducing (x, y) to threshold points"""
+    # Deferred import: NumPy is only loaded when a series is downsampled
+    try:
+        import numpy as np
+    except ImportError:
+        return _lttb_indices_python(x, y, threshold)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    count = len(x)
+    if threshold >= count or threshold < 3:
+        return np.arange(count)
+    # threshold - 2 buckets between the fixed first and last points
+    edges = np.floor(np.linspace(1, count - 1, threshold - 1)).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = count - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # The next bucket's centroid (the last point for the last bucket)
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else count
+        next_x = x[end:next_end].mean()
+        next_y = y[end:next_end].mean()
+        # Twice the area of the triangle (previous, candidate, next centroid)
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(areas.argmax())
+        selected[bucket + 1] = previous
+    return selected
+
+
+def _lttb_indices_python(x, y, threshold):
+    """lttb_indices without NumPy (the serverless bundle may not ship it)"""
+    count = len(x)
+    if threshold >= count or threshold < 3:
+        return list(range(count))
+    # Same bucket edges as np.floor(np.linspace(1, count - 1, threshold - 1))
+    step = (count - 2) / (threshold - 2)
+    edges = [int(1 + bucket * step) for bucket in range(threshold - 2)] + [count - 1]
+    selected = [0]
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else count
+        next_x = sum(x[end:next_end]) / (next_end - end)
+        next_y = sum(y[end:next_end]) / (next_end - end)
+        previous = max(
+            range(start, end),
+            key=lambda index: abs(
+                (x[previous] - next_x) * (y[index] - y[previous])
+                - (x[previous] - x[index]) * (next_y - y[previous])
+            )
+        )
+        selected.append(previous)
+    selected.append(count - 1)
+    return selected
+
+
+def downsample(points, max_points):
+    """A series reduced to at most max_points points with LTTB"""
+    if len(points) <= max_points:
+        return points
+    x = [point["t"].timestamp() for point in points]
+    y = [float(point["value"]) for point in points]
+    return [points[index] for index in lttb_indices(x, y, max_points)]
+
+
+async def get_trends(collection, patient_id, interval="day", created_from=None, created_to=None,
+                     tz="UTC", max_points=DEFAULT_MAX_POINTS, lttb=True):
+    """Trend series of one patient, each limited to max_points points"""
+    series = await fetch_points(collection, build_match(patient_id, created_from, created_to), interval, tz)
+    for metric, points in series.items():
+        if len(points) > max_points:
+            if lttb:
+                series[metric] = await run_in_threadpool(downsample, points, max_points)
+            else:
+                # Without downsampling the most recent points are kept
+                series[metric] = points[-max_points:]
+    return series
@@ -0,0 +1,248 @@
+"""
+Streaming multipart parsing for uploads
+Request bodies are parsed as they arrive and file parts are written to the
+storage backend in fixed-size chunks, so memory per request stays flat no matter how
+large the uploaded photo is.
+"""
+
+import hashlib
+import os
+from fastapi import HTTPException
+from python_multipart.multipart import MultipartParser, parse_options_header
+import storage
+
+# Size of the chunks written to storage
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(64 * 1024)))
+# Hard limit for a single uploaded image
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(10 * 1024 * 1024)))
+# Hard limit for a single text field
+MAX_FIELD_BYTES = 64 * 1024
+# Text fields a form may contain besides the image
+MAX_FORM_FIELDS = 32
+# Slack for multipart boundaries, headers and text fields in Content-Length
+MULTIPART_OVERHEAD_BYTES = 256 * 1024
+
+ALLOWED_IMAGE_TYPES = {
+    "image/jpeg": ".jpg",
+    "image/jpg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "image/heic": ".heic",
+}
+
+
+class _EventCollector:
+    """Turns python-multipart callbacks into a list of simple events"""
+
+    def __init__(self):
+        self.events = []
+        self._header_field = b""
+        self._header_value = b""
+        self._headers = {}
+
+    def on_part_begin(self):
+        self._headers = {}
+
+    def on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("latin-1")
+        filename = options.get(b"filename")
+        content_type = self._headers.get(b"content-type", b"").decode("latin-1").lower()
+        self.events.append((
+            "part",
+            name,
+            filename.decode("utf-8", "replace") if filename is not None else None,
+            content_type,
+        ))
+
+    def on_part_data(self, data, start, end):
+        self.events.append(("data", bytes(data[start:end])))
+
+    def on_part_end(self):
+        self.events.append(("end",))
+
+
+async def iter_multipart(request, max_body_bytes=None):
+    """
+    Parse a multipart request body as it streams in
+    Yields ("part", name, filename, content_type), ("data", bytes) and ("end",)
+    Bodies over max_body_bytes end with a 413, with or without Content-Length
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(
+            status_code=400,
+            detail="Expected a multipart/form-data request"
+        )
+
+    # Reject obviously oversized bodies before reading anything
+    content_length = request.headers.get("content-length")
+    if max_body_bytes and content_length and content_length.isdigit() and int(content_length) > max_body_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail="Upload too large"
+        )
+
+    collector = _EventCollector()
+    parser = MultipartParser(boundary, {
+        "on_part_begin": collector.on_part_begin,
+        "on_header_field": collector.on_header_field,
+        "on_header_value": collector.on_header_value,
+        "on_header_end": collector.on_header_end,
+        "on_headers_finished": collector.on_headers_finished,
+        "on_part_data": collector.on_part_data,
+        "on_part_end": collector.on_part_end,
+    })
+    received = 0
+    async for chunk in request.stream():
+        if not chunk:
+            continue
+        # Chunked bodies carry no Content-Length, so count what arrives
+        received += len(chunk)
+        if max_body_bytes and received > max_body_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail="Upload too large"
+            )
+        parser.write(chunk)
+        events, collector.events = collector.events, []
+        for event in events:
+            yield event
+    parser.finalize()
+
+
+class ChunkedUploadWriter:
+    """
+    Forwards a stream of byte fragments to a storage upload in fixed-size
+    chunks with a size cap, hashing the content (SHA-256) on the way through
+    """
+
+    def __init__(self, upload, max_bytes, chunk_size=UPLOAD_CHUNK_SIZE):
+        self.upload = upload
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self._buffer = bytearray()
+
+    async def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Image exceeds the {round(self.max_bytes / (1024 * 1024), 2):g} MB limit"
+            )
+        self.digest.update(data)
+        self._buffer += data
+        while len(self._buffer) >= self.chunk_size:
+            chunk = bytes(self._buffer[:self.chunk_size])
+            del self._buffer[:self.chunk_size]
+            await self.upload.write(chunk)
+
+    async def close(self):
+        if self._buffer:
+            await self.upload.write(bytes(self._buffer))
+            self._buffer.clear()
+
+    async def discard(self):
+        """Abandon a partially written upload"""
+        self._buffer.clear()
+        await self.upload.abort()
+
+
+async def receive_image_form(request, image_field):
+    """
+    Stream a multipart form containing one image and plain text fields
+    Returns (fields, image) where image has the pending storage upload,
+    extension, content_type, size and sha256; storage.commit_upload() turns
+    it into a stored image and discard_image() abandons it
+    """
+    fields = {}
+    image = None
+    writer = None
+    field_name = None
+    field_value = bytearray()
+
+    try:
+        async for event in iter_multipart(request, MAX_IMAGE_BYTES + MULTIPART_OVERHEAD_BYTES):
+            kind = event[0]
+            if kind == "part":
+                _, field_name, filename, content_type = event
+                field_value = bytearray()
+                if len(fields) >= MAX_FORM_FIELDS:
+                    raise HTTPException(
+                        status_code=400,
+                        detail="Too many form fields"
+                    )
+                if field_name == image_field and filename is not None:
+                    if image is not None:
+                        raise HTTPException(
+                            status_code=400,
+                            detail="Only one image may be uploaded"
+                        )
+                    extension = ALLOWED_IMAGE_TYPES.get(content_type)
+                    if extension is None:
+                        raise HTTPException(
+                            status_code=400,
+                            detail="Unsupported image type"
+                        )
+                    upload = await storage.get_backend().open_upload(extension, content_type)
+                    writer = ChunkedUploadWriter(upload, MAX_IMAGE_BYTES)
+                    image = {"upload": upload, "extension": extension, "content_type": content_type}
+            elif kind == "data":
+                if writer is not None:
+                    await writer.write(event[1])
+                elif field_name is not None:
+                    field_value += event[1]
+                    if len(field_value) > MAX_FIELD_BYTES:
+                        raise HTTPException(
+                            status_code=413,
+                            detail=f"Field '{field_name}' is too large"
+                        )
+            elif kind == "end":
+                if writer is not None:
+                    await writer.close()
+                    image["size"] = writer.size
+                    image["sha256"] = writer.digest.hexdigest()
+                    writer = None
+                elif field_name is not None:
+                    try:
+                        fields[field_name] = field_value.decode("utf-8")
+                    except UnicodeDecodeError:
+                        raise HTTPException(
+                            status_code=400,
+                            detail=f"Field '{field_name}' is not valid UTF-8"
+                        )
+                field_name = None
+    except BaseException:
+        if writer is not None:
+            await writer.discard()
+        elif image is not None:
+            await discard_image(image)
+        raise
+
+    if writer is not None:
+        # Body ended in the middle of the image part
+        await writer.discard()
+        raise HTTPException(
+            status_code=400,
+            detail="Incomplete upload"
+        )
+    return fields, image
+
+
+async def discard_image(image):
+    """Abandon an uploaded image that was never committed to storage"""
+    await image["upload"].abort()
@@ -31,11 +31,9 @@ FILE_STORAGE_WARNING = """
 ⚠️ WARNING: File uploads in serverless environment (Vercel) are stored in /tmp
 and will be DELETED after function execution completes.
 
-For production use, you MUST implement external storage:
-- Vercel Blob Storage
-- AWS S3
-- Cloudinary
-- Supabase Storage
+For production use, you MUST use external storage. Set STORAGE_BACKEND=s3
+and S3_BUCKET (plus S3_ENDPOINT_URL for S3-compatible providers such as
+Cloudflare R2, MinIO or Supabase Storage) to store images in a bucket.
 
 See VERCEL_DEPLOYMENT_GUIDE.md for implementation details.
 """
@@ -0,0 +1,78 @@
+"""
+Collection version counters for conditional GETs
+Every write to a tracked collection increments its counter in
+collection_versions. List responses carry a weak ETag and Last-Modified
+derived from it, so revalidating an unchanged list costs one small document
+read and a 304 instead of re-running the query.
+"""
+
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+import database
+from images import etag_matches
+
+# Responses depend on the caller and must be revalidated on every use
+CONDITIONAL_CACHE_CONTROL = "private, no-cache"
+
+
+def _versions():
+    return database.get_collection("collection_versions")
+
+
+async def bump(name):
+    """
+    Mark a collection as changed
+    Call after the write: a client reading in between gets new data with the
+    old version, which only costs it one extra full response later.
+    """
+    await _versions().update_one(
+        {"_id": name},
+        {"$inc": {"version": 1}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
+
+async def get_version(name):
+    """(version, updated_at) of a collection; (0, None) before its first write"""
+    doc = await _versions().find_one({"_id": name})
+    if doc is None:
+        return 0, None
+    return doc["version"], doc.get("updated_at")
+
+
+def validators(version, updated_at, *scope):
+    """
+    Cache validator headers for a versioned response
+    scope identifies the view (caller, query string), so different views of
+    the same collection version get different ETags.
+    """
+    digest = hashlib.sha1("|".join(str(part) for part in scope).encode()).hexdigest()[:16]
+    headers = {
+        "etag": f'W/"{version}-{digest}"',
+        "cache-control": CONDITIONAL_CACHE_CONTROL,
+        "vary": "Authorization",
+    }
+    if updated_at is not None:
+        if updated_at.tzinfo is None:
+            updated_at = updated_at.replace(tzinfo=timezone.utc)
+        headers["last-modified"] = format_datetime(updated_at, usegmt=True)
+    return headers
+
+
+def is_not_modified(request, headers):
+    """Whether the request's conditional headers match the validators"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence over If-Modified-Since
+        return etag_matches(if_none_match, headers["etag"].removeprefix("W/"))
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or "last-modified" not in headers:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return parsedate_to_datetime(headers["last-modified"]) <= since
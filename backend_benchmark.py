@@ -0,0 +1,632 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the Soin API
+
+Usage:
+    python backend_benchmark.py login --base-url http://localhost:8001/api --concurrency 50 --requests 1000
+    python backend_benchmark.py cold-start --runs 10 --output cold_start.jsonl
+    python backend_benchmark.py serialization --docs 200 --iterations 500
+    python backend_benchmark.py login-flood --base-url http://localhost:8001/api --server-pid 1234
+    python backend_benchmark.py suite --save-baseline benchmark_baseline.json
+    python backend_benchmark.py suite --baseline benchmark_baseline.json
+    python backend_benchmark.py search --mongo-url mongodb://localhost:27017 --docs 1000000
+
+Run the login benchmark once against the previous build and once against the
+current one to compare concurrent throughput before/after a change.
+
+The cold-start benchmark spawns fresh interpreters that import api/index.py
+and send one request through the Mangum handler, the same path a new Vercel
+instance takes. Append its results with --output to track them over releases.
+
+The serialization benchmark renders a synthetic page of submissions through
+the per-field conversion + json path the list endpoint used before, and through
+the orjson FastJSONResponse path, and reports both.
+
+The login-flood benchmark replays a credential-stuffing burst (wrong
+passwords for many emails) alongside a trickle of legitimate logins from
+another client address. It reports how many attempts were throttled, the
+legitimate users' latency and, with --server-pid on the same machine, the
+CPU time the server spent, which stays bounded once the buckets are empty.
+
+The search benchmark seeds a scratch MongoDB database (one million
+submissions by default, kept for later runs) and times representative
+faceted searches; a query whose p95 exceeds --budget-ms fails the run. It
+needs a real MongoDB: the in-memory stand-in says nothing about index use.
+
+The suite drives the FastAPI app in-process over the ASGI transport with an
+in-memory MongoDB stand-in (mongomock-motor) and a temporary image directory,
+so it needs no server or database. It runs concurrent register, login,
+upload, list and image scenarios. Save a baseline once, then compare later
+runs against it: a scenario whose p95 latency or throughput is worse than the
+baseline by more than --tolerance counts as a regression (exit status 1).
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+
+def percentile(values, pct):
+    """Return the pct-th percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(name, latencies, statuses, elapsed):
+    """Build a result dict from raw latencies (seconds) and status codes"""
+    ok = sum(1 for status in statuses if 200 <= status < 300)
+    latencies_ms = [latency * 1000 for latency in latencies]
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "ok": ok,
+        "errors": len(latencies) - ok,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(statistics.mean(latencies_ms), 2) if latencies_ms else 0.0,
+        "p50_ms": round(percentile(latencies_ms, 50), 2),
+        "p95_ms": round(percentile(latencies_ms, 95), 2),
+        "p99_ms": round(percentile(latencies_ms, 99), 2),
+    }
+
+
+def print_result(result):
+    """Pretty-print a single benchmark result"""
+    print(f"\n📊 {result['scenario']}")
+    for key, value in result.items():
+        if key != "scenario":
+            print(f"  {key:>20}: {value}")
+
+
+def ensure_user(base_url, email, password):
+    """Register the benchmark user, ignoring 'already registered' errors"""
+    response = requests.post(
+        f"{base_url}/register",
+        json={
+            "full_name": "Benchmark User",
+            "email": email,
+            "password": password,
+            "age": 30,
+            "role": "patient",
+        },
+    )
+    if response.status_code not in (200, 201, 400):
+        raise RuntimeError(f"Could not create benchmark user: {response.status_code} {response.text}")
+
+
+def bench_login(args):
+    """Fire concurrent logins and measure throughput and latency"""
+    ensure_user(args.base_url, args.email, args.password)
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=args.concurrency, pool_maxsize=args.concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    payload = {"email": args.email, "password": args.password}
+
+    def one_login(_):
+        start = time.perf_counter()
+        response = session.post(f"{args.base_url}/login", json=payload)
+        return time.perf_counter() - start, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one_login, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    result = summarize(
+        f"login (concurrency={args.concurrency})",
+        [latency for latency, _ in results],
+        [status for _, status in results],
+        elapsed,
+    )
+    return result
+
+
+# Executed in a fresh interpreter for every cold-start run
+COLD_START_SCRIPT = r"""
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, "api")
+import index
+imported = time.perf_counter()
+event = {
+    "version": "2.0",
+    "routeKey": "$default",
+    "rawPath": sys.argv[1],
+    "rawQueryString": "",
+    "headers": {"host": "localhost", "accept": "application/json"},
+    "requestContext": {
+        "http": {"method": "GET", "path": sys.argv[1], "protocol": "HTTP/1.1", "sourceIp": "127.0.0.1"},
+        "stage": "$default",
+    },
+    "isBase64Encoded": False,
+}
+class Context:
+    function_name = "cold-start-benchmark"
+response = index.handler(event, Context())
+finished = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "first_request_ms": (finished - imported) * 1000,
+    "status": response["statusCode"],
+}))
+"""
+
+
+def bench_cold_start(args):
+    """Measure import time and first-request latency in fresh interpreters"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    import_times = []
+    first_request_times = []
+    statuses = []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, "-c", COLD_START_SCRIPT, args.path],
+            cwd=root,
+            # Serverless mode refuses to start without a signing secret
+            env={**os.environ, "JWT_SECRET": os.environ.get("JWT_SECRET", "benchmark-secret")},
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        run = json.loads(output.stdout.strip().splitlines()[-1])
+        import_times.append(run["import_ms"])
+        first_request_times.append(run["first_request_ms"])
+        statuses.append(run["status"])
+
+    total_times = [a + b for a, b in zip(import_times, first_request_times)]
+    ok = sum(1 for status in statuses if 200 <= status < 300)
+    return {
+        "scenario": f"cold-start ({args.path})",
+        "requests": args.runs,
+        "ok": ok,
+        "errors": args.runs - ok,
+        "import_p50_ms": round(percentile(import_times, 50), 2),
+        "import_max_ms": round(max(import_times), 2),
+        "first_request_p50_ms": round(percentile(first_request_times, 50), 2),
+        "first_request_max_ms": round(max(first_request_times), 2),
+        "total_p50_ms": round(percentile(total_times, 50), 2),
+    }
+
+
+def bench_serialization(args):
+    """Compare list-endpoint response rendering: json + per-field conversion vs orjson"""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+    from bson import ObjectId
+    from starlette.responses import JSONResponse
+    from serialization import FastJSONResponse
+    import submissions
+
+    def make_page():
+        now = datetime.utcnow()
+        return [
+            {
+                "_id": ObjectId(),
+                "patient_id": str(ObjectId()),
+                "patient_name": "Benchmark Patient",
+                "patient_email": "patient@test.com",
+                "patient_age": 42,
+                "blood_glucose": 126.5,
+                "hba1c": 6.8,
+                "insulin_level": 14.2,
+                "diabetes_type": "type2",
+                "symptoms": ["fatigue", "thirst", "blurred vision"],
+                "medications": ["metformin"],
+                "notes": "Fasting sample taken in the morning.",
+                "tongue_image_url": f"/images/{'0' * 64}.jpg",
+                "created_at": now,
+                "updated_at": now,
+            }
+            for _ in range(args.docs)
+        ]
+
+    def legacy(doc):
+        result = {key: value for key, value in doc.items() if key != "_id"}
+        result["id"] = str(doc["_id"])
+        for field in ("created_at", "updated_at"):
+            if isinstance(result.get(field), datetime):
+                result[field] = submissions.isoformat_utc(result[field])
+        return result
+
+    def render_legacy(page):
+        return JSONResponse(content=[legacy(doc) for doc in page]).body
+
+    def render_fast(page):
+        return FastJSONResponse(content=[submissions.serialize_submission(doc) for doc in page]).body
+
+    results = []
+    for name, render in (("json", render_legacy), ("orjson", render_fast)):
+        latencies = []
+        size = 0
+        started = time.perf_counter()
+        for _ in range(args.iterations):
+            # Fresh documents each time: the handler gets them straight from the cursor
+            page = make_page()
+            start = time.perf_counter()
+            size = len(render(page))
+            latencies.append(time.perf_counter() - start)
+        elapsed = time.perf_counter() - started
+        result = summarize(f"serialization {name} ({args.docs} docs/page)", latencies, [200] * len(latencies), elapsed)
+        rendering = sum(latencies)
+        result["docs_per_s"] = round(args.docs * args.iterations / rendering)
+        result["mb_per_s"] = round(size * args.iterations / rendering / 1e6, 1)
+        result["bytes_per_page"] = size
+        results.append(result)
+
+    print_result(results[0])
+    baseline = results[0]["docs_per_s"]
+    results[1]["speedup"] = round(results[1]["docs_per_s"] / baseline, 2) if baseline else 0.0
+    return results[1]
+
+
+def process_cpu_seconds(pid):
+    """User + system CPU time of a local process, from /proc (Linux only)"""
+    with open(f"/proc/{pid}/stat") as stat:
+        fields = stat.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def bench_login_flood(args):
+    """Credential-stuffing burst against /login next to legitimate logins"""
+    ensure_user(args.base_url, args.email, args.password)
+    # Existing accounts: unknown emails are rejected without a bcrypt verify
+    for index in range(args.emails):
+        ensure_user(args.base_url, f"victim{index}@test.com", "victim-password")
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=args.concurrency, pool_maxsize=args.concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # Distinct client addresses; only honoured when the server trusts X-Forwarded-For
+    attacker = {"X-Forwarded-For": "203.0.113.66"}
+    legitimate = {"X-Forwarded-For": "198.51.100.7"}
+
+    def attack(index):
+        start = time.perf_counter()
+        response = session.post(
+            f"{args.base_url}/login",
+            json={"email": f"victim{index % args.emails}@test.com", "password": "wrong-password"},
+            headers=attacker,
+        )
+        return time.perf_counter() - start, response.status_code
+
+    cpu_before = process_cpu_seconds(args.server_pid) if args.server_pid else None
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        flood = pool.map(attack, range(args.requests))
+        legitimate_results = []
+        for _ in range(args.legitimate):
+            start = time.perf_counter()
+            response = session.post(
+                f"{args.base_url}/login", json={"email": args.email, "password": args.password}, headers=legitimate
+            )
+            legitimate_results.append((time.perf_counter() - start, response.status_code))
+        flood_results = list(flood)
+    elapsed = time.perf_counter() - started
+
+    result = summarize(
+        f"login-flood (legitimate logins during a {args.requests}-attempt flood)",
+        [latency for latency, _ in legitimate_results],
+        [status for _, status in legitimate_results],
+        elapsed,
+    )
+    statuses = [status for _, status in flood_results]
+    result["flood_attempts"] = len(statuses)
+    result["flood_throttled"] = statuses.count(429)
+    result["flood_verified"] = len(statuses) - statuses.count(429)
+    if cpu_before is not None:
+        cpu = process_cpu_seconds(args.server_pid) - cpu_before
+        result["server_cpu_s"] = round(cpu, 3)
+        result["server_cpu_ms_per_attempt"] = round(cpu * 1000 / (len(statuses) + len(legitimate_results)), 3)
+    return result
+
+
+def make_jpeg(seed, size=256):
+    """A small JPEG with content unique to seed"""
+    from PIL import Image
+
+    image = Image.new("RGB", (size, size), ((seed * 37) % 256, (seed * 91) % 256, (seed * 53) % 256))
+    image.putpixel((seed % size, (seed // size) % size), (255, 255, 255))
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=85)
+    return output.getvalue()
+
+
+async def run_scenario(name, concurrency, requests_count, request_fn):
+    """Run request_fn(index) requests_count times with bounded concurrency"""
+    latencies = []
+    statuses = []
+    queue = iter(range(requests_count))
+
+    async def worker():
+        for index in queue:
+            start = time.perf_counter()
+            response = await request_fn(index)
+            latencies.append(time.perf_counter() - start)
+            statuses.append(response.status_code)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(f"{name} (concurrency={concurrency})", latencies, statuses, time.perf_counter() - started)
+
+
+async def run_suite(args):
+    import httpx
+    from mongomock_motor import AsyncMongoMockClient
+
+    import database
+    import server
+    import storage
+
+    database._client = AsyncMongoMockClient()
+    await database.ensure_indexes()
+    image_directory = tempfile.mkdtemp(prefix="soin-benchmark-")
+    storage._backend = storage.LocalStorage(image_directory)
+    try:
+        return await _run_scenarios(args, httpx.ASGITransport(app=server.app))
+    finally:
+        shutil.rmtree(image_directory, ignore_errors=True)
+
+
+async def _run_scenarios(args, transport):
+    import httpx
+
+    import auth
+    import database
+
+    results = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark/api") as client:
+        password = "benchmark123"
+
+        async def register(index):
+            return await client.post("/register", json={
+                "full_name": f"Patient {index}", "email": f"suite_patient{index}@test.com",
+                "password": password, "age": 40, "role": "patient",
+            })
+
+        async def login(index):
+            return await client.post("/login", json={
+                "email": f"suite_patient{index % args.requests}@test.com", "password": password,
+            })
+
+        results.append(await run_scenario("register", args.concurrency, args.requests, register))
+        results.append(await run_scenario("login", args.concurrency, args.requests, login))
+
+        patient_ids = [str(doc["_id"]) async for doc in database.get_collection("users").find({}, {"_id": 1})]
+        patient_headers = [
+            {"Authorization": f"Bearer {auth.create_access_token(user_id, 'patient')}"} for user_id in patient_ids
+        ]
+        images = [make_jpeg(index) for index in range(args.requests)]
+
+        async def upload(index):
+            return await client.post(
+                "/submissions",
+                headers=patient_headers[index % len(patient_headers)],
+                data={
+                    "blood_glucose": "126.5", "hba1c": "6.8", "insulin_level": "14.2",
+                    "diabetes_type": "type2", "symptoms": '["fatigue", "thirst"]',
+                    "medications": '["metformin"]', "notes": "benchmark",
+                },
+                files={"tongue_image": (f"tongue{index}.jpg", images[index], "image/jpeg")},
+            )
+
+        results.append(await run_scenario("upload", args.concurrency, args.requests, upload))
+
+        doctor_headers = {"Authorization": f"Bearer {auth.create_access_token('0' * 24, 'doctor')}"}
+
+        async def list_page(index):
+            return await client.get("/submissions", params={"limit": 50}, headers=doctor_headers)
+
+        results.append(await run_scenario("list", args.concurrency, args.requests, list_page))
+
+        names = [doc["tongue_image_filename"] async for doc in database.get_collection("submissions").find()]
+
+        async def image(index):
+            return await client.get(f"/images/{names[index % len(names)]}")
+
+        results.append(await run_scenario("image", args.concurrency, args.requests, image))
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Mark results whose p95 or throughput regressed beyond tolerance (a fraction)"""
+    for result in results:
+        previous = baseline.get(result["scenario"])
+        if previous is None:
+            continue
+        p95_change = result["p95_ms"] / previous["p95_ms"] - 1 if previous["p95_ms"] else 0.0
+        throughput_change = (
+            result["throughput_rps"] / previous["throughput_rps"] - 1 if previous["throughput_rps"] else 0.0
+        )
+        result["baseline_p95_ms"] = previous["p95_ms"]
+        result["p95_change_pct"] = round(p95_change * 100, 1)
+        result["throughput_change_pct"] = round(throughput_change * 100, 1)
+        result["regression"] = p95_change > tolerance or throughput_change < -tolerance
+
+
+def bench_suite(args):
+    """In-process concurrent scenarios with optional baseline comparison"""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+    # One client address for every request: keep login throttling out of the numbers
+    os.environ.setdefault("LOGIN_IP_CAPACITY", "1000000")
+    os.environ.setdefault("LOGIN_EMAIL_CAPACITY", "1000000")
+    os.environ.setdefault("BCRYPT_ROUNDS", str(args.bcrypt_rounds))
+    os.environ.setdefault("JWT_SECRET", "benchmark-secret")
+
+    results = asyncio.run(run_suite(args))
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            compare_to_baseline(results, json.load(baseline_file), args.tolerance / 100)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump({result["scenario"]: result for result in results}, baseline_file, indent=2)
+        print(f"\n💾 Baseline saved to {args.save_baseline}")
+    return results
+
+
+SEARCH_SYMPTOMS = ["Increased thirst", "Frequent urination", "Fatigue", "Blurred vision", "Slow healing", "Tingling"]
+SEARCH_MEDICATIONS = ["Metformin", "Insulin", "Gliclazide", "Sitagliptin", "Empagliflozin"]
+SEARCH_NOTES = ["feeling tired after meals", "thirsty at night", "no complaints", "dizzy in the morning", "skipped dose"]
+SEARCH_QUERIES = {
+    "search_unfiltered": {},
+    "search_type2_high_glucose_thirst": {
+        "diabetes_type": ["type2"], "blood_glucose_min": 180, "symptoms": ["Increased thirst"],
+    },
+    "search_medication_hba1c": {"medications": ["Insulin"], "hba1c_min": 8, "hba1c_max": 10},
+    "search_notes_text": {"text": "thirsty"},
+}
+
+
+async def seed_search_data(collection, count, batch_size=10000):
+    """Insert synthetic submissions until the collection holds count documents"""
+    import random
+    from datetime import timedelta, timezone
+
+    rng = random.Random(42)
+    existing = await collection.estimated_document_count()
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    for offset in range(existing, count, batch_size):
+        docs = []
+        for index in range(offset, min(offset + batch_size, count)):
+            docs.append({
+                "patient_id": f"{index % 20000:024x}",
+                "patient_name": f"Patient {index % 20000}",
+                "blood_glucose": round(rng.uniform(60, 320), 1),
+                "hba1c": round(rng.uniform(4.5, 12.5), 1),
+                "insulin_level": round(rng.uniform(2, 30), 1),
+                "diabetes_type": rng.choice(["type1", "type2", "type2", "gestational", "prediabetes"]),
+                "symptoms": rng.sample(SEARCH_SYMPTOMS, rng.randint(0, 3)),
+                "medications": rng.sample(SEARCH_MEDICATIONS, rng.randint(0, 2)),
+                "notes": rng.choice(SEARCH_NOTES),
+                "tongue_image_url": "/images/benchmark.jpg",
+                "created_at": start + timedelta(minutes=index),
+            })
+        await collection.insert_many(docs, ordered=False)
+        print(f"  seeded {offset + len(docs)}/{count}")
+
+
+async def run_search(args):
+    import database
+    import search
+
+    try:
+        collection = database.get_collection("submissions")
+        await seed_search_data(collection, args.docs)
+        if not await database.ensure_indexes("submissions"):
+            raise RuntimeError("The submissions indexes could not be built")
+        results = []
+        for name, filters in SEARCH_QUERIES.items():
+            match = search.build_match(**filters)
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(args.iterations):
+                request_started = time.perf_counter()
+                await search.search(collection, match, search.DEFAULT_PAGE_SIZE, 0)
+                latencies.append(time.perf_counter() - request_started)
+            result = summarize(name, latencies, [200] * len(latencies), time.perf_counter() - started)
+            result["budget_ms"] = args.budget_ms
+            result["regression"] = result["p95_ms"] > args.budget_ms
+            results.append(result)
+        return results
+    finally:
+        database.close()
+
+
+def bench_search(args):
+    """Faceted search latency on a seeded MongoDB database"""
+    os.environ["MONGO_URL"] = args.mongo_url
+    os.environ["DB_NAME"] = args.db_name
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+    return asyncio.run(run_search(args))
+
+
+def save_result(path, result):
+    """Append a timestamped result as one JSON line"""
+    record = dict(result, recorded_at=datetime.now().isoformat())
+    with open(path, "a") as output:
+        output.write(json.dumps(record) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soin API benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    login = subparsers.add_parser("login", help="Concurrent login throughput")
+    login.add_argument("--base-url", default="http://localhost:8001/api")
+    login.add_argument("--email", default="benchmark_user@test.com")
+    login.add_argument("--password", default="benchmark123")
+    login.add_argument("--concurrency", type=int, default=50)
+    login.add_argument("--requests", type=int, default=500)
+    login.add_argument("--output", help="Append the result as JSON to this file")
+    login.set_defaults(func=bench_login)
+
+    cold_start = subparsers.add_parser("cold-start", help="Serverless import + first request latency")
+    cold_start.add_argument("--runs", type=int, default=5)
+    cold_start.add_argument("--path", default="/api/health", help="Route to request after import")
+    cold_start.add_argument("--output", help="Append the result as JSON to this file")
+    cold_start.set_defaults(func=bench_cold_start)
+
+    flood = subparsers.add_parser("login-flood", help="Login throttling under a credential-stuffing burst")
+    flood.add_argument("--base-url", default="http://localhost:8001/api")
+    flood.add_argument("--email", default="benchmark_user@test.com")
+    flood.add_argument("--password", default="benchmark123")
+    flood.add_argument("--concurrency", type=int, default=50)
+    flood.add_argument("--requests", type=int, default=2000, help="Attacker login attempts")
+    flood.add_argument("--emails", type=int, default=20, help="Distinct emails the attacker tries")
+    flood.add_argument("--legitimate", type=int, default=5, help="Legitimate logins during the flood")
+    flood.add_argument("--server-pid", type=int, help="Local server process to measure CPU time of")
+    flood.add_argument("--output", help="Append the result as JSON to this file")
+    flood.set_defaults(func=bench_login_flood)
+
+    suite = subparsers.add_parser("suite", help="In-process load/latency suite (no server or database needed)")
+    suite.add_argument("--concurrency", type=int, default=20)
+    suite.add_argument("--requests", type=int, default=200, help="Requests per scenario")
+    suite.add_argument("--bcrypt-rounds", type=int, default=12, help="Unless BCRYPT_ROUNDS is set")
+    suite.add_argument("--baseline", help="Compare against this saved baseline")
+    suite.add_argument("--save-baseline", help="Save the results as the new baseline")
+    suite.add_argument("--tolerance", type=float, default=20.0, help="Allowed regression in percent")
+    suite.add_argument("--output", help="Append the results as JSON to this file")
+    suite.set_defaults(func=bench_suite)
+
+    search = subparsers.add_parser("search", help="Faceted search latency on seeded data (needs MongoDB)")
+    search.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    search.add_argument("--db-name", default="soin_benchmark_search", help="Scratch database, seeded on first run")
+    search.add_argument("--docs", type=int, default=1000000, help="Submissions to seed")
+    search.add_argument("--iterations", type=int, default=50, help="Runs per query")
+    search.add_argument("--budget-ms", type=float, default=100.0, help="p95 above this counts as a regression")
+    search.add_argument("--output", help="Append the results as JSON to this file")
+    search.set_defaults(func=bench_search)
+
+    serialization = subparsers.add_parser("serialization", help="List response rendering throughput")
+    serialization.add_argument("--docs", type=int, default=200, help="Submissions per page")
+    serialization.add_argument("--iterations", type=int, default=500)
+    serialization.add_argument("--output", help="Append the result as JSON to this file")
+    serialization.set_defaults(func=bench_serialization)
+
+    args = parser.parse_args()
+    result = args.func(args)
+    results = result if isinstance(result, list) else [result]
+    for result in results:
+        print_result(result)
+        if getattr(args, "output", None):
+            save_result(args.output, result)
+    failed = any(result["errors"] or result.get("regression") for result in results)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+import { useCallback, useEffect, useRef, useState } from 'react';
+import { toast } from 'sonner';
+import { API } from '@/App';
+import { fetchSubmissionsPage } from '@/lib/submissions';
+
+// Submissions matching filters, newest first, one page at a time: the first
+// page loads whenever the filters change and loadMore() appends the next one
+export function useSubmissions(filters = {}, errorMessage = 'Failed to fetch submissions') {
+  const [submissions, setSubmissions] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const filtersRef = useRef(filters);
+  // Responses to requests made before the latest reload are dropped
+  const generation = useRef(0);
+  const filtersKey = JSON.stringify(filters);
+
+  const reload = useCallback(async () => {
+    const current = ++generation.current;
+    setLoading(true);
+    try {
+      const page = await fetchSubmissionsPage(API, filtersRef.current);
+      if (current !== generation.current) return;
+      setSubmissions(page.items);
+      setNextCursor(page.nextCursor);
+    } catch (error) {
+      if (current === generation.current) toast.error(errorMessage);
+    } finally {
+      if (current === generation.current) setLoading(false);
+    }
+  }, [errorMessage]);
+
+  const loadMore = useCallback(async () => {
+    if (!nextCursor) return;
+    const current = generation.current;
+    setLoadingMore(true);
+    try {
+      const page = await fetchSubmissionsPage(API, { ...filtersRef.current, cursor: nextCursor });
+      if (current !== generation.current) return;
+      // Live updates may already have added some of these
+      setSubmissions((loaded) => {
+        const seen = new Set(loaded.map((submission) => submission.id));
+        return [...loaded, ...page.items.filter((submission) => !seen.has(submission.id))];
+      });
+      setNextCursor(page.nextCursor);
+    } catch (error) {
+      toast.error(errorMessage);
+    } finally {
+      setLoadingMore(false);
+    }
+  }, [nextCursor, errorMessage]);
+
+  useEffect(() => {
+    filtersRef.current = JSON.parse(filtersKey);
+    reload();
+  }, [filtersKey, reload]);
+
+  return {
+    submissions,
+    setSubmissions,
+    loading,
+    loadingMore,
+    hasMore: nextCursor !== null,
+    loadMore,
+    reload,
+  };
+}
+
+// value, once it has stopped changing for delay ms (for search-as-you-type)
+export function useDebouncedValue(value, delay = 300) {
+  const [debounced, setDebounced] = useState(value);
+  useEffect(() => {
+    const timer = setTimeout(() => setDebounced(value), delay);
+    return () => clearTimeout(timer);
+  }, [value, delay]);
+  return debounced;
+}
@@ -0,0 +1,16 @@
+import axios from 'axios';
+
+// Submissions per page; more are loaded on demand
+export const PAGE_SIZE = 50;
+
+// One page of GET /submissions (keyset-paginated). Pass the nextCursor of the
+// previous page, with the same filters, to continue; empty filters are left out
+export async function fetchSubmissionsPage(api, { cursor, ...filters } = {}) {
+  const params = { limit: PAGE_SIZE };
+  Object.entries(filters).forEach(([key, value]) => {
+    if (value) params[key] = value;
+  });
+  if (cursor) params.cursor = cursor;
+  const response = await axios.get(`${api}/submissions`, { params });
+  return { items: response.data, nextCursor: response.headers['x-next-cursor'] || null };
+}
@@ -1,6 +1,7 @@
 import { useState, useEffect } from 'react';
 import axios from 'axios';
 import { API } from '@/App';
+import { useDebouncedValue, useSubmissions } from '@/hooks/use-submissions';
 import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
 import { Card, CardContent, CardHeader, CardTitle, CardDescription } from '@/components/ui/card';
@@ -19,10 +20,14 @@ const AdminDashboard = ({ user, onLogout }) => {
     total_submissions: 0
   });
   const [pendingDoctors, setPendingDoctors] = useState([]);
-  const [submissions, setSubmissions] = useState([]);
-  const [filteredSubmissions, setFilteredSubmissions] = useState([]);
   const [searchTerm, setSearchTerm] = useState('');
   const [filterType, setFilterType] = useState('all');
+  // Filtered by the API; more pages load on demand
+  const debouncedSearch = useDebouncedValue(searchTerm.trim());
+  const { submissions, loadingMore, hasMore, loadMore } = useSubmissions({
+    patient_search: debouncedSearch,
+    diabetes_type: filterType === 'all' ? '' : filterType,
+  });
   const [selectedImage, setSelectedImage] = useState(null);
   const [imageZoom, setImageZoom] = useState(false);
   const [loading, setLoading] = useState(true);
@@ -32,22 +37,15 @@ const AdminDashboard = ({ user, onLogout }) => {
     fetchData();
   }, []);
 
-  useEffect(() => {
-    filterSubmissions();
-  }, [searchTerm, filterType, submissions]);
-
   const fetchData = async () => {
     try {
-      const [statsRes, doctorsRes, submissionsRes] = await Promise.all([
+      const [statsRes, doctorsRes] = await Promise.all([
         axios.get(`${API}/admin/stats`),
-        axios.get(`${API}/admin/pending-doctors`),
-        axios.get(`${API}/submissions`)
+        axios.get(`${API}/admin/pending-doctors`)
       ]);
 
       setStats(statsRes.data);
       setPendingDoctors(doctorsRes.data);
-      setSubmissions(submissionsRes.data);
-      setFilteredSubmissions(submissionsRes.data);
     } catch (error) {
       toast.error('Failed to fetch data');
     } finally {
@@ -89,24 +87,6 @@ const AdminDashboard = ({ user, onLogout }) => {
     }
   };
 
-  const filterSubmissions = () => {
-    let filtered = submissions;
-
-    if (searchTerm) {
-      filtered = filtered.filter(
-        (sub) =>
-          sub.patient_name.toLowerCase().includes(searchTerm.toLowerCase()) ||
-          sub.patient_email.toLowerCase().includes(searchTerm.toLowerCase())
-      );
-    }
-
-    if (filterType !== 'all') {
-      filtered = filtered.filter((sub) => sub.diabetes_type === filterType);
-    }
-
-    setFilteredSubmissions(filtered);
-  };
-
   return (
     <div className="min-h-screen beige-gradient">
       {/* Header */}
@@ -296,7 +276,7 @@ const AdminDashboard = ({ user, onLogout }) => {
               </Card>
 
               {/* Submissions List */}
-              {filteredSubmissions.length === 0 ? (
+              {submissions.length === 0 ? (
                 <Card className="border-2 border-[#8B7355]/20">
                   <CardContent className="p-12 text-center">
                     <p className="text-xl text-[#8B7355]">No submissions found</p>
@@ -304,7 +284,7 @@ const AdminDashboard = ({ user, onLogout }) => {
                 </Card>
               ) : (
                 <div className="space-y-4">
-                  {filteredSubmissions.map((submission) => (
+                  {submissions.map((submission) => (
                     <Card key={submission.id} className="border-2 border-[#8B7355]/20 card-hover" data-testid="admin-submission-card">
                       <CardContent className="p-6">
                         <div className="grid md:grid-cols-4 gap-6">
@@ -312,7 +292,7 @@ const AdminDashboard = ({ user, onLogout }) => {
                           <div className="space-y-2">
                             <p className="text-sm font-semibold text-[#5D4E37]">Tongue Image</p>
                             <img
-                              src={`${API}${submission.tongue_image_url}`}
+                              src={`${API}${submission.tongue_image_url}?variant=512`}
                               alt="Tongue"
                               className="rounded-lg border border-[#8B7355]/30 cursor-zoom-in w-full"
                               onClick={() => {
@@ -417,6 +397,19 @@ const AdminDashboard = ({ user, onLogout }) => {
                   ))}
                 </div>
               )}
+              {hasMore && (
+                <div className="text-center">
+                  <Button
+                    variant="outline"
+                    onClick={loadMore}
+                    disabled={loadingMore}
+                    className="border-[#8B7355] text-[#8B7355] hover:bg-[#8B7355] hover:text-white"
+                    data-testid="admin-load-more-btn"
+                  >
+                    {loadingMore ? 'Loading...' : 'Load more'}
+                  </Button>
+                </div>
+              )}
             </div>
           </TabsContent>
         </Tabs>
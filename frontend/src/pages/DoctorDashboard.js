@@ -1,66 +1,59 @@
-import { useState, useEffect } from 'react';
-import axios from 'axios';
+import { useState, useEffect, useRef } from 'react';
 import { API } from '@/App';
+import { useDebouncedValue, useSubmissions } from '@/hooks/use-submissions';
 import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogDescription } from '@/components/ui/dialog';
-import { toast } from 'sonner';
 import { LogOut, Search, ZoomIn, Filter } from 'lucide-react';
 import { format } from 'date-fns';
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '@/components/ui/select';
 
 const DoctorDashboard = ({ user, onLogout }) => {
-  const [submissions, setSubmissions] = useState([]);
-  const [filteredSubmissions, setFilteredSubmissions] = useState([]);
   const [searchTerm, setSearchTerm] = useState('');
   const [filterType, setFilterType] = useState('all');
   const [selectedImage, setSelectedImage] = useState(null);
   const [imageZoom, setImageZoom] = useState(false);
-  const [loading, setLoading] = useState(true);
 
-  useEffect(() => {
-    fetchSubmissions();
-  }, []);
-
-  useEffect(() => {
-    filterSubmissions();
-  }, [searchTerm, filterType, submissions]);
-
-  const fetchSubmissions = async () => {
-    try {
-      const response = await axios.get(`${API}/submissions`);
-      setSubmissions(response.data);
-      setFilteredSubmissions(response.data);
-    } catch (error) {
-      toast.error('Failed to fetch submissions');
-    } finally {
-      setLoading(false);
-    }
+  // Filtered by the API; more pages load on demand
+  const debouncedSearch = useDebouncedValue(searchTerm.trim());
+  const filters = {
+    patient_search: debouncedSearch,
+    diabetes_type: filterType === 'all' ? '' : filterType,
   };
+  const { submissions, setSubmissions, loading, loadingMore, hasMore, loadMore, reload } = useSubmissions(filters);
+  const filtersRef = useRef(filters);
+  filtersRef.current = filters;
 
-  const filterSubmissions = () => {
-    let filtered = submissions;
-
-    // Search filter
-    if (searchTerm) {
-      filtered = filtered.filter(
-        (sub) =>
-          sub.patient_name.toLowerCase().includes(searchTerm.toLowerCase()) ||
-          sub.patient_email.toLowerCase().includes(searchTerm.toLowerCase())
-      );
-    }
-
-    // Diabetes type filter
-    if (filterType !== 'all') {
-      filtered = filtered.filter((sub) => sub.diabetes_type === filterType);
-    }
-
-    setFilteredSubmissions(filtered);
-  };
+  // Live updates instead of polling; EventSource reconnects by itself
+  useEffect(() => {
+    const token = localStorage.getItem('token');
+    if (!token || typeof EventSource === 'undefined') return undefined;
+    const source = new EventSource(`${API}/submissions/stream?access_token=${encodeURIComponent(token)}`);
+    // New submissions only join the list if they pass the current filters
+    const matches = (submission) => {
+      const { patient_search: term, diabetes_type: type } = filtersRef.current;
+      if (type && submission.diabetes_type !== type) return false;
+      if (!term) return true;
+      return [submission.patient_name, submission.patient_email]
+        .some((value) => (value || '').toLowerCase().includes(term.toLowerCase()));
+    };
+    const upsert = (event) => {
+      const submission = JSON.parse(event.data);
+      setSubmissions((current) => {
+        const existing = current.find((sub) => sub.id === submission.id);
+        if (!existing && !matches(submission)) return current;
+        return [{ ...existing, ...submission }, ...current.filter((sub) => sub.id !== submission.id)];
+      });
+    };
+    source.addEventListener('submission.created', upsert);
+    source.addEventListener('submission.updated', upsert);
+    source.addEventListener('resync', () => reload());
+    return () => source.close();
+  }, [reload, setSubmissions]);
 
   // Group submissions by patient
-  const groupedSubmissions = filteredSubmissions.reduce((acc, submission) => {
+  const groupedSubmissions = submissions.reduce((acc, submission) => {
     if (!acc[submission.patient_id]) {
       acc[submission.patient_id] = {
         patient_name: submission.patient_name,
@@ -153,7 +146,7 @@ const DoctorDashboard = ({ user, onLogout }) => {
                   <div className="flex gap-4 text-sm text-[#8B7355]">
                     <span>{patientData.patient_email}</span>
                     <span>Age: {patientData.patient_age}</span>
-                    <span>Total Submissions: {patientData.submissions.length}</span>
+                    <span>Submissions: {patientData.submissions.length}{hasMore ? '+' : ''}</span>
                   </div>
                 </CardHeader>
                 <CardContent className="p-6">
@@ -171,7 +164,7 @@ const DoctorDashboard = ({ user, onLogout }) => {
                             <div className="space-y-2">
                               <p className="text-sm font-semibold text-[#5D4E37]">Tongue Image</p>
                               <img
-                                src={`${API}${submission.tongue_image_url}`}
+                                src={`${API}${submission.tongue_image_url}?variant=512`}
                                 alt="Tongue"
                                 className="rounded-lg border border-[#8B7355]/30 cursor-zoom-in w-full"
                                 onClick={() => {
@@ -274,6 +267,19 @@ const DoctorDashboard = ({ user, onLogout }) => {
             ))}
           </div>
         )}
+        {!loading && hasMore && (
+          <div className="text-center mt-6">
+            <Button
+              variant="outline"
+              onClick={loadMore}
+              disabled={loadingMore}
+              className="border-[#8B7355] text-[#8B7355] hover:bg-[#8B7355] hover:text-white"
+              data-testid="load-more-btn"
+            >
+              {loadingMore ? 'Loading...' : 'Load more'}
+            </Button>
+          </div>
+        )}
       </div>
 
       {/* Image Zoom Dialog */}
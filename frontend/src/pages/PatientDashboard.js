@@ -1,6 +1,7 @@
-import { useState, useEffect } from 'react';
+import { useState } from 'react';
 import axios from 'axios';
 import { API } from '@/App';
+import { useSubmissions } from '@/hooks/use-submissions';
 import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
 import { Label } from '@/components/ui/label';
@@ -38,7 +39,10 @@ const MEDICATION_OPTIONS = [
 ];
 
 const PatientDashboard = ({ user, onLogout }) => {
-  const [submissions, setSubmissions] = useState([]);
+  // The API only returns this patient's own submissions
+  const { submissions, loadingMore, hasMore, loadMore, reload: fetchSubmissions } = useSubmissions(
+    {}, 'Failed to fetch history'
+  );
   const [loading, setLoading] = useState(false);
   const [selectedImage, setSelectedImage] = useState(null);
   const [imageZoom, setImageZoom] = useState(false);
@@ -56,19 +60,6 @@ const PatientDashboard = ({ user, onLogout }) => {
   });
   const [previewImage, setPreviewImage] = useState(null);
 
-  useEffect(() => {
-    fetchSubmissions();
-  }, []);
-
-  const fetchSubmissions = async () => {
-    try {
-      const response = await axios.get(`${API}/submissions`);
-      setSubmissions(response.data);
-    } catch (error) {
-      toast.error('Failed to fetch history');
-    }
-  };
-
   const handleImageChange = (e) => {
     const file = e.target.files[0];
     if (file) {
@@ -479,6 +470,19 @@ const PatientDashboard = ({ user, onLogout }) => {
                 </Card>
               ))
             )}
+            {hasMore && (
+              <div className="text-center">
+                <Button
+                  variant="outline"
+                  onClick={loadMore}
+                  disabled={loadingMore}
+                  className="border-[#8B7355] text-[#8B7355] hover:bg-[#8B7355] hover:text-white"
+                  data-testid="history-load-more-btn"
+                >
+                  {loadingMore ? 'Loading...' : 'Load more'}
+                </Button>
+              </div>
+            )}
           </div>
         </DialogContent>
       </Dialog>
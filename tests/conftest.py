@@ -0,0 +1,71 @@
+"""
+Shared fixtures: backend modules are imported the way the server imports
+them (top-level, from backend/) and MongoDB is replaced by mongomock-motor.
+"""
+
+import os
+import sys
+from pathlib import Path
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+os.environ.setdefault("JWT_SECRET", "test-secret-" + "0" * 32)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """An empty in-memory database behind database.get_collection()"""
+    from mongomock_motor import AsyncMongoMockClient
+    import database
+
+    client = AsyncMongoMockClient()
+    monkeypatch.setattr(database, "_client", client)
+    monkeypatch.setattr(database, "_db", client[database.DB_NAME])
+    monkeypatch.setattr(database, "_indexes_ready", set())
+    monkeypatch.setattr(database, "_index_failures", {})
+    monkeypatch.setattr(database, "_index_tasks", {})
+    return client[database.DB_NAME]
+
+
+@pytest.fixture
+def local_storage(tmp_path, monkeypatch):
+    """A LocalStorage in a temporary directory, used as the configured backend"""
+    import storage
+
+    backend = storage.LocalStorage(tmp_path)
+    monkeypatch.setattr(storage, "_backend", backend)
+    return backend
+
+
+@pytest.fixture
+async def api(mongo, local_storage):
+    """An HTTP client for the API app, without its startup hooks"""
+    import httpx
+    from server import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+        yield client
+
+
+@pytest.fixture
+async def patient(mongo):
+    """A patient account and the Authorization header of its access token"""
+    import auth
+
+    result = await mongo["users"].insert_one({
+        "full_name": "Test Patient",
+        "email": "patient@example.com",
+        "age": 54,
+        "role": "patient",
+        "approval_status": "approved",
+        "is_active": True,
+    })
+    token = auth.create_access_token(str(result.inserted_id), "patient")
+    return {"id": str(result.inserted_id), "headers": {"Authorization": f"Bearer {token}"}}
@@ -0,0 +1,68 @@
+import io
+import json
+import zipfile
+import pytest
+import bulk_import
+import storage
+
+pytestmark = pytest.mark.anyio
+
+
+async def _import(mongo, count):
+    from server import SubmissionImportRow
+
+    patient = await mongo["users"].insert_one(
+        {"email": "patient@example.com", "full_name": "Patient", "role": "patient"}
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for number in range(count):
+            archive.writestr(f"tongue-{number}.jpg", b"\xff\xd8\xff\xe0 image %d" % number)
+
+    async def lines():
+        for number in range(count):
+            row = {
+                "patient_id": str(patient.inserted_id),
+                "blood_glucose": 110,
+                "hba1c": 6.1,
+                "diabetes_type": "Type 2",
+                "tongue_image": f"tongue-{number}.jpg",
+            }
+            yield number + 1, json.dumps(row).encode()
+
+    with zipfile.ZipFile(buffer) as archive:
+        return await bulk_import.import_submissions(lines(), SubmissionImportRow, archive)
+
+
+async def test_interrupted_insert_releases_unsaved_images(mongo, local_storage, monkeypatch):
+    collection = type(mongo["submissions"])
+
+    async def insert_then_fail(self, docs, **kwargs):
+        # The first document lands before the connection drops
+        await self.insert_one(docs[0])
+        raise ConnectionError("connection reset")
+
+    monkeypatch.setattr(collection, "insert_many", insert_then_fail)
+
+    with pytest.raises(ConnectionError):
+        await _import(mongo, 3)
+
+    saved = await mongo["submissions"].find_one({})
+    refcounts = {blob["_id"]: blob["refcount"] async for blob in storage._blobs().find({})}
+    assert len(refcounts) == 3
+    assert refcounts.pop(saved["tongue_image_filename"]) == 1
+    assert set(refcounts.values()) == {0}
+
+
+async def test_imported_submissions_get_follow_up_jobs(mongo, local_storage, monkeypatch):
+    import features
+
+    monkeypatch.setattr(features, "is_available", lambda: True)
+
+    report = await _import(mongo, 2)
+
+    assert report.inserted == 2
+    jobs = [(job["kind"], job["payload"]["image"]) async for job in mongo["jobs"].find({})]
+    images = [doc["tongue_image_filename"] async for doc in mongo["submissions"].find({})]
+    expected = [(kind, image) for image in images for kind in ("thumbnails", "tongue_features")]
+    assert sorted(jobs) == sorted(expected)
@@ -0,0 +1,43 @@
+import asyncio
+import pytest
+import database
+
+pytestmark = pytest.mark.anyio
+
+
+async def _settle():
+    await asyncio.gather(*database._index_tasks.values())
+
+
+async def test_first_use_builds_the_collections_indexes(mongo):
+
+    database.get_collection("rate_limits")
+    database.get_collection("rate_limits")
+    await _settle()
+
+    assert list(database._index_tasks) == ["rate_limits"]
+    assert database._indexes_ready == {"rate_limits"}
+    indexes = await mongo["rate_limits"].index_information()
+    assert indexes["expires_ttl"]["expireAfterSeconds"] == 0
+
+
+async def test_failed_build_is_retried_after_the_retry_interval(mongo, monkeypatch):
+    attempts = []
+
+    async def failing_create_index(collection_name, keys, options):
+        attempts.append(options["name"])
+        return False
+
+    monkeypatch.setattr(database, "_create_index", failing_create_index)
+
+    database.get_collection("rate_limits")
+    await _settle()
+    database.get_collection("rate_limits")
+    await _settle()
+    assert attempts == ["expires_ttl"]
+
+    monkeypatch.setitem(database._index_failures, "rate_limits", -database.INDEX_RETRY_SECONDS * 2)
+    database.get_collection("rate_limits")
+    await _settle()
+    assert attempts == ["expires_ttl", "expires_ttl"]
+    assert "rate_limits" not in database._indexes_ready
@@ -0,0 +1,60 @@
+import pytest
+from fastapi import HTTPException
+import images
+
+SIZE = 1000
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-499", (0, 499)),
+    ("bytes=500-", (500, 999)),
+    ("bytes=999-999", (999, 999)),
+    ("bytes=0-", (0, 999)),
+    # The end is clamped to the last byte
+    ("bytes=900-5000", (900, 999)),
+    # Suffix ranges: the last N bytes, all of them if N exceeds the size
+    ("bytes=-100", (900, 999)),
+    ("bytes=-1", (999, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("  bytes=0-0  ", (0, 0)),
+])
+def test_satisfiable_ranges(header, expected):
+    assert images.parse_range(header, SIZE) == expected
+
+
+@pytest.mark.parametrize("header", [
+    "bytes=-",
+    "bytes=0-1,5-9",  # Multi-range requests get the whole image
+    "bytes=500-100",  # last < first is syntactically invalid
+    "items=0-10",
+    "bytes=a-b",
+    "",
+])
+def test_ignored_ranges(header):
+    assert images.parse_range(header, SIZE) is None
+
+
+@pytest.mark.parametrize("header, size", [
+    ("bytes=1000-", SIZE),
+    ("bytes=1000-1200", SIZE),
+    ("bytes=-0", SIZE),
+    ("bytes=0-", 0),
+    ("bytes=-10", 0),
+])
+def test_unsatisfiable_ranges(header, size):
+    with pytest.raises(HTTPException) as error:
+        images.parse_range(header, size)
+    assert error.value.status_code == 416
+    assert error.value.headers["Content-Range"] == f"bytes */{size}"
+
+
+@pytest.mark.parametrize("header, matches", [
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"other", "abc"', True),
+    ("*", True),
+    ('"other"', False),
+    ('"ab"', False),
+])
+def test_etag_matches(header, matches):
+    assert images.etag_matches(header, '"abc"') is matches
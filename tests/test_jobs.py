@@ -0,0 +1,133 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+import jobs
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_serverless_enqueue_is_skipped_without_an_external_worker(mongo, monkeypatch):
+    monkeypatch.setattr(jobs, "is_serverless", lambda: True)
+
+    assert await jobs.enqueue("echo", {}) is None
+    assert await mongo["jobs"].count_documents({}) == 0
+
+    monkeypatch.setattr(jobs, "JOB_EXTERNAL_WORKERS", True)
+    job_id = await jobs.enqueue("echo", {})
+
+    assert (await mongo["jobs"].find_one({"_id": job_id}))["status"] == "queued"
+
+
+@pytest.fixture
+def handlers(monkeypatch):
+    """An empty handler registry the tests fill in"""
+    registry = {}
+    monkeypatch.setattr(jobs, "_handlers", registry)
+    return registry
+
+
+async def _expire_lease(mongo, job_id):
+    await mongo["jobs"].update_one(
+        {"_id": job_id}, {"$set": {"run_at": datetime.now(timezone.utc) - timedelta(seconds=1)}}
+    )
+
+
+def _aware(value):
+    # mongomock, like pymongo by default, may return naive UTC datetimes
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+async def test_claim_leases_the_due_job(mongo, handlers):
+    handlers["echo"] = None
+    later = await jobs.enqueue("echo", {"n": 2}, delay=60)
+    due = await jobs.enqueue("echo", {"n": 1})
+
+    job = await jobs.claim("worker-a")
+
+    assert job["_id"] == due
+    assert (job["status"], job["attempts"], job["worker"]) == ("running", 1, "worker-a")
+    assert job["lease"]
+    # The other job is not due yet, and the claimed one is leased
+    assert await jobs.claim("worker-b") is None
+    assert (await mongo["jobs"].find_one({"_id": later}))["status"] == "queued"
+
+
+async def test_expired_lease_is_taken_over(mongo, handlers):
+    ran = []
+
+    async def echo(payload):
+        ran.append(payload)
+
+    handlers["echo"] = echo
+    job_id = await jobs.enqueue("echo", {"n": 1})
+    first = await jobs.claim("worker-a")
+    await _expire_lease(mongo, job_id)
+
+    second = await jobs.claim("worker-b")
+
+    assert second["_id"] == job_id
+    assert second["attempts"] == 2
+    assert second["lease"] != first["lease"]
+    # The first worker finishing late does not overwrite the new lease
+    await jobs.run_job(first)
+    stored = await mongo["jobs"].find_one({"_id": job_id})
+    assert (stored["status"], stored["lease"]) == ("running", second["lease"])
+    await jobs.run_job(second)
+    assert (await mongo["jobs"].find_one({"_id": job_id}))["status"] == "done"
+    assert ran == [{"n": 1}, {"n": 1}]
+
+
+async def test_failed_job_is_retried_with_backoff_then_failed(mongo, handlers, monkeypatch):
+    async def broken(payload):
+        raise ValueError("bad payload")
+
+    handlers["broken"] = broken
+    monkeypatch.setattr(jobs.random, "uniform", lambda low, high: high)
+    job_id = await jobs.enqueue("broken", {}, max_attempts=2)
+
+    # BSON keeps milliseconds
+    started = datetime.now(timezone.utc).replace(microsecond=0)
+    await jobs.run_job(await jobs.claim("worker-a"))
+
+    stored = await mongo["jobs"].find_one({"_id": job_id})
+    assert stored["status"] == "queued"
+    assert stored["last_error"] == "ValueError: bad payload"
+    assert _aware(stored["run_at"]) >= started + timedelta(seconds=jobs.JOB_RETRY_BASE_SECONDS)
+    assert await jobs.claim("worker-a") is None
+
+    await _expire_lease(mongo, job_id)
+    await jobs.run_job(await jobs.claim("worker-a"))
+
+    stored = await mongo["jobs"].find_one({"_id": job_id})
+    assert (stored["status"], stored["attempts"]) == ("failed", 2)
+    assert "expires_at" in stored
+
+
+def test_retry_delay_doubles_up_to_the_maximum(monkeypatch):
+    monkeypatch.setattr(jobs.random, "uniform", lambda low, high: high)
+
+    delays = [jobs.retry_delay(attempts) for attempts in (1, 2, 3)]
+
+    assert delays == [jobs.JOB_RETRY_BASE_SECONDS * factor for factor in (1, 2, 4)]
+    assert jobs.retry_delay(100) == jobs.JOB_RETRY_MAX_SECONDS
+
+
+async def test_lost_last_attempt_is_marked_failed(mongo, handlers):
+    handlers["echo"] = None
+    job_id = await jobs.enqueue("echo", {}, max_attempts=1)
+    await jobs.claim("worker-a")
+    await _expire_lease(mongo, job_id)
+
+    assert await jobs.claim("worker-b") is None
+    assert await jobs.fail_abandoned() == 1
+
+    stored = await mongo["jobs"].find_one({"_id": job_id})
+    assert stored["status"] == "failed"
+    assert stored["last_error"] == "Worker lost during the last attempt"
+
+
+async def test_enqueue_with_a_known_key_returns_the_existing_job(mongo):
+    first = await jobs.enqueue("echo", {"n": 1}, key="echo:1")
+    second = await jobs.enqueue("echo", {"n": 2}, key="echo:1")
+
+    assert second == first
+    assert await mongo["jobs"].count_documents({}) == 1
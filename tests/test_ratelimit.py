@@ -0,0 +1,82 @@
+import types
+from datetime import timedelta
+import pytest
+import ratelimit
+
+pytestmark = pytest.mark.anyio
+
+# Two attempts per burst, refilled at one every two seconds
+BUCKET = ratelimit.TokenBucket("test", 2, 30)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A monotonic clock for the memory backend that only moves when told to"""
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(ratelimit, "time", types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+async def test_memory_bucket_denies_when_empty_and_refills_over_time(clock):
+    backend = ratelimit.MemoryBackend()
+
+    assert await backend.take(BUCKET, "k") == (True, 0.0)
+    assert await backend.take(BUCKET, "k") == (True, 0.0)
+    assert await backend.take(BUCKET, "k") == (False, pytest.approx(2.0))
+    # Half a token back: still denied, the wait shrinks accordingly
+    clock.now += 1
+    assert await backend.take(BUCKET, "k") == (False, pytest.approx(1.0))
+    clock.now += 1
+    assert await backend.take(BUCKET, "k") == (True, 0.0)
+    # Refills never exceed the capacity
+    clock.now += 3600
+    results = [(await backend.take(BUCKET, "k"))[0] for _ in range(3)]
+    assert results == [True, True, False]
+    # Keys are limited separately
+    assert (await backend.take(BUCKET, "other"))[0]
+
+
+async def test_memory_backend_evicts_the_least_recently_used_key(clock):
+    backend = ratelimit.MemoryBackend(max_keys=2)
+    for key in ("a", "b"):
+        await backend.take(BUCKET, key)
+        await backend.take(BUCKET, key)
+    await backend.take(BUCKET, "a")
+
+    await backend.take(BUCKET, "c")
+
+    assert list(backend._buckets) == [("test", "a"), ("test", "c")]
+
+
+async def test_mongo_bucket_denies_when_empty_and_refills_over_time(mongo):
+    backend = ratelimit.MongoBackend()
+
+    assert await backend.take(BUCKET, "k") == (True, 0.0)
+    assert await backend.take(BUCKET, "k") == (True, 0.0)
+    allowed, retry_after = await backend.take(BUCKET, "k")
+    assert not allowed
+    assert retry_after == pytest.approx(2.0, abs=0.1)
+
+    # Two seconds pass: one token is back
+    doc = await mongo["rate_limits"].find_one({"_id": "test:k"})
+    await mongo["rate_limits"].update_one(
+        {"_id": "test:k"}, {"$set": {"updated_at": doc["updated_at"] - timedelta(seconds=2)}}
+    )
+    assert (await backend.take(BUCKET, "k"))[0]
+    assert not (await backend.take(BUCKET, "k"))[0]
+
+    doc = await mongo["rate_limits"].find_one({"_id": "test:k"})
+    assert doc["expires_at"] - doc["updated_at"] == timedelta(seconds=4)
+
+
+async def test_throttled_login_is_429_with_retry_after(api, monkeypatch):
+    monkeypatch.setattr(ratelimit, "_backend", ratelimit.MemoryBackend())
+    monkeypatch.setattr(ratelimit, "LOGIN_EMAIL", BUCKET)
+    credentials = {"email": "someone@example.com", "password": "wrong-password"}
+
+    for _ in range(2):
+        assert (await api.post("/api/login", json=credentials)).status_code == 401
+    response = await api.post("/api/login", json=credentials)
+
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "2"
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+import search
+
+pytestmark = pytest.mark.anyio
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+async def _seed(mongo, count):
+    await mongo["submissions"].insert_many([
+        {
+            "created_at": START + timedelta(minutes=index),
+            "diabetes_type": "Type 2" if index % 3 else "Type 1",
+            "blood_glucose": 90 + index,
+            "hba1c": 6.0,
+            "symptoms": ["Fatigue"],
+            "medications": [],
+        }
+        for index in range(count)
+    ])
+
+
+async def test_small_result_is_counted_exactly(mongo, monkeypatch):
+    monkeypatch.setattr(search, "SEARCH_COUNT_LIMIT", 20)
+    await _seed(mongo, 20)
+
+    docs, total, capped, facets = await search.search(mongo["submissions"], {}, limit=5)
+
+    assert (len(docs), total, capped) == (5, 20, False)
+    assert sum(row["count"] for row in facets["diabetes_type"]) == 20
+    assert docs[0]["created_at"].replace(tzinfo=timezone.utc) == START + timedelta(minutes=19)
+
+
+async def test_broad_search_counts_and_facets_the_newest_matches_only(mongo, monkeypatch):
+    monkeypatch.setattr(search, "SEARCH_COUNT_LIMIT", 20)
+    await _seed(mongo, 50)
+
+    docs, total, capped, facets = await search.search(mongo["submissions"], {}, limit=5)
+
+    assert (total, capped) == (20, True)
+    assert facets["symptoms"] == [{"value": "Fatigue", "count": 20}]
+    # The newest 20 have blood glucose 120..139
+    assert {bucket["min"]: bucket["count"] for bucket in facets["blood_glucose"]}[100] == 6
+    assert {bucket["min"]: bucket["count"] for bucket in facets["blood_glucose"]}[126] == 14
+
+
+async def test_deep_page_stays_inside_the_counted_matches(mongo, monkeypatch):
+    monkeypatch.setattr(search, "SEARCH_COUNT_LIMIT", 20)
+    await _seed(mongo, 50)
+
+    docs, total, capped, _ = await search.search(mongo["submissions"], {}, limit=10, offset=25)
+
+    assert len(docs) == 10
+    assert (total, capped) == (35, True)
@@ -0,0 +1,121 @@
+import io
+import pytest
+from PIL import Image
+import stats
+import storage
+
+pytestmark = pytest.mark.anyio
+
+
+def _jpeg():
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 32), (190, 60, 70)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def _form():
+    return {"blood_glucose": "120", "hba1c": "6.4", "diabetes_type": "Type 2"}
+
+
+async def test_bookkeeping_failure_keeps_the_saved_submission(api, patient, mongo, monkeypatch):
+    async def stats_down(**counters):
+        raise RuntimeError("stats down")
+
+    monkeypatch.setattr(stats, "increment", stats_down)
+
+    response = await api.post(
+        "/api/submissions", headers=patient["headers"], data=_form(),
+        files={"tongue_image": ("tongue.jpg", _jpeg(), "image/jpeg")},
+    )
+
+    assert response.status_code == 200
+    doc = await mongo["submissions"].find_one({})
+    blob = await storage._blobs().find_one({"_id": doc["tongue_image_filename"]})
+    assert blob["refcount"] == 1
+    # The version bump still went through
+    assert (await mongo["collection_versions"].find_one({"_id": "submissions"}))["version"] == 1
+
+
+async def test_failed_insert_releases_the_image(api, patient, mongo, monkeypatch):
+    collection = type(mongo["submissions"])
+
+    async def insert_down(self, *args, **kwargs):
+        raise RuntimeError("insert down")
+
+    monkeypatch.setattr(collection, "insert_one", insert_down)
+
+    response = await api.post(
+        "/api/submissions", headers=patient["headers"], data=_form(),
+        files={"tongue_image": ("tongue.jpg", _jpeg(), "image/jpeg")},
+    )
+
+    assert response.status_code == 500
+    blob = await storage._blobs().find_one({})
+    assert blob["refcount"] == 0
+
+
+async def test_undecodable_image_variant_redirects_to_the_original(api, local_storage, monkeypatch):
+    import thumbnails
+    from concurrent.futures import ThreadPoolExecutor
+
+    monkeypatch.setattr(thumbnails._pool, "_executor", ThreadPoolExecutor(max_workers=1))
+    name = f"{'d' * 64}.jpg"
+    (local_storage.root / name).write_bytes(b"not an image")
+
+    response = await api.get(f"/api/images/{name}?variant=128")
+
+    assert response.status_code == 307
+    assert response.headers["location"] == f"http://testserver/api/images/{name}"
+    assert response.headers["cache-control"] == "no-store"
+    original = await api.get(response.headers["location"])
+    assert original.content == b"not an image"
+
+
+async def test_columnar_export_without_pyarrow_is_501(api, mongo, monkeypatch):
+    import auth
+    import export
+
+    monkeypatch.setattr(export, "is_columnar_available", lambda: False)
+    token = auth.create_access_token("0" * 24, "admin")
+
+    response = await api.get(
+        "/api/admin/export-data?format=parquet", headers={"Authorization": f"Bearer {token}"}
+    )
+
+    assert response.status_code == 501
+
+
+async def test_reenabling_a_user_keeps_their_old_tokens_revoked(api, patient, monkeypatch):
+    import types
+    import auth
+
+    admin = {"Authorization": f"Bearer {auth.create_access_token('0' * 24, 'admin')}"}
+    clock = types.SimpleNamespace(time=lambda: 1_000_000_000)
+    monkeypatch.setattr(auth, "time", clock)
+    old_token = auth.create_access_token(patient["id"], "patient")
+    status_url = f"/api/admin/users/{patient['id']}/status"
+
+    clock.time = lambda: 1_000_000_010
+    assert (await api.post(status_url, params={"active": "false"}, headers=admin)).status_code == 200
+    clock.time = lambda: 1_000_000_020
+    assert (await api.post(status_url, params={"active": "true"}, headers=admin)).status_code == 200
+
+    response = await api.get("/api/submissions", headers={"Authorization": f"Bearer {old_token}"})
+    assert response.status_code == 401
+    # Tokens issued after the revocation are accepted again
+    response = await api.get("/api/submissions", headers=patient["headers"])
+    assert response.status_code == 200
+
+
+async def test_form_field_that_is_not_utf8_is_400(api, patient, mongo):
+    response = await api.post(
+        "/api/submissions", headers=patient["headers"],
+        files={
+            "tongue_image": ("tongue.jpg", _jpeg(), "image/jpeg"),
+            "blood_glucose": (None, b"\xff\xfe120"),
+        },
+    )
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Field 'blood_glucose' is not valid UTF-8"
+    assert await mongo["submissions"].count_documents({}) == 0
@@ -0,0 +1,217 @@
+import io
+import json
+import os
+import time
+import zipfile
+from datetime import datetime, timedelta, timezone
+import pytest
+import storage
+
+pytestmark = pytest.mark.anyio
+
+NAME = f"{'a' * 64}.jpg"
+
+
+def _age(path, seconds):
+    """Backdate a file's modification time"""
+    stamp = time.time() - seconds
+    os.utime(path, (stamp, stamp))
+
+
+async def _store_unreferenced(backend, name=NAME, content=b"image"):
+    """A blob whose last reference was dropped before the grace period"""
+    (backend.root / name).write_bytes(content)
+    _age(backend.root / name, storage.IMAGE_GC_GRACE_SECONDS + 60)
+    stale = datetime.now(timezone.utc) - timedelta(seconds=storage.IMAGE_GC_GRACE_SECONDS + 60)
+    await storage._blobs().insert_one({"_id": name, "refcount": 0, "updated_at": stale})
+
+
+class FailingUpload:
+    async def commit(self, name):
+        raise OSError("disk full")
+
+
+async def test_unreferenced_blob_is_collected(mongo, local_storage):
+    await _store_unreferenced(local_storage)
+
+    assert await storage.collect_garbage() == 1
+    assert not (local_storage.root / NAME).exists()
+    assert not (local_storage.root / f".{NAME}.gc").exists()
+    assert await storage._blobs().find_one({"_id": NAME}) is None
+
+
+async def test_recently_released_blob_is_kept(mongo, local_storage):
+    (local_storage.root / NAME).write_bytes(b"image")
+    await storage.acquire(NAME, 5, "image/jpeg")
+    await storage.release(NAME)
+
+    assert await storage.collect_garbage() == 0
+    assert (local_storage.root / NAME).exists()
+
+
+async def test_upload_during_sweep_restores_quarantined_blob(mongo, local_storage, monkeypatch):
+    await _store_unreferenced(local_storage)
+    quarantine = local_storage.quarantine
+
+    async def quarantine_then_upload(name):
+        moved = await quarantine(name)
+        # An identical upload references the blob between quarantine and delete
+        await storage.acquire(name, 5, "image/jpeg")
+        return moved
+
+    monkeypatch.setattr(local_storage, "quarantine", quarantine_then_upload)
+
+    assert await storage.collect_garbage() == 0
+    assert (local_storage.root / NAME).read_bytes() == b"image"
+    assert not (local_storage.root / f".{NAME}.gc").exists()
+    blob = await storage._blobs().find_one({"_id": NAME})
+    assert blob["refcount"] == 1
+
+
+async def test_upload_rewriting_blob_during_sweep_keeps_new_copy(mongo, local_storage, monkeypatch):
+    await _store_unreferenced(local_storage)
+    quarantine = local_storage.quarantine
+
+    async def quarantine_then_upload(name):
+        moved = await quarantine(name)
+        # The upload found the blob missing and stored the content again
+        await storage.acquire(name, 5, "image/jpeg")
+        (local_storage.root / name).write_bytes(b"image")
+        return moved
+
+    monkeypatch.setattr(local_storage, "quarantine", quarantine_then_upload)
+
+    assert await storage.collect_garbage() == 0
+    assert (local_storage.root / NAME).read_bytes() == b"image"
+    assert not (local_storage.root / f".{NAME}.gc").exists()
+
+
+async def test_orphans_and_leftovers_are_collected(mongo, local_storage):
+    orphan = f"{'b' * 64}.png"
+    leftover = ".upload.jpg.part"
+    recent = f"{'c' * 64}.png"
+    for name in (orphan, leftover, recent):
+        (local_storage.root / name).write_bytes(b"x")
+    _age(local_storage.root / orphan, storage.IMAGE_GC_GRACE_SECONDS + 60)
+    _age(local_storage.root / leftover, storage.IMAGE_GC_GRACE_SECONDS + 60)
+
+    assert await storage.collect_garbage() == 2
+    assert sorted(os.listdir(local_storage.root)) == [recent]
+
+
+async def test_commit_upload_releases_reference_when_write_fails(mongo, local_storage):
+    image = {"sha256": "a" * 64, "extension": ".jpg", "size": 5, "content_type": "image/jpeg",
+             "upload": FailingUpload()}
+
+    with pytest.raises(OSError):
+        await storage.commit_upload(image)
+
+    blob = await storage._blobs().find_one({"_id": NAME})
+    assert blob["refcount"] == 0
+
+
+async def test_failed_import_insert_releases_image_reference(mongo, local_storage):
+    import bulk_import
+    from server import SubmissionImportRow
+
+    patient = await mongo["users"].insert_one(
+        {"email": "patient@example.com", "full_name": "Patient", "role": "patient"}
+    )
+    await mongo["submissions"].create_index("external_id", unique=True, name="external_id_unique")
+    await mongo["submissions"].insert_one({"external_id": "visit-1"})
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("tongue.jpg", b"\xff\xd8\xff\xe0 tongue image")
+    row = {
+        "patient_id": str(patient.inserted_id),
+        "blood_glucose": 110,
+        "hba1c": 6.1,
+        "diabetes_type": "Type 2",
+        "tongue_image": "tongue.jpg",
+    }
+    rows = [{**row, "external_id": "visit-1"}, {**row, "external_id": "visit-2"}]
+
+    async def lines():
+        for number, row in enumerate(rows, 1):
+            yield number, json.dumps(row).encode()
+
+    with zipfile.ZipFile(buffer) as archive:
+        report = await bulk_import.import_submissions(lines(), SubmissionImportRow, archive)
+
+    assert (report.inserted, report.failed) == (1, 1)
+    assert report.errors[0]["errors"][0]["message"] == "Duplicate external_id"
+    # Both rows acquired the shared blob; only the inserted one keeps its reference
+    blob = await storage._blobs().find_one({})
+    assert blob["refcount"] == 1
+
+
+class FakeS3:
+    """The parts of S3Storage an S3Upload uses, recording every call"""
+
+    bucket = "bucket"
+
+    def __init__(self):
+        self.calls = []
+        self.objects = {}
+
+    def key(self, name):
+        return name
+
+    async def stat(self, name):
+        return {"size": len(self.objects[name])} if name in self.objects else None
+
+    async def call(self, method, **kwargs):
+        body = kwargs.get("Body")
+        if body is not None:
+            # Memory use while the part was filled
+            kwargs["in_memory"] = not getattr(body, "_rolled", True)
+            kwargs["Body"] = body.read()
+        self.calls.append((method, kwargs))
+        if method == "put_object":
+            self.objects[kwargs["Key"]] = kwargs["Body"]
+        elif method == "create_multipart_upload":
+            return {"UploadId": "upload-1"}
+        elif method == "upload_part":
+            return {"ETag": f"etag-{kwargs['PartNumber']}"}
+        elif method == "copy_object":
+            self.objects[kwargs["Key"]] = b"copied"
+        return {}
+
+
+async def _stream(upload, total, chunk_size=64 * 1024):
+    written = 0
+    while written < total:
+        size = min(chunk_size, total - written)
+        await upload.write(b"x" * size)
+        written += size
+
+
+async def test_small_s3_upload_is_one_put(monkeypatch):
+    monkeypatch.setattr(storage, "S3_SPOOL_MEMORY_BYTES", 1024)
+    s3 = FakeS3()
+    upload = storage.S3Upload(s3, ".jpg", "image/jpeg")
+
+    await _stream(upload, 300 * 1024)
+    await upload.commit(NAME)
+
+    [(method, kwargs)] = s3.calls
+    assert method == "put_object" and kwargs["Key"] == NAME
+    assert len(kwargs["Body"]) == 300 * 1024
+    assert kwargs["in_memory"] is False
+
+
+async def test_large_s3_upload_spools_each_part(monkeypatch):
+    monkeypatch.setattr(storage, "S3_PART_SIZE", 256 * 1024)
+    monkeypatch.setattr(storage, "S3_SPOOL_MEMORY_BYTES", 1024)
+    s3 = FakeS3()
+    upload = storage.S3Upload(s3, ".jpg", "image/jpeg")
+
+    await _stream(upload, 600 * 1024)
+    await upload.commit(NAME)
+
+    parts = [kwargs for method, kwargs in s3.calls if method == "upload_part"]
+    assert [len(part["Body"]) for part in parts] == [256 * 1024, 256 * 1024, 88 * 1024]
+    assert not any(part["in_memory"] for part in parts)
+    complete = next(kwargs for method, kwargs in s3.calls if method == "complete_multipart_upload")
+    assert [part["PartNumber"] for part in complete["MultipartUpload"]["Parts"]] == [1, 2, 3]
+    assert [method for method, _ in s3.calls][-2:] == ["copy_object", "delete_object"]
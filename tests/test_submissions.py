@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+import submissions
+
+pytestmark = pytest.mark.anyio
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+PROJECTION = {"created_at": 1}
+
+
+async def _insert(mongo, created_ats):
+    docs = [{"_id": ObjectId(), "created_at": created_at} for created_at in created_ats]
+    await mongo["submissions"].insert_many(docs)
+    # Expected listing order: newest first, ties by descending _id
+    return [doc["_id"] for doc in sorted(docs, key=lambda doc: (doc["created_at"], doc["_id"]), reverse=True)]
+
+
+async def _walk(collection, limit, **filters):
+    ids = []
+    cursor = None
+    # Bounded, so a cursor that stops advancing fails instead of hanging
+    for _ in range(100):
+        query = submissions.build_query(cursor=cursor, **filters)
+        docs, cursor = await submissions.fetch_page(collection, query, PROJECTION, limit)
+        ids.extend(doc["_id"] for doc in docs)
+        if cursor is None:
+            return ids
+    pytest.fail("Pagination did not reach the last page")
+
+
+async def test_pages_split_inside_a_run_of_equal_timestamps(mongo):
+    # Five submissions share a timestamp, so pages of two end inside the run
+    expected = await _insert(mongo, [START] * 5 + [START + timedelta(minutes=1), START - timedelta(minutes=1)])
+
+    assert await _walk(mongo["submissions"], 2) == expected
+
+
+async def test_last_full_page_has_no_next_cursor(mongo):
+    await _insert(mongo, [START + timedelta(seconds=second) for second in range(4)])
+
+    docs, next_cursor = await submissions.fetch_page(mongo["submissions"], {}, PROJECTION, 4)
+
+    assert len(docs) == 4
+    assert next_cursor is None
+
+
+async def test_cursor_respects_created_range(mongo):
+    expected = await _insert(mongo, [START + timedelta(days=day) for day in range(6)])
+
+    ids = await _walk(mongo["submissions"], 2, created_from=START + timedelta(days=1),
+                      created_to=START + timedelta(days=5))
+
+    assert ids == expected[1:5]
+
+
+def test_cursor_round_trip():
+    doc = {"_id": ObjectId(), "created_at": START + timedelta(microseconds=1)}
+
+    assert submissions.decode_cursor(submissions.encode_cursor(doc)) == (doc["created_at"], doc["_id"])
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "MjAyNC0wMS0wMQ", "fHw"])
+def test_invalid_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as error:
+        submissions.build_query(cursor=cursor)
+    assert error.value.status_code == 400
+
+
+async def test_patient_search_pages_through_matches_only(mongo):
+    docs = [
+        {"_id": ObjectId(), "created_at": START + timedelta(minutes=minute),
+         "patient_name": name, "patient_email": f"{name.split()[0].lower()}@example.com"}
+        for minute, name in enumerate(["Ana Ruiz", "Ben Okafor", "Ana Ruiz", "Cy Ng", "Ana Ruiz", "Ben (A+) Roy"])
+    ]
+    await mongo["submissions"].insert_many(docs)
+
+    ids = await _walk(mongo["submissions"], 2, patient_search="ANA")
+    escaped = await _walk(mongo["submissions"], 2, patient_search="(a+)")
+
+    assert ids == [docs[4]["_id"], docs[2]["_id"], docs[0]["_id"]]
+    assert escaped == [docs[5]["_id"]]
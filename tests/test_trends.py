@@ -0,0 +1,94 @@
+import sys
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import pytest
+import trends
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def _series(count):
+    x = np.arange(count, dtype=np.float64)
+    return x, np.sin(x / 3.0)
+
+
+@pytest.mark.parametrize("count, threshold", [(10, 10), (10, 50), (10, 2), (10, 0), (0, 5), (1, 5)])
+def test_short_series_or_tiny_threshold_keeps_every_point(count, threshold):
+    x, y = _series(count)
+
+    assert list(trends.lttb_indices(x, y, threshold)) == list(range(count))
+
+
+@pytest.mark.parametrize("count, threshold", [(4, 3), (11, 10), (100, 3), (100, 7), (1000, 100), (1001, 100)])
+def test_one_point_per_bucket_between_the_endpoints(count, threshold):
+    x, y = _series(count)
+
+    selected = trends.lttb_indices(x, y, threshold)
+
+    assert len(selected) == threshold
+    assert selected[0] == 0
+    assert selected[-1] == count - 1
+    assert all(np.diff(selected) > 0)
+    # Each middle point comes from its own bucket of the interior points
+    edges = np.floor(np.linspace(1, count - 1, threshold - 1)).astype(np.int64)
+    for bucket, index in enumerate(selected[1:-1]):
+        assert edges[bucket] <= index < edges[bucket + 1]
+
+
+def test_spikes_are_kept():
+    x = np.arange(500, dtype=np.float64)
+    y = np.full(500, 100.0)
+    y[137] = 400.0
+    y[362] = 20.0
+
+    selected = set(trends.lttb_indices(x, y, 20))
+
+    assert {137, 362} <= selected
+
+
+@pytest.mark.parametrize("count, threshold", [(4, 3), (11, 10), (100, 7), (1000, 100), (1001, 100), (5000, 333)])
+def test_pure_python_fallback_matches_numpy(count, threshold):
+    rng = np.random.default_rng(count)
+    x = np.cumsum(rng.uniform(1, 100, count))
+    y = rng.normal(120, 30, count)
+
+    expected = list(trends.lttb_indices(x, y, threshold))
+
+    assert trends._lttb_indices_python(list(x), list(y), threshold) == expected
+
+
+def test_downsample_without_numpy(monkeypatch):
+    points = [{"t": START + timedelta(hours=hour), "value": hour % 7} for hour in range(50)]
+    monkeypatch.setitem(sys.modules, "numpy", None)
+
+    reduced = trends.downsample(points, 10)
+
+    assert len(reduced) == 10
+    assert reduced[0] is points[0] and reduced[-1] is points[-1]
+
+
+def test_downsample_returns_original_points():
+    points = [{"t": START + timedelta(hours=hour), "value": float(hour % 7)} for hour in range(50)]
+
+    reduced = trends.downsample(points, 10)
+
+    assert len(reduced) == 10
+    assert reduced[0] is points[0] and reduced[-1] is points[-1]
+    assert trends.downsample(points, 50) is points
+
+
+@pytest.mark.anyio
+async def test_raw_trends_are_limited_to_max_points(mongo):
+    await mongo["submissions"].insert_many([
+        {"patient_id": "p1", "created_at": START + timedelta(hours=hour), "blood_glucose": 100 + hour % 13}
+        for hour in range(40)
+    ])
+
+    series = await trends.get_trends(mongo["submissions"], "p1", interval="raw", max_points=8)
+    latest = await trends.get_trends(mongo["submissions"], "p1", interval="raw", max_points=8, lttb=False)
+
+    assert len(series["blood_glucose"]) == 8
+    assert series["blood_glucose"][0]["t"] == START
+    assert series["blood_glucose"][-1]["t"] == START + timedelta(hours=39)
+    assert [point["t"] for point in latest["blood_glucose"]] == [START + timedelta(hours=hour) for hour in range(32, 40)]
+    assert series["hba1c"] == []